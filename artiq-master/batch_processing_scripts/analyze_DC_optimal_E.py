@@ -136,13 +136,11 @@ def analyze_data(data_matrix, param_name, scan_value):
 
 def get_actual_RF_amplitude(timestamp):
 
-    # Calculate data filepath
-    data_directory = "/home/electrons/software/data"
-    date, _ = timestamp.split("_")
-    path = f"{data_directory}/{date}/{timestamp}_act_RF_amplitude"
+    # Load data (run archive, or scan_result CSV of older runs)
+    _, ydata = load_data(timestamp, ynames=["act_RF_amplitude"])
+    data = np.asarray(ydata["act_RF_amplitude"], dtype=float)
 
     # Analyze data
-    data = np.genfromtxt(path, delimiter=",")
     data_nonzero = data[data != 0]
     mean, std = calculate_trimmed_mean(data_nonzero)
 
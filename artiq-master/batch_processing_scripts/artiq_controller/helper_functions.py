@@ -1,5 +1,7 @@
 import numpy as np
 import os
+import sys
+import sqlite3
 import pandas as pd
 from scipy.signal import find_peaks
 
@@ -9,20 +11,29 @@ import matplotlib.pyplot as plt
 
 from fitting_functions import fit_n_peaks, gaussian_sum, _extract_mus_from_popt
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../repository/helper_functions"))
+from run_archive import RunArchive, find_run_archive
+from run_catalog import RunCatalog
+
 # Utility Functions - Load_data
 # ===============================================
 
-def load_data(timestamp, ynames=["ratio_signal"]):
+def load_data(timestamp, ynames=["ratio_signal"], catalog=None):
     """
     Load data from the artiq data saving folders.
     1) INPUT ----------------------------------------
     timestamp:  str, which experiment you want to load data from
     ynames:     list, dataset name you want to load, use the same name as its dataset name in artiq
+    catalog:    open RunCatalog to look the configuration up in (see load_configuration)
     2) OUTPUT ---------------------------------------
     xdata:      np.ndarray, setpoint data (column = scanned parameter name from _conf)
     ydata:      dict {yname: np.ndarray}, datasets you want to load
     """
 
+    # Runs with a binary archive: read only the requested columns
+    if find_run_archive(timestamp) is not None:
+        return _load_data_from_archive(timestamp, ynames)
+
     date, _ = timestamp.split("_")
     basefilename = f"/home/electrons/software/data/{date}/{timestamp}"
     scan_path = f"{basefilename}_scan_result.csv"
@@ -33,7 +44,7 @@ def load_data(timestamp, ynames=["ratio_signal"]):
     # The CSV column for x-axis is the actual scanned parameter name (from _conf file)
     xdata = None
     if scan_df is not None:
-        scanning_parameter = load_configuration(timestamp, ["scanning_parameter"])[0]
+        scanning_parameter = load_configuration(timestamp, ["scanning_parameter"], catalog)[0]
         if scanning_parameter and scanning_parameter in scan_df.columns:
             xdata = scan_df[scanning_parameter].to_numpy()
 
@@ -47,16 +58,57 @@ def load_data(timestamp, ynames=["ratio_signal"]):
             raise FileNotFoundError(f"Dataset '{yname}' not found in scan/substep CSV outputs")
     return xdata, ydata
 
-def load_configuration(timestamp, conf_names=["U2"]):
+def _load_data_from_archive(timestamp, ynames):
+
+    with RunArchive.from_timestamp(timestamp) as run:
+
+        xdata = None
+        scanning_parameter = run.config("scanning_parameter")
+        if scanning_parameter and run.has_column(scanning_parameter):
+            xdata = np.array(run.column(scanning_parameter))
+
+        ydata = {}
+        for yname in ynames:
+            if run.has_column(yname):
+                ydata[yname] = np.array(run.column(yname))
+            elif run.has_column(yname, table="substep"):
+                ydata[yname] = np.array(run.column(yname, table="substep"))
+            else:
+                raise FileNotFoundError(f"Dataset '{yname}' not found in run archive {run.path}")
+
+    return xdata, ydata
+
+def load_configuration(timestamp, conf_names=["U2"], catalog=None):
     """
     Get parameter configurations from artiq.
     1) INPUT ----------------------------------------
     timestamp:  str, which experiment you want to load configuration from
     conf_names: list, configuration name you want to load, use the same name as its parameter name in artiq
+    catalog:    open RunCatalog (e.g. RunCatalog.open_existing() once for a batch of timestamps),
+                by default the run catalog is opened read-only if it exists
     2) OUTPUT  --------------------------------------
     list of the parameters you requested, in the same order as your conf_names
     """
-    
+
+    own_catalog = catalog is None
+    if own_catalog:
+        catalog = RunCatalog.open_existing()
+
+    if catalog is not None:
+        try:
+            if catalog.has_run(timestamp):
+                config = catalog.config(timestamp, conf_names)
+                return [config[name] for name in conf_names]
+        except sqlite3.Error as e:
+            print(f"Run catalog lookup failed ({e}), reading the run files instead")
+        finally:
+            if own_catalog:
+                catalog.close()
+
+    if find_run_archive(timestamp) is not None:
+        with RunArchive.from_timestamp(timestamp) as run:
+            return [run.config(name) for name in conf_names]
+
     date, _ = timestamp.split("_")
     filename = f"/home/electrons/software/data/{date}/{timestamp}_conf"
 
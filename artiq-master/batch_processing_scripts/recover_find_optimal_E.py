@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 """
 Recover FindOptimalE scan results after a crash by combining:
-1) *_conf files in /home/electrons/software/data/<DATE>/ to get U2 + RF_amplitude (and filter)
+1) the run catalog of /home/electrons/software/data/ to get U2 + RF_amplitude (and filter),
+   runs of <DATE> not in the catalog yet are indexed from their *_conf / *_run.h5 files first
 2) output_log.txt (your ArtiqController log) to get Best observed/model E for each timestamp
-3) (optional) per-run performance signals from data files (loading_signal, ratio_signal, ...)
+3) (optional) per-run performance signals from the catalog statistics, or the data files
 
 Outputs:
 - per_run.csv (one row per timestamp)
@@ -22,6 +23,7 @@ import argparse
 import csv
 import json
 import re
+import sys
 from pathlib import Path
 from typing import Dict, Tuple, Optional, List
 
@@ -30,6 +32,10 @@ import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 
+sys.path.append(str(Path(__file__).resolve().parent.parent / "repository" / "helper_functions"))
+from run_archive import RunArchive, find_run_archive
+from run_catalog import RunCatalog
+
 
 # -----------------------------
 # Parsing helpers
@@ -90,25 +96,6 @@ def parse_output_log(path: Path) -> Dict[str, dict]:
     return out
 
 
-def parse_conf_file(path: Path) -> Dict[str, str]:
-    """
-    Parses your *_conf format into {key: val_string}.
-    Only grabs the 'val =' line under each [section].
-    """
-    cur = None
-    out: Dict[str, str] = {}
-    for raw in path.read_text(encoding="utf-8", errors="replace").splitlines():
-        line = raw.strip()
-        if not line:
-            continue
-        if line.startswith("[") and line.endswith("]"):
-            cur = line.strip("[]").strip()
-            continue
-        if cur and line.startswith("val ="):
-            out[cur] = line.split("=", 1)[1].strip()
-    return out
-
-
 def safe_float(x: str) -> float:
     try:
         return float(x)
@@ -141,6 +128,12 @@ def trimmed_mean_std(arr: np.ndarray, trim_pct: float = 0.1, trim_min: int = 1)
 # Data loading (signals)
 # -----------------------------
 def load_1d_dataset(data_dir: Path, date: str, ts: str, name: str) -> np.ndarray:
+    # finished runs keep their datasets in the binary run archive
+    archive = find_run_archive(ts, str(data_dir))
+    if archive is not None:
+        with RunArchive(archive) as run:
+            return np.array(run.dataset(name), dtype=float)
+
     p = data_dir / date / f"{ts}_{name}"
     return np.genfromtxt(str(p), delimiter=",")  # delimiter ok even if none
 
@@ -226,25 +219,23 @@ def main():
     log_map = parse_output_log(out_log)
     print(f"[Info] Parsed {len(log_map)} timestamps from output_log")
 
-    # Find conf files for that date
-    conf_dir = data_dir / date
-    conf_files = sorted(conf_dir.glob(f"{date}_*_conf"))
-    print(f"[Info] Found {len(conf_files)} *_conf files in {conf_dir}")
+    # Find runs of that date in the catalog
+    catalog = RunCatalog(data_folder=str(data_dir))
+    added = catalog.index_date(date)
+    timestamps = catalog.find_runs(
+        date=date, after=ts_min,
+        RF_amplitude=(args.rf - args.rf_tol, args.rf + args.rf_tol),
+    )
+    print(f"[Info] Found {len(timestamps)} runs at RF_amplitude={args.rf} in the catalog ({added} newly indexed)")
 
     SIGNALS = ["loading_signal", "trapped_signal", "lost_signal", "ratio_signal", "ratio_lost"]
 
     per_run_rows = []
-    for cf in conf_files:
-        ts = cf.name.replace("_conf", "")
-        if ts < ts_min:
-            continue
+    for ts in timestamps:
+        conf = catalog.config(ts, ["RF_amplitude", "U2"])
+        rf = safe_float(conf["RF_amplitude"])
 
-        conf = parse_conf_file(cf)
-        rf = safe_float(conf.get("RF_amplitude", "nan"))
-        if not np.isfinite(rf) or abs(rf - args.rf) > args.rf_tol:
-            continue
-
-        u2 = safe_float(conf.get("U2", "nan"))
+        u2 = safe_float(conf["U2"])
         if not np.isfinite(u2):
             continue
 
@@ -260,7 +251,11 @@ def main():
         row.update(log_map[ts])
 
         if not args.no_signals:
+            stats = catalog.statistics(ts)
             for s in SIGNALS:
+                if s in stats and stats[s]["max"] is not None:
+                    row[s] = stats[s]["max"]  # same as signal_summary
+                    continue
                 try:
                     arr = load_1d_dataset(data_dir, date, ts, s)
                     row[s] = signal_summary(arr)
@@ -269,6 +264,8 @@ def main():
 
         per_run_rows.append(row)
 
+    catalog.close()
+
     if not per_run_rows:
         raise SystemExit("No matching runs found. Check --date/--after/--rf and paths.")
 
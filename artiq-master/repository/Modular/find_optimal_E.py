@@ -7,7 +7,7 @@ import os
 sys.path.append("/home/electrons/software/Electrons_Artiq_Sequences/artiq-master/repository/helper_functions")
 from build_functions   import optimizer_build
 from prepare_functions import optimizer_prepare
-from run_functions     import initial_sampling, bo_sampling, run_experiment_with_retries
+from run_functions     import initial_sampling, bo_sampling, bo_sampling_batch, run_experiment_with_retries
 from analyze_functions import optimizer_analyze
 
 class FindOptimalE(EnvExperiment):
@@ -32,20 +32,28 @@ class FindOptimalE(EnvExperiment):
             initial_sampling(self)
 
             low_ei_count = 0
-            for current_step in range(self.max_iteration):
+            current_step = 0
+            while current_step < self.max_iteration:
 
                 t0 = time.time()
 
-                ei = run_experiment_with_retries(self, bo_sampling, current_step)
+                if self.batch_size > 1:
+                    # several points per GP update, time_cost is stored per point
+                    eis = bo_sampling_batch(self, current_step, int(self.batch_size))
+                    ei = eis[0]  # the only EI not conditioned on believed points
+                else:
+                    ei = run_experiment_with_retries(self, bo_sampling, current_step)
+                    self.mutate_dataset("time_cost", current_step + self.init_sample_size, time.time() - t0)
+                    eis = [ei]
+
+                current_step += len(eis)
 
                 # converge in advance: ei < tolerance event counter
                 if ei < self.tolerance: low_ei_count += 1
                 else: low_ei_count = 0
 
-                self.mutate_dataset("time_cost", current_step + self.init_sample_size, time.time() - t0)
-
                 # if the algorithm was already converged
-                if (current_step + 1) >= self.min_iteration \
+                if current_step >= self.min_iteration \
                         and low_ei_count >= self.converge_count:
                     break
 
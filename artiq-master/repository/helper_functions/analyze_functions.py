@@ -5,17 +5,25 @@ from configparser import ConfigParser
 import traceback
 import datetime
 import os
+import sqlite3
 
 import scan_functions as sf
 from base_sequences import set_multipoles
-from helper_functions import latin_hypercube, normalize_coordinates, normalize_values, gaussian_process_hyperparameters, gaussian_process_predictor
+from run_functions import finish_post_processing
+from helper_functions import latin_hypercube, normalize_coordinates
+from run_archive import write_run_archive
+from run_catalog import RunCatalog, column_statistics
 
 # ===================================================================
 # 1) Master function for analyze
 def ofat_analyze(self):
 
-    # 1) Reset devices to default state
-    reset_instruments(self)
+    # 0) Datasets of the last points may still be in the post-processing pipeline
+    finish_post_processing(self)
+
+    # 1) Reset devices to default state (none were set up for an unsafe scan)
+    if self.scan_ok:
+        reset_instruments(self)
     close_instruments(self)
 
     # 2) Save data
@@ -25,8 +33,12 @@ def ofat_analyze(self):
 
 def doe_analyze(self):
 
-    # 1) Reset devices to default state
-    reset_instruments(self)
+    # 0) Datasets of the last points may still be in the post-processing pipeline
+    finish_post_processing(self)
+
+    # 1) Reset devices to default state (none were set up for an unsafe scan)
+    if self.scan_ok:
+        reset_instruments(self)
     close_instruments(self)
 
     # 2) Save data
@@ -35,8 +47,12 @@ def doe_analyze(self):
 
 def optimizer_analyze(self):
 
-    # 1) Reset devices to default state
-    reset_instruments(self)
+    # 0) Datasets of the last points may still be in the post-processing pipeline
+    finish_post_processing(self)
+
+    # 1) Reset devices to default state (none were set up for an unsafe scan)
+    if self.scan_ok:
+        reset_instruments(self)
     close_instruments(self)
 
     # 2) Save data
@@ -44,7 +60,8 @@ def optimizer_analyze(self):
     define_optimizer_saving_configuration(self)
     save_data_or_exit(self)
 
-    printout_final_result(self)
+    if self.scan_ok:
+        printout_final_result(self)
 
 # ===================================================================
 # 2) Subfunctions for analyze
@@ -99,43 +116,57 @@ def reset_optimizer_parameters(self):
 
 def close_instruments(self):
 
-    # Close instrument connections created by prepare
+    # Close instrument connections created by prepare, skipping the ones it never
+    # opened (prepare stops before the instruments when the scan is unsafe)
+    # 0) Wait for pre-flight readings still in flight
+    if getattr(self, 'preflight', None) is not None:
+        try:
+            self.preflight.close()
+        except Exception:
+            print("[Error] Failed to close the pre-flight readings")
+            traceback.print_exc()
+
     # 1) Close Laser Client
-    try:
-        self.laser.close()
-    except Exception:
-        print("[Error] Failed to close the laser")
-        traceback.print_exc()
+    if getattr(self, 'laser', None) is not None:
+        try:
+            self.laser.close()
+        except Exception:
+            print("[Error] Failed to close the laser")
+            traceback.print_exc()
 
     # 2) Close Tickler (DSG821)
-    try:
-        self.tickler.off()
-        self.tickler.close()
-    except Exception:
-        print("[Error] Failed to close the tickler")
-        traceback.print_exc()
+    if getattr(self, 'tickler', None) is not None:
+        try:
+            self.tickler.off()
+            self.tickler.close()
+        except Exception:
+            print("[Error] Failed to close the tickler")
+            traceback.print_exc()
 
     # 3) Close RF (RS and Keysight)
-    try:
-        self.rf.off()
-    except Exception:
-        print("[Error] Failed to close the RF")
-        traceback.print_exc()
+    if getattr(self, 'rf', None) is not None:
+        try:
+            self.rf.off()
+        except Exception:
+            print("[Error] Failed to close the RF")
+            traceback.print_exc()
         
     # 4) Close Extraction Pulser (BK4053)
     # Should not turn off ext_pulser because it could kill the AOM
-    try:
-        self.ext_pulser.close()
-    except Exception:
-        print("[Error] Failed to close the extraction pulse and AOM controller")
-        traceback.print_exc()
+    if getattr(self, 'ext_pulser', None) is not None:
+        try:
+            self.ext_pulser.close()
+        except Exception:
+            print("[Error] Failed to close the extraction pulse and AOM controller")
+            traceback.print_exc()
 
     # 5) Close Final Signal Generator (DG4162)
-    try:
-        self.threshold_detector.off(disable_output=False, kill_socket=True)
-    except Exception:
-        print("[Error] Failed to close the final signal and RST generator")
-        traceback.print_exc()
+    if getattr(self, 'threshold_detector', None) is not None:
+        try:
+            self.threshold_detector.off(disable_output=False, kill_socket=True)
+        except Exception:
+            print("[Error] Failed to close the final signal and RST generator")
+            traceback.print_exc()
 
 def printout_final_result(self):
 
@@ -158,25 +189,20 @@ def printout_final_result(self):
 
 def find_model_optimum(self):
 
-    # Extract data for final model
+    # Final model, extends the surrogate of the run by the last measured point
     E_normalized = normalize_coordinates(self.E_sampled, self.bounds)
-    y_normalized, _ = normalize_values(self.y_sampled)
-    length_scale, variance, noise, xi, _ = gaussian_process_hyperparameters(E_normalized, y_normalized)
+    self.surrogate.fit(E_normalized, self.y_sampled)
 
     # General testing points for final model
     candidates = latin_hypercube(self.n_candidate_anal, self.bounds)
     candidates_normalized = normalize_coordinates(candidates, self.bounds)
 
-    # Predict with final model
-    mu, sigma = gaussian_process_predictor(
-        E_normalized, y_normalized, candidates_normalized,
-        noise=noise, length_scale=length_scale, variance=variance
-    )
+    # Final predicted optimum by the model (in signal units), refined from the best candidates
+    mu, sigma = self.surrogate.predict(candidates_normalized)
+    x_best, mu_best = self.surrogate.maximize(candidates_normalized, mu, n_starts=self.n_acq_starts, acquisition='mean')
 
-    # Final predicted optimum by the model
-    idx = np.argmax(mu)
-    E_best = candidates[idx]
-    y_best = mu[idx]
+    E_best = self.bounds[:, 0] + x_best * (self.bounds[:, 1] - self.bounds[:, 0])
+    y_best = self.surrogate.denormalize(mu_best)
 
     return E_best, y_best
 
@@ -200,6 +226,9 @@ def define_saving_configuration(self):
             {'var': 'act_RF_amplitude',   'level': 'scan',       'name': 'array of actual RF amplitude'},
     ]
 
+    for name in getattr(self, 'extra_windows', {}):
+        common_data_to_save.append({'var': f'{name}_signal', 'level': signal_level, 'name': f'array of counts in extra window {name}'})
+
     # save sequence file name
     self.data_to_save.extend(common_data_to_save)
     self.config_dict.append({'par' : 'sequence_file', 'val' : self.sequence_filename, 'cmt' : 'Filename of the main sequence file'})
@@ -404,24 +433,57 @@ def _build_substep_result_table(self):
     return out
 
 
-def save_csv_tables(self):
-    scan_df = _build_scan_result_table(self)
-    scan_df.to_csv(f"{self.basefilename}_scan_result.csv", index=False)
+def save_csv_tables(self, scan_df=None, sub_df=None):
+    if scan_df is None:
+        scan_df = _build_scan_result_table(self)
+        sub_df = _build_substep_result_table(self)
 
-    sub_df = _build_substep_result_table(self)
+    scan_df.to_csv(f"{self.basefilename}_scan_result.csv", index=False)
     if sub_df is not None:
         sub_df.to_csv(f"{self.basefilename}_substep_result.csv", index=False)
 
-def save_all(self):
+def save_run_archive(self, scan_df, sub_df):
 
-    save_csv_tables(self)
+    # every dataset to save, the result tables, config and raw timestamps in one binary file
+    datasets = {}
+    for hlp in self.data_to_save:
+        try:
+            datasets[hlp['var']] = self.get_dataset(hlp['var'])
+        except KeyError:
+            continue
+
+    write_run_archive(
+        self.basefilename,
+        scan_df,
+        substep_table = sub_df,
+        datasets      = datasets,
+        config        = self.config_dict,
+        events        = getattr(self, "events", None),
+    )
+
+def save_all(self):
 
     # save all config
     self.config_dict.append({'par' : 'Status', 'val' : True, 'cmt' : 'Run finished.'})
+
+    scan_df = _build_scan_result_table(self)
+    sub_df = _build_substep_result_table(self)
+
+    if self.export_csv:
+        save_csv_tables(self, scan_df, sub_df)
+
     save_config(self)
+
+    # the CSVs and the config are already on disk if the archive fails
+    try:
+        save_run_archive(self, scan_df, sub_df)
+    except Exception:
+        print("[Warning] Failed to write the run archive")
+        traceback.print_exc()
     
     # add scan to list
     add_scan_to_list(self)
+    add_scan_to_catalog(self, scan_df, sub_df)
 
 def add_scan_to_list(self):
 
@@ -430,6 +492,20 @@ def add_scan_to_list(self):
     f_hlp.write(self.scan_timestamp + '\n')
     f_hlp.close()
 
+def add_scan_to_catalog(self, scan_df, sub_df):
+
+    # index the run in the catalog of the data folder, the run itself is already saved
+    try:
+        with RunCatalog(data_folder=self.datafolder) as catalog:
+            catalog.add_run(
+                self.scan_timestamp, self.config_dict, self.basefilename,
+                mode     = self.mode,
+                n_points = len(scan_df),
+                stats    = {'scan': column_statistics(scan_df), 'substep': column_statistics(sub_df)},
+            )
+    except sqlite3.Error as e:
+        print(f'Run catalog not updated: {e}')
+
 def save_config(self):
 
     # save run configuration
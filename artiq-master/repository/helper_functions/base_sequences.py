@@ -1,8 +1,10 @@
-from artiq.experiment import kernel, delay, now_mu, us, ms, parallel, sequential
+from artiq.experiment import kernel, rpc, delay, now_mu, us, ms, parallel, sequential
 import numpy as np
 import time
 
 from helper_functions import calculate_input_voltage, calculate_Vsampler, calculate_HighV, calculate_Vin, safe_check
+from event_processing import HistogramAccumulator, EventStore
+from zotino_shadow import ZotinoShadow, ZOTINO_GAIN_MU
 
 ###########################################################
 ##  Lifetime table (host-side CSV)  ########################
@@ -26,55 +28,99 @@ def load_lifetime_wait_times(filepath):
     return wait_times, no_of_repeats
 
 
+###########################################################
+##  Timestamp Buffer (core device -> host)  ###############
+###########################################################
+
+# Number of machine-unit timestamps the kernel can hold before it has to ship
+# them to the host. A single repeat rarely exceeds a few hundred events, the
+# buffer is flushed early inside `read_timestamps_to_buffer` if it fills up.
+TIMESTAMP_BUFFER_SIZE = 4096
+
+
+def init_timestamp_buffer(self):
+    """Allocate the on-core timestamp buffer, the run-wide event store and the histogram."""
+    self.timestamp_buffer = np.zeros(TIMESTAMP_BUFFER_SIZE, dtype=np.int64)
+    self.repeat_counts = np.zeros(1, dtype=np.int32)
+    self.events = EventStore()
+    self.histogram = HistogramAccumulator(self.detection_time, self.bin_width)
+
+
+def start_timestamp_point(self, index):
+    """Prepare host and kernel buffers before a readout kernel measures dataset index `index`."""
+    self.events.begin_point(index)
+    self.histogram.reset(self.detection_time, self.bin_width)
+    self.repeat_counts = np.zeros(int(self.no_of_repeats), dtype=np.int32)
+
+
+def collect_timestamps(self):
+    """All timestamps (us) of the current scan point, as one float array."""
+    return np.asarray(self.events.current_point(), dtype=np.float64)
+
+
+@rpc(flags={"async"})
+def store_timestamps_mu(self, buffer_mu, n):
+    """
+    Host side of the buffered readout. `buffer_mu` holds `n` valid timestamps in
+    machine units relative to the gate start, converted here to us in one step.
+    """
+    chunk = np.asarray(buffer_mu[:n], dtype=np.float64) * (self.core.ref_period * 1e6)
+    self.events.append(chunk)
+    self.histogram.add(chunk)
+
+
+@rpc(flags={"async"})
+def store_repeat_counts(self, counts):
+    """Number of events of every repeat, sent once after the last repeat."""
+    self.events.append_repeat_counts(counts)
+
 ###########################################################
 ##  Control Widgets  ######################################
 ###########################################################
 
 # ==============  Recording and Validating ============== #
-def record_laser_frequencies(self, idx, tol=1e-5, target_422=None, target_390=None):
+def start_preflight(self):
     """
-    Fetch Last Frequencies of each laser from Laser Lock GUI and record them into dataset.
-    When failed to fetch frequency, 0.0 will be returned according to the function.
-    target_422, target_390: optional; when provided, use for comparison instead of self.frequency_422/390.
+    Issue the laser frequency and RF amplitude readings of the next point in parallel.
+    Returns a `PendingSnapshot`, the readings may overlap with a kernel run.
     """
 
-    freq_422 = self.laser.get_frequency(422)
-    freq_390 = self.laser.get_frequency(390)
+    return self.preflight.start()
 
-    self.mutate_dataset('last_frequency_422', idx, freq_422)
-    self.mutate_dataset('last_frequency_390', idx, freq_390)
+def record_preflight(self, pending, idx, tol=1e-5, target_422=None, target_390=None):
+    """
+    Wait for the pre-flight readings and record them into dataset.
+    When failed to fetch a frequency, 0.0 is recorded (see `LaserClient.get_frequency`).
+    target_422, target_390: optional; when provided, use for comparison instead of self.frequency_422/390.
+    """
+
+    snapshot = pending.result()
+    snapshot.record(self, idx)
 
     ref_422 = target_422 if target_422 is not None else self.frequency_422
     ref_390 = target_390 if target_390 is not None else self.frequency_390
 
-    status_422 = (abs(freq_422 - ref_422) <= tol)
-    status_390 = (abs(freq_390 - ref_390) <= tol)
-
-    return status_390, status_422
-
-def record_RF_amplitude(self, idx):
-
-    ampl = self.rf.get_amplitude()
-    self.mutate_dataset('act_RF_amplitude', idx, ampl)
-    
-    return
+    return snapshot.laser_status(ref_422, ref_390, tol)
 
 # =============  Extraction Pulse Control  ============= #
 def set_extraction_pulse(self):
 
-    # Set extraction pulse frequency (for robustness)
-    ext_freq = 1e6 / (self.detection_time+100)
-    self.ext_pulser.set_carr_freq(2, ext_freq)
-    self.ext_pulser.set_carr_delay(2, (self.load_time+self.wait_time+0.15) * 1e-6)
+    # Unchanged settings are skipped, the rest is sent as one batch
+    with self.ext_pulser.batch():
 
-    # Set extraction pulse length
-    self.ext_pulser.set_carr_width(2, ext_freq, self.ext_pulse_length * 1e-9)
+        # Set extraction pulse frequency (for robustness)
+        ext_freq = 1e6 / (self.detection_time+100)
+        self.ext_pulser.set_carr_freq(2, ext_freq)
+        self.ext_pulser.set_carr_delay(2, (self.load_time+self.wait_time+0.15) * 1e-6)
 
-    # Set extraction pulse amplitude
-    self.ext_pulser.set_carr_ampl(2, self.ext_pulse_level)
-    
-    # Parts to ensure
-    self.ext_pulser.set_burst_mode(2, True)   # Channel 2 = extraction pulse
+        # Set extraction pulse length
+        self.ext_pulser.set_carr_width(2, ext_freq, self.ext_pulse_length * 1e-9)
+
+        # Set extraction pulse amplitude
+        self.ext_pulser.set_carr_ampl(2, self.ext_pulse_level)
+
+        # Parts to ensure
+        self.ext_pulser.set_burst_mode(2, True)   # Channel 2 = extraction pulse
 
     return
 
@@ -83,20 +129,23 @@ def set_loading_pulse(self):
     
     ext_freq = 1e6 / (self.detection_time+100)
 
-    # Parts to set
-    self.ext_pulser.set_carr_freq(1, ext_freq)
-    self.ext_pulser.set_carr_width(1, ext_freq, self.load_time * 1e-6)
+    # Unchanged settings are skipped, the rest is sent as one batch
+    with self.ext_pulser.batch():
+
+        # Parts to set
+        self.ext_pulser.set_carr_freq(1, ext_freq)
+        self.ext_pulser.set_carr_width(1, ext_freq, self.load_time * 1e-6)
 
-    # Parts to ensure
-    self.ext_pulser.set_carr_delay(1, 0.0)
-    self.ext_pulser.set_carr_ampl(1, 1.0)
-    self.ext_pulser.set_carr_offset(1, 0.5)
-    self.ext_pulser.set_burst_mode(1, True)   # Channel 1 = loading pulse (was incorrectly set to 2)
+        # Parts to ensure
+        self.ext_pulser.set_carr_delay(1, 0.0)
+        self.ext_pulser.set_carr_ampl(1, 1.0)
+        self.ext_pulser.set_carr_offset(1, 0.5)
+        self.ext_pulser.set_burst_mode(1, True)   # Channel 1 = loading pulse (was incorrectly set to 2)
 
-    # Make sure the pulser is on
-    # both channel is switched here because we do not want this recurring
-    self.ext_pulser.on(1)
-    self.ext_pulser.on(2)
+        # Make sure the pulser is on
+        # both channel is switched here because we do not want this recurring
+        self.ext_pulser.on(1)
+        self.ext_pulser.on(2)
 
     return
 
@@ -105,6 +154,7 @@ def recover_threshold_detector(self, max_tries=5):
 
     set_threshold_voltage(self, 1.0)
     self.threshold_detector.set_to_force_rst_mode()
+    self.threshold_detector.wait_finished()
 
     try:
         for i in range(max_tries):
@@ -129,22 +179,75 @@ def update_detection_time(self):
     return
 
 # =============  General Zotino Controller  ============= #
-@kernel
+def zotino_shadow(self):
+    """Host copy of the Zotino channel states, see `ZotinoShadow`."""
+    if getattr(self, '_zotino_shadow', None) is None:
+        self._zotino_shadow = ZotinoShadow(self.zotino0.offset_dacs, self.zotino0.vref)
+    return self._zotino_shadow
+
 def zotino_initialization(self):
 
+    zotino_init(self)
+
+    # output state after init is unknown, rewrite every channel next time
+    zotino_shadow(self).invalidate()
+
+    return
+
+@kernel
+def zotino_init(self):
+
     self.core.break_realtime()
     self.zotino0.init()
     delay(200*us)
 
     return
 
-@kernel
 def zotino_write(self, channel, voltage):
 
+    write_zotino_channels(self, [channel], [voltage])
+
+    return
+
+def write_zotino_channels(self, channel_list, voltage_list):
+    """
+    Set Zotino channels, only gains and DAC codes that differ from the last
+    write are sent, nothing at all if no channel changes.
+    """
+
+    shadow = zotino_shadow(self)
+    gain_channels, dac_channels, dac_codes = shadow.plan(channel_list, voltage_list)
+
+    if len(gain_channels) == 0 and len(dac_channels) == 0:
+        return
+
+    try:
+        zotino_write_mu(self, gain_channels, dac_channels, dac_codes)
+    except BaseException:
+        shadow.invalidate(channel_list)
+        raise
+
+    shadow.commit(gain_channels, dac_channels, dac_codes)
+
+    return
+
+# This function must be standalone instead of a loop over zotino_write
+# because otherwise it would be extremely slow (causing 5s overhead)
+@kernel
+def zotino_write_mu(self, gain_channels, dac_channels, dac_codes):
+
     self.core.break_realtime()
-    self.zotino0.write_gain_mu(channel, 65000)
-    delay(200*us)
-    self.zotino0.write_dac(channel, voltage)
+
+    for k in range(len(gain_channels)):
+        self.zotino0.write_gain_mu(gain_channels[k], ZOTINO_GAIN_MU)
+        delay(100*us)
+
+    # each SPI write takes slack, keep the 100 us per channel of the old
+    # write loop (the gains may all be applied already)
+    for k in range(len(dac_channels)):
+        self.zotino0.write_dac_mu(dac_channels[k], dac_codes[k])
+        delay(100*us)
+
     self.zotino0.load()
     delay(200*us)
 
@@ -175,20 +278,9 @@ def set_multipoles(self):
     return
 
 # ================  DC Voltages Control  ================ #
-# This function must be standalone instead of calling zotino_write
-# because otherwise it would be extremely slow (causing 5s overhead)
-@kernel
 def set_electrode_voltages(self, channel_list, voltage_list):
-    
-    self.core.break_realtime()
 
-    for k in range(len(channel_list)):
-        self.zotino0.write_gain_mu(channel_list[k], 65000)
-        delay(100*us)
-        self.zotino0.write_dac(channel_list[k], voltage_list[k])
-
-    self.zotino0.load()
-    delay(200*us)
+    write_zotino_channels(self, channel_list, voltage_list)
 
     return
 
@@ -314,7 +406,7 @@ def bare_counting(self):
 @kernel
 def count_events(self):
     
-    ind_count = 0
+    n_buffered = 0
     # Time Sequence
     for i in range(self.no_of_repeats):
 
@@ -359,27 +451,51 @@ def count_events(self):
                 
                 self.ttl8.pulse(self.tickle_pulse_length * us)
 
-        read_only_timestamps(self, tload_start, t_end, 'timestamps')
+        n_buffered = read_only_timestamps(self, tload_start, t_end, i, n_buffered)
+
+    store_repeat_counts(self, self.repeat_counts)
 
     return
 
 @kernel
-def read_only_timestamps(self, t_start, t_end, which_data_set):
+def read_only_timestamps(self, t_start, t_end, i, n_buffered):
+
+    n_buffered = read_timestamps_to_buffer(self, t_start, t_end, i, n_buffered)
 
+    if ((i+1) % self.timestamp_flush_repeats == 0) or ((i+1) == self.no_of_repeats):
+        store_timestamps_mu(self, self.timestamp_buffer, n_buffered)
+        n_buffered = 0
+
+    return n_buffered
+
+@kernel
+def read_timestamps_to_buffer(self, t_start, t_end, i, n_buffered):
+    """
+    Drain the input gate of repeat `i` into `self.timestamp_buffer` (machine
+    units relative to `t_start`) and return the new fill level. No RPC is issued
+    per event, only when the buffer runs full.
+    """
+
+    n_events = 0
     tstamp = self.ttl3.timestamp_mu(t_end)
     while tstamp != -1:
-        timestamp = self.core.mu_to_seconds(tstamp) - self.core.mu_to_seconds(t_start)
-        timestamp_us = timestamp * 1e6
-        self.append_to_dataset(which_data_set, timestamp_us) # store the timestamps in microsecond
+        if n_buffered == TIMESTAMP_BUFFER_SIZE:
+            store_timestamps_mu(self, self.timestamp_buffer, n_buffered)
+            n_buffered = 0
+        self.timestamp_buffer[n_buffered] = tstamp - t_start
+        n_buffered += 1
+        n_events += 1
         tstamp = self.ttl3.timestamp_mu(t_end) # read the timestamp of another event
 
-    return
+    self.repeat_counts[i] = n_events
+
+    return n_buffered
 
 # ========  Experiment Sequences - histogram on  ======== #
 @kernel
 def count_histogram(self):
     
-    ind_count = 0
+    n_buffered = 0
     # Time Sequence
     for i in range(self.no_of_repeats):
 
@@ -423,36 +539,34 @@ def count_histogram(self):
                 
                 self.ttl8.pulse(self.tickle_pulse_length * us)
 
-        read_histogram_timestamps(self, t_start, t_end, i)
+        n_buffered = read_histogram_timestamps(self, t_start, t_end, i, n_buffered)
+
+    store_repeat_counts(self, self.repeat_counts)
 
     return
 
 @kernel
-def read_histogram_timestamps(self, t_start, t_end, i):
+def read_histogram_timestamps(self, t_start, t_end, i, n_buffered):
 
-    tstamp = self.ttl3.timestamp_mu(t_end)
-    while tstamp != -1:
-        timestamp = self.core.mu_to_seconds(tstamp) - self.core.mu_to_seconds(t_start)
-        timestamp_us = timestamp * 1e6
-        self.append_to_dataset('timestamps', timestamp_us) # store the timestamps in microsecond
-        tstamp = self.ttl3.timestamp_mu(t_end) # read the timestamp of another event
+    n_buffered = read_timestamps_to_buffer(self, t_start, t_end, i, n_buffered)
+
+    refresh = ((i+1) % self.histogram_refresh == 0) or ((i+1) == self.no_of_repeats)
+
+    # the histogram needs every event up to now, so always flush before a refresh
+    if refresh or ((i+1) % self.timestamp_flush_repeats == 0):
+        store_timestamps_mu(self, self.timestamp_buffer, n_buffered)
+        n_buffered = 0
 
-    if ((i+1) % self.histogram_refresh == 0) or ((i+1) == self.no_of_repeats):
+    if refresh:
         make_histogram(self)
 
-    return
+    return n_buffered
 
 # =============  Calculate Histogram Data  ============= #
+@rpc(flags={"async"})
 def make_histogram(self):
-    
-    # for display
-    extract = list(self.get_dataset('timestamps'))
-    self.hist_data = extract[1:len(extract)]
-    number_of_bins = int(self.detection_time / self.bin_width) + 1
-    a, b = np.histogram(self.hist_data, bins = np.linspace(0, self.detection_time, number_of_bins))
-    
-    self.set_dataset('hist_ys', a, broadcast=True)
-    self.set_dataset('hist_xs', b, broadcast=True)
 
-    return
+    # for display, only publishes the running counts of `self.histogram`
+    self.histogram.publish(self)
 
+    return
@@ -65,6 +65,10 @@ def load_variables(self):
     self.wavemeter_frequencies = []
     self.data_to_save = []
 
+    # Extra counting windows {name: (lower, upper)} in us, counted next to
+    # trapped/lost/loading and stored as dataset `{name}_signal`
+    self.extra_windows = {}
+
 def load_attributes(self):
 
     self.setattr_device('core')
@@ -87,6 +91,7 @@ def load_common_parameters(self):
     my_setattr(self, 'histogram_on',      BooleanValue(default=True), group=group_display, scanable=False)
     my_setattr(self, 'bin_width',         NumberValue(default=1.0,unit='us',scale=1,ndecimals=1,step=0.1), group=group_display, scanable = False)
     my_setattr(self, 'histogram_refresh', NumberValue(default=1000,unit='',scale=1,ndecimals=0,step=1), group=group_display, scanable = False)
+    my_setattr(self, 'export_csv',        BooleanValue(default=True), group=group_display, scanable=False)  # csv tables next to the binary run archive
 
     # 2. Detector Settings
     #------------------------------------------------------
@@ -101,6 +106,9 @@ def load_common_parameters(self):
     group_general = "Shared Sequence Settings"
     my_setattr(self, 'load_time',         NumberValue(default=260,unit='us',scale=1,ndecimals=0,step=1), group=group_general)
     my_setattr(self, 'no_of_repeats',     NumberValue(default=10000,unit='',scale=1,ndecimals=0,step=1), group=group_general)
+    my_setattr(self, 'timestamp_flush_repeats', NumberValue(default=1,unit='',scale=1,ndecimals=0,step=1,min=1), group=group_general, scanable=False)
+    my_setattr(self, 'pipeline_post_processing', BooleanValue(default=False), group=group_general, scanable=False)  # write datasets of point N while point N+1 runs
+    my_setattr(self, 'overlap_preflight', BooleanValue(default=False), group=group_general, scanable=False)  # read lasers and RF during the kernel of the point
 
     # 3-1) Trapping Mode
     group_trapping = "Trapping Mode Settings"
@@ -133,6 +141,8 @@ def load_common_parameters(self):
     my_setattr(self, 'frequency_422',     NumberValue(default=709.076780,unit='THz',scale=1,ndecimals=6,step=1e-6), group=group_laser)
     my_setattr(self, 'frequency_390',     NumberValue(default=768.708843,unit='THz',scale=1,ndecimals=6,step=1e-6), group=group_laser)
     my_setattr(self, 'laser_failure',     EnumerationValue(['wait for fix', 'raise error'], default='wait for fix'), group=group_laser, scanable=False)
+    my_setattr(self, 'laser_server',      StringValue(default='192.168.42.26:63700'), group=group_laser, scanable=False)  # host:port of the Laser Lock GUI, e.g. localhost:63700 for drivers/laser_server_sim.py
+    my_setattr(self, 'laser_poll_interval', NumberValue(default=0.0,unit='s',scale=1,ndecimals=2,step=0.05,min=0), group=group_laser, scanable=False)  # 0: query the Laser Lock GUI on every reading
 
     # 6. RF Settings
     #------------------------------------------------------
@@ -217,6 +227,7 @@ def load_optimizer_parameters(self):
     my_setattr(self, 'max_iteration',   NumberValue(default=50,unit='',scale=1,ndecimals=0,step=1), group=group_algorithm, scanable=False)
     my_setattr(self, 'tolerance',       NumberValue(default=5e-3,unit='',scale=1,ndecimals=6,step=1e-6), group=group_algorithm, scanable=False)
     my_setattr(self, 'converge_count',  NumberValue(default=3,unit='',scale=1,ndecimals=0,step=1), group=group_algorithm, scanable=False)
+    my_setattr(self, 'batch_size',      NumberValue(default=1,unit='',scale=1,ndecimals=0,step=1,min=1), group=group_algorithm, scanable=False) # BO points proposed (q-EI) and measured per GP update
     my_setattr(self, 'min_Ex',          NumberValue(default=-0.3,unit='',scale=1,ndecimals=3,step=.001), group=group_bound, scanable=False)
     my_setattr(self, 'max_Ex',          NumberValue(default=0.05,unit='',scale=1,ndecimals=3,step=.001), group=group_bound, scanable=False)
     my_setattr(self, 'min_Ey',          NumberValue(default=-0.05,unit='',scale=1,ndecimals=3,step=.001), group=group_bound, scanable=False)
@@ -224,9 +235,11 @@ def load_optimizer_parameters(self):
     my_setattr(self, 'min_Ez',          NumberValue(default=-0.1,unit='',scale=1,ndecimals=3,step=.001), group=group_bound, scanable=False)
     my_setattr(self, 'max_Ez',          NumberValue(default=0.1,unit='',scale=1,ndecimals=3,step=.001), group=group_bound, scanable=False)
     my_setattr(self, 'min_iteration',   NumberValue(default=5,unit='',scale=1,ndecimals=0,step=1), group=group_advanced, scanable=False)
-    my_setattr(self, 'n_candidate_run', NumberValue(default=1024,unit='',scale=1,ndecimals=0,step=1), group=group_advanced, scanable=False)
-    my_setattr(self, 'n_candidate_anal',NumberValue(default=4096,unit='',scale=1,ndecimals=0,step=1), group=group_advanced, scanable=False)
+    my_setattr(self, 'n_candidate_run', NumberValue(default=256,unit='',scale=1,ndecimals=0,step=1), group=group_advanced, scanable=False)
+    my_setattr(self, 'n_candidate_anal',NumberValue(default=512,unit='',scale=1,ndecimals=0,step=1), group=group_advanced, scanable=False)
+    my_setattr(self, 'n_acq_starts',    NumberValue(default=8,unit='',scale=1,ndecimals=0,step=1,min=0), group=group_advanced, scanable=False) # L-BFGS-B starts refining the best candidates, 0: argmax of the candidates only
     my_setattr(self, 'init_sample_size',NumberValue(default=10,unit='',scale=1,ndecimals=0,step=1), group=group_advanced, scanable=False)
+    my_setattr(self, 'gp_hyperparameters', EnumerationValue(['grid', 'ARD fit'], default='grid'), group=group_advanced, scanable=False) # 'ARD fit': per-dimension length scales, variance and noise by L-BFGS-B
 
     # For compatibility
     self.mode = "Trapping"
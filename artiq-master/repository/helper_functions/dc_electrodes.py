@@ -3,7 +3,7 @@ import matplotlib.pyplot as plt
 import os
 
 from traps import traps
-from helper_functions import adjust_control_voltages
+from helper_functions import input_voltage_coefficients
 
 class VoltageSafetyError(ValueError):
     pass
@@ -22,12 +22,18 @@ class Electrodes(object):
         self.multipoles = info["multipoles_order"]
         self.elec_list = info["electrodes_order"]
         self.voltage_ratings = info["elec_voltage_ratings"]
+
+        # Vectors in Zotino channel order (order of elec_dict)
+        self.elec_names = list(self.elec_dict.keys())
+        self.channels = np.array([self.elec_dict[e] for e in self.elec_names], dtype = int)
+        self.limits = np.array([self.voltage_ratings[e] for e in self.elec_names], dtype = float)
         self._read_in_cfile(info["cfile"])
 
         # DC offset voltages
-        self.offset_voltages = {}
-        for elec in self.elec_dict:
-            self.offset_voltages[elec] = 0.0
+        self.offsets = np.zeros(len(self.elec_names))
+
+        # Zotino input calibration (gain, bias) per channel, filled on first use per amplifier setting
+        self._calibration = {}
 
     # 1) Internal Methods
     #================================================================
@@ -48,20 +54,22 @@ class Electrodes(object):
             if Cfile_text[i].find(':') >= 0: head.append(Cfile_text[i])
             else: body.append(Cfile_text[i].split())
 
-        num_columns = 1 # this needs to change if the cfile has more than one column
+        # The C file lists one block per multipole, each with one line per electrode
+        # in electrodes_order. Only the first column is used (single-column C files).
+        n_elec = len(self.elec_dict)
+        column = np.array([float(line[0]) for line in body[:n_elec * len(self.multipoles)]])
+        by_cfile_order = column.reshape(len(self.multipoles), n_elec).T
 
-        # Construct multipole matrix based on data in C file
-        self.multipole_matrix = {
-            elec: {
-                mult: 
-                        [
-                            float(body[eindex + mindex*len(self.elec_dict)][i]) for i in range(num_columns)
-                        ] for mindex, mult in enumerate(self.multipoles)
-                } for eindex, elec in enumerate(self.elec_list)
-            }
+        # Multipole matrix: electrodes (elec_dict order) x multipoles (multipoles_order)
+        rows = [self.elec_list.index(e) for e in self.elec_names]
+        self.multipole_matrix = by_cfile_order[rows]
+
+    def _multipole_array(self, multipole_vector):
+        """
+        Multipole dict -> vector in multipoles_order, missing multipoles are 0.0.
+        A list of dicts gives one row per dict, arrays are taken as they are.
+        """
 
-    def _get_voltage_matrix(self, multipole_vector):
-        
         # example of multipole vector:
         #
         # multipole_vector = {
@@ -74,41 +82,45 @@ class Electrodes(object):
         #        'U4' : 0,
         #        'U5' : 0
         #    }
-        #
-        # If missing, default = 0.0
 
-        num_columns = 1 # this needs to change if the cfile has more than one column
+        if isinstance(multipole_vector, dict):
+            return np.array([multipole_vector.get(m, 0.0) for m in self.multipoles], dtype = float)
 
-        # Calculate control voltage matrix, support multi columns C file (not used now)
-        voltage_matrix = {}
-        for e in self.elec_dict.keys():
-            voltage_matrix[e] = [self.offset_voltages[e] for n in range(num_columns)]
-            for n in range(num_columns):
-                for m in self.multipoles:
-                    voltage_matrix[e][n] += self.multipole_matrix[e][m][n] * multipole_vector.get(m, 0.0)
+        if len(multipole_vector) > 0 and isinstance(multipole_vector[0], dict):
+            return np.array([[v.get(m, 0.0) for m in self.multipoles] for v in multipole_vector], dtype = float)
+
+        return np.asarray(multipole_vector, dtype = float)
+
+    def _get_voltages(self, multipole_vector, offsets = None):
+        """
+        Electrode voltages, shape (n_electrodes,) for one multipole vector
+        or (n_points, n_electrodes) for a batch. `offsets` replaces the
+        current offsets, also per point with shape (n_points, n_electrodes).
+        """
+
+        if offsets is None:
+            offsets = self.offsets
+        return self._multipole_array(multipole_vector) @ self.multipole_matrix.T + offsets
+
+    def _get_voltage_matrix(self, multipole_vector):
+
+        voltages = self._get_voltages(multipole_vector)
 
         # Make sure calculated control voltage is not exceeding voltage rating
-        self._check_safety(voltage_matrix)
+        self._check_safety(voltages)
 
         # Construct lists that can be used by Zotino
-        channel_list = []
-        voltage_list = []
-        for k in voltage_matrix.keys():
-            channel_list.append(self.elec_dict[k])
-            voltage_list.append(voltage_matrix[k][0])
-        
-        return (np.array(channel_list, dtype = int), np.array(voltage_list, dtype = float))
+        return (self.channels.copy(), voltages)
 
-    def _check_safety(self, voltage_matrix):
+    def _check_safety(self, voltages):
 
-        for elec, voltages in voltage_matrix.items():
-            voltage = voltages[0]
-            limit = self.voltage_ratings[elec]
-            if abs(voltage) > limit:
-                raise VoltageSafetyError(
-                    f"SAFETY VIOLATION: Electrode {elec} is set to {voltage:.2f} V, "
-                    f"which exceeds its limit of +/- {limit:.2f} V!"
-                )
+        unsafe = np.flatnonzero(np.abs(voltages) > self.limits)
+        if len(unsafe) > 0:
+            i = unsafe[0]
+            raise VoltageSafetyError(
+                f"SAFETY VIOLATION: Electrode {self.elec_names[i]} is set to {voltages[i]:.2f} V, "
+                f"which exceeds its limit of +/- {self.limits[i]:.2f} V!"
+            )
 
     # 2) Usages
     #================================================================
@@ -119,7 +131,26 @@ class Electrodes(object):
 
         if elec not in self.elec_dict:
             raise ValueError(f"Electrode {elec} not found in current trap ({self.trap}).")
-        self.offset_voltages[elec] = voltage
+        self.offsets[self.elec_names.index(elec)] = voltage
+
+    @property
+    def offset_voltages(self):
+        return dict(zip(self.elec_names, self.offsets.tolist()))
+
+    def calibrate(self, voltages, amp=None):
+        """
+        Electrode voltages (single or batch) -> Zotino input voltages.
+        """
+
+        if amp is None:
+            amp = self.amp
+
+        amp = bool(amp)
+        if amp not in self._calibration:
+            self._calibration[amp] = input_voltage_coefficients(self.channels, amp)
+
+        gain, bias = self._calibration[amp]
+        return gain * voltages + bias
 
     def get_control_voltage(self, multipole_vector, amp=None):
         """
@@ -127,25 +158,38 @@ class Electrodes(object):
         """
 
         # Enables user to override amplifier usage based on actual experimental setup
-        if amp is None:
-            amp = self.amp
+        channels, voltages = self._get_voltage_matrix(multipole_vector)
+        return (channels, self.calibrate(voltages, amp))
+
+    def get_control_voltages(self, multipole_vectors, amp=None):
+        """
+        Batch version of get_control_voltage without the safety exception.
+        Returns the channel list, the Zotino voltages (n_points, n_channels)
+        and a boolean array that is True for the points within the voltage ratings.
+        """
+
+        voltages = np.atleast_2d(self._get_voltages(multipole_vectors))
+        safe = np.all(np.abs(voltages) <= self.limits, axis = 1)
+
+        return (self.channels.copy(), self.calibrate(voltages, amp), safe)
 
-        # Calculate voltages and calibrate using helper_functions
-        vec = self._get_voltage_matrix(multipole_vector)
-        control_signal = adjust_control_voltages(vec, amp)
+    def is_safe(self, multipole_vectors):
+        """
+        True for every multipole vector (single or batch) within all voltage ratings.
+        """
 
-        return control_signal
+        voltages = self._get_voltages(multipole_vectors)
+        return np.all(np.abs(voltages) <= self.limits, axis = -1)
 
     def get_offset_scan_range(self, multipole_vector, elec):
         """
         Calculate safe offset scan range under specific multipole vector.
         """
 
-        S = 0.0
-        for m in self.multipoles:
-            S += self.multipole_matrix[elec][m][0] * multipole_vector.get(m, 0.0)
+        i = self.elec_names.index(elec)
+        S = self.multipole_matrix[i] @ self._multipole_array(multipole_vector)
 
-        limit = self.voltage_ratings[elec]
+        limit = self.limits[i]
         offset_min = -limit - S
         offset_max = limit - S
 
@@ -156,42 +200,23 @@ class Electrodes(object):
         Calculate safe multipole scan range under specific multipole vector and offset.
         """
 
-        # Calculate base voltages excluding multipole to scan
-        base_vector = dict(multipole_vector)    # Must have this step to ensure copying
-        base_vector[mul] = 0.0
-        channels, voltages = self._get_voltage_matrix(base_vector)
-
-        # Construct map from electrode name to control voltages
-        voltage_by_channel = {
-            channel: voltage
-            for channel, voltage in zip(channels, voltages)
-        }
-        voltage_by_electrode = {
-            electrode: voltage_by_channel[self.elec_dict[electrode]]
-            for electrode in self.elec_dict
-        }
-
-        # Global range for the multipole scan range
-        global_min = -np.inf
-        global_max = np.inf
-
-        for elec, S in voltage_by_electrode.items():
-
-            # Extract necessary numbers for calculation
-            limit = self.voltage_ratings[elec]
-            coeff_scan = self.multipole_matrix[elec][mul][0]
-
-            # If coefficient too small, then no limit on this electrode
-            if abs(coeff_scan) < 1e-10: continue
-
-            # Calculate range of multipole caused by this electrode
-            range1 = ( limit - S) / coeff_scan
-            range2 = (-limit - S) / coeff_scan
-            minimum = min(range1, range2)
-            maximum = max(range1, range2)
-
-            global_min = max(global_min, minimum)
-            global_max = min(global_max, maximum)
+        # Base voltages excluding the multipole to scan
+        j = self.multipoles.index(mul)
+        base_vector = self._multipole_array(multipole_vector).copy()
+        base_vector[j] = 0.0
+        S = self._get_voltages(base_vector)
+        self._check_safety(S)
+
+        # Electrodes with a negligible coefficient put no limit on the range
+        coeff_scan = self.multipole_matrix[:, j]
+        active = np.abs(coeff_scan) >= 1e-10
+        S, coeff_scan, limit = S[active], coeff_scan[active], self.limits[active]
+
+        # Range of multipole allowed by each electrode, the intersection is the global range
+        range1 = ( limit - S) / coeff_scan
+        range2 = (-limit - S) / coeff_scan
+        global_min = np.max(np.minimum(range1, range2), initial = -np.inf)
+        global_max = np.min(np.maximum(range1, range2), initial = np.inf)
 
         if global_min > global_max:
             print(f"No safe range for multipole {mul!r} under current condition!")
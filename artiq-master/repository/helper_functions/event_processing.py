@@ -0,0 +1,352 @@
+import numpy as np
+
+
+class HistogramAccumulator(object):
+    """
+    Running histogram of MCP timestamps for one scan point.
+
+    Bin edges are fixed from `detection_time` and `bin_width` when the point
+    starts, afterwards only the events of each new chunk are binned and added
+    into an integer counts array. Old timestamps are never read again, so the
+    cost of a refresh only depends on the events that arrived since the last one.
+    """
+
+    def __init__(self, detection_time = 1.0, bin_width = 1.0):
+
+        self.reset(detection_time, bin_width)
+
+    # 1) Setup
+    #================================================================
+    def reset(self, detection_time = None, bin_width = None):
+        """
+        Clear the counts, optionally with new timing parameters (unit: us).
+        """
+
+        if detection_time is not None:
+            self.detection_time = float(detection_time)
+        if bin_width is not None:
+            self.bin_width = float(bin_width)
+
+        # Same binning as np.linspace(0, detection_time, n_edges)
+        n_edges = int(self.detection_time / self.bin_width) + 1
+        self.n_bins = max(n_edges - 1, 1)
+        self.edges = np.linspace(0, self.detection_time, self.n_bins + 1)
+        self.counts = np.zeros(self.n_bins, dtype=np.int64)
+        self.n_events = 0
+
+    # 2) Usages
+    #================================================================
+    def add(self, timestamps):
+        """
+        Bin a chunk of new timestamps (us) into the running counts.
+        """
+
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        if timestamps.size == 0:
+            return
+
+        # uniform-bin fast path of np.histogram, identical result to passing the edges
+        new_counts, _ = np.histogram(timestamps, bins=self.n_bins, range=(0.0, self.detection_time))
+        self.counts += new_counts
+        self.n_events += timestamps.size
+
+    def publish(self, experiment):
+        """
+        Broadcast the current histogram as `hist_ys` / `hist_xs`.
+        """
+
+        experiment.set_dataset('hist_ys', self.counts.copy(), broadcast=True)
+        experiment.set_dataset('hist_xs', self.edges, broadcast=True)
+
+
+class WindowCounter(object):
+    """
+    Count events inside several time windows in one pass.
+
+    Windows are open intervals (lower, upper) in us, given as a dict
+    {name: (lower, upper)}. For histograms a window contains every bin whose
+    left edge lies strictly inside it, for raw timestamps every event strictly
+    inside it. The bin-index boundaries are computed once per set of bin edges,
+    afterwards each count is a difference of the cumulative sum of the counts.
+    """
+
+    def __init__(self, windows):
+
+        self.names = list(windows.keys())
+        bounds = np.array([windows[name] for name in self.names], dtype=float).reshape(-1, 2)
+        self.lower = bounds[:, 0]
+        self.upper = bounds[:, 1]
+
+        self._edges_key = None
+        self._start = None
+        self._stop = None
+
+    @classmethod
+    def for_trapping(cls, load_time, wait_time, tickle_pulse_length, ext_pulse_length,
+                     histogram = True, extra_windows = None):
+        """
+        Trapped / lost / loading windows of the trapping sequence (unit: us).
+        Without histogram only the gated loading and extraction periods were
+        recorded, so the windows are half-open and there is no lost window.
+        """
+
+        extraction_start = load_time + wait_time
+
+        if histogram:
+            windows = {
+                'trapped': (extraction_start - 1, extraction_start + ext_pulse_length // 1000 + 3),
+                'lost':    (load_time + 4, load_time + tickle_pulse_length + 3),
+                'loading': (1, load_time + 2),
+            }
+        else:
+            windows = {
+                'trapped': (extraction_start - 3, np.inf),
+                'lost':    (0, 0),
+                'loading': (-np.inf, load_time + 2),
+            }
+
+        if extra_windows:
+            windows.update(extra_windows)
+
+        return cls(windows)
+
+    # 1) Internal Methods
+    #================================================================
+    def _bin_bounds(self, edges):
+
+        key = (len(edges), float(edges[0]), float(edges[-1]))
+        if key != self._edges_key:
+            left_edges = edges[:-1]
+            self._start = np.searchsorted(left_edges, self.lower, side='right')
+            self._stop = np.maximum(np.searchsorted(left_edges, self.upper, side='left'), self._start)
+            self._edges_key = key
+
+        return self._start, self._stop
+
+    # 2) Usages
+    #================================================================
+    def count_histogram(self, edges, counts):
+        """
+        Window counts from histogram bin edges and counts.
+        """
+
+        start, stop = self._bin_bounds(np.asarray(edges, dtype=float))
+        cumulative = np.concatenate(([0], np.cumsum(counts)))
+        totals = cumulative[stop] - cumulative[start]
+
+        return dict(zip(self.names, totals.tolist()))
+
+    def count_events(self, timestamps, is_sorted = False):
+        """
+        Window counts from raw timestamps (us).
+        """
+
+        timestamps = np.asarray(timestamps, dtype=float)
+        if not is_sorted:
+            timestamps = np.sort(timestamps)
+
+        start = np.searchsorted(timestamps, self.lower, side='right')
+        stop = np.searchsorted(timestamps, self.upper, side='left')
+        totals = np.maximum(stop - start, 0)
+
+        return dict(zip(self.names, totals.tolist()))
+
+
+class EventStore(object):
+    """
+    Columnar store of all MCP timestamps of a run.
+
+    Timestamps (us, float32) of every scan point are kept in one flat array.
+    Two offset tables slice it: `point_offsets` (one entry per stored point,
+    plus the end) and `repeat_offsets` (one entry per repeat, plus the end),
+    `point_repeat_offsets` maps points onto repeats. `point_index` holds the
+    dataset index each stored point belongs to. A point that is measured again
+    (e.g. retry after an RTIO error, also of a Lifetime substep measured before
+    other substeps) replaces its previous events.
+
+    The columns are saved in the `/events` group of the run archive, see
+    `write_run_archive` and `RunArchive.events`.
+    """
+
+    def __init__(self, capacity = 1 << 16):
+
+        self._timestamps = np.zeros(capacity, dtype=np.float32)
+        self._repeat_ends = np.zeros(1024, dtype=np.int64)
+        self.n_events = 0
+        self.n_repeats = 0
+
+        self._point_index = []
+        self._point_event_start = []
+        self._point_repeat_start = []
+        self._position = {}                 # dataset index -> position in the point lists
+        self._point_open = False
+
+    # 1) Internal Methods
+    #================================================================
+    @staticmethod
+    def _grow(array, needed):
+
+        if needed <= len(array):
+            return array
+        new_size = max(needed, 2 * len(array))
+        grown = np.zeros(new_size, dtype=array.dtype)
+        grown[:len(array)] = array
+        return grown
+
+    def _drop(self, k):
+        """
+        Remove the events and repeats of the k-th stored point, the later ones move up.
+        """
+
+        e0, r0 = self._point_event_start[k], self._point_repeat_start[k]
+        if k + 1 < len(self._point_index):
+            e1, r1 = self._point_event_start[k + 1], self._point_repeat_start[k + 1]
+        else:
+            e1, r1 = self.n_events, self.n_repeats
+        n_e, n_r = e1 - e0, r1 - r0
+
+        self._timestamps[e0:self.n_events - n_e] = self._timestamps[e1:self.n_events]
+        self._repeat_ends[r0:self.n_repeats - n_r] = self._repeat_ends[r1:self.n_repeats] - n_e
+        self.n_events -= n_e
+        self.n_repeats -= n_r
+
+        del self._point_index[k], self._point_event_start[k], self._point_repeat_start[k]
+        for j in range(k, len(self._point_index)):
+            self._point_event_start[j] -= n_e
+            self._point_repeat_start[j] -= n_r
+        self._position = {index: j for j, index in enumerate(self._point_index)}
+
+    # 2) Recording
+    #================================================================
+    def begin_point(self, index):
+        """
+        Start recording the events of dataset index `index`.
+        """
+
+        self.end_point()
+
+        # Re-measured point: drop the events of the previous attempt
+        if index in self._position:
+            self._drop(self._position[index])
+
+        self._position[index] = len(self._point_index)
+        self._point_index.append(index)
+        self._point_event_start.append(self.n_events)
+        self._point_repeat_start.append(self.n_repeats)
+        self._point_open = True
+
+    def end_point(self):
+
+        self._point_open = False
+
+    def append(self, timestamps):
+        """
+        Append a chunk of timestamps (us) to the open point.
+        """
+
+        if not self._point_open:
+            raise RuntimeError("EventStore: no open scan point, call begin_point first!")
+
+        n = len(timestamps)
+        self._timestamps = self._grow(self._timestamps, self.n_events + n)
+        self._timestamps[self.n_events:self.n_events + n] = timestamps
+        self.n_events += n
+
+    def append_repeat_counts(self, counts):
+        """
+        Register the number of events of each repeat, in the order the repeats were run.
+        """
+
+        counts = np.asarray(counts, dtype=np.int64)
+        if len(counts) == 0:
+            return
+
+        start = self.n_events - int(np.sum(counts))
+        if self._point_open and start < self._point_event_start[-1]:
+            raise RuntimeError("EventStore: repeat counts exceed the events of the open point!")
+
+        self._repeat_ends = self._grow(self._repeat_ends, self.n_repeats + len(counts))
+        self._repeat_ends[self.n_repeats:self.n_repeats + len(counts)] = start + np.cumsum(counts)
+        self.n_repeats += len(counts)
+
+    # 3) Access
+    #================================================================
+    @property
+    def timestamps(self):
+        return self._timestamps[:self.n_events]
+
+    @property
+    def point_index(self):
+        return np.array(self._point_index, dtype=np.int64)
+
+    @property
+    def point_offsets(self):
+        return np.array(self._point_event_start + [self.n_events], dtype=np.int64)
+
+    @property
+    def point_repeat_offsets(self):
+        return np.array(self._point_repeat_start + [self.n_repeats], dtype=np.int64)
+
+    @property
+    def repeat_offsets(self):
+        return np.concatenate(([0], self._repeat_ends[:self.n_repeats]))
+
+    def current_point(self):
+        """
+        Timestamps of the most recently started point.
+        """
+
+        if not self._point_event_start:
+            return self.timestamps[:0]
+        return self.timestamps[self._point_event_start[-1]:]
+
+    def __len__(self):
+        return len(self._point_index)
+
+
+# offset tables that, together with the flat timestamps, describe an EventStore
+EVENT_INDEX_KEYS = ("point_index", "point_offsets", "point_repeat_offsets", "repeat_offsets")
+
+
+class EventArchive(object):
+    """
+    Read-only view on saved EventStore columns, see `RunArchive.events`.
+    `timestamps` may be a memory-mapped array.
+    """
+
+    def __init__(self, timestamps, point_index, point_offsets, point_repeat_offsets, repeat_offsets):
+
+        self.timestamps           = timestamps
+        self.point_index          = np.asarray(point_index)
+        self.point_offsets        = np.asarray(point_offsets)
+        self.point_repeat_offsets = np.asarray(point_repeat_offsets)
+        self.repeat_offsets       = np.asarray(repeat_offsets)
+
+    def __len__(self):
+        return len(self.point_index)
+
+    def _position(self, index):
+
+        matches = np.flatnonzero(self.point_index == index)
+        if len(matches) == 0:
+            raise KeyError(f"Scan point {index} is not in the event archive!")
+        return matches[-1]
+
+    def point(self, index):
+        """
+        All timestamps of scan point (dataset index) `index`.
+        """
+
+        k = self._position(index)
+        return self.timestamps[self.point_offsets[k]:self.point_offsets[k + 1]]
+
+    def shot(self, index, repeat):
+        """
+        Timestamps of repeat `repeat` of scan point `index`.
+        """
+
+        k = self._position(index)
+        r = self.point_repeat_offsets[k] + repeat
+        if r >= self.point_repeat_offsets[k + 1]:
+            raise IndexError(f"Scan point {index} has no repeat {repeat}!")
+        return self.timestamps[self.repeat_offsets[r]:self.repeat_offsets[r + 1]]
@@ -0,0 +1,164 @@
+"""
+Vectorized numeric kernels of the compensation field Bayesian optimizer.
+
+    normal_cdf / normal_pdf:  ufuncs (scipy.special.ndtr), no Python loop per point
+    squared_distances:        ||x1 - x2||**2 by the dot-product expansion
+                              ||x1||**2 + ||x2||**2 - 2 x1.x2, (n, m) memory
+                              instead of the (n, m, d) difference tensor
+    chunked:                  evaluate a function of many candidates in
+                              blocks of rows to bound the temporary memory
+
+Run this file for a micro-benchmark against the previous implementations.
+"""
+import numpy as np
+from scipy.special import ndtr
+
+INV_SQRT2PI = 0.3989422804014327
+THRESHOLD = 1e-9
+CHUNK_SIZE = 4096
+
+
+def normal_cdf(z):
+    return ndtr(z)
+
+def normal_pdf(z):
+    z = np.asarray(z, dtype=float)
+    return INV_SQRT2PI * np.exp(-0.5 * z * z)
+
+def squared_distances(X1, X2):
+    """
+    (n, m) squared Euclidean distances between the rows of X1 (n x d) and X2 (m x d).
+    """
+
+    X1 = np.atleast_2d(np.asarray(X1, dtype=float))
+    X2 = np.atleast_2d(np.asarray(X2, dtype=float))
+
+    D = np.einsum('ij,ij->i', X1, X1)[:, None] + np.einsum('ij,ij->i', X2, X2)[None, :] - 2.0 * (X1 @ X2.T)
+
+    # the expansion can round slightly below zero for (nearly) equal points
+    return np.maximum(D, 0.0, out=D)
+
+def gaussian_kernel(X1, X2, length_scale = 0.3, variance = 1.0):
+    """
+    Squared exponential kernel variance * exp(-||x1 - x2||**2 / (2 length_scale**2)),
+    `length_scale` a scalar or one per dimension.
+    """
+
+    length_scale = np.asarray(length_scale, dtype=float)
+    if length_scale.ndim == 0:
+        D = squared_distances(X1, X2) / (length_scale ** 2 + 1e-16)
+    else:
+        D = squared_distances(np.atleast_2d(X1) / length_scale, np.atleast_2d(X2) / length_scale)
+
+    np.multiply(D, -0.5, out=D)
+    np.exp(D, out=D)
+    return np.multiply(D, variance, out=D)
+
+def expected_improvement(mu, sigma, y_best, xi = 0.01):
+    """
+    EI = (mu - y_best - xi) * Phi(Z) + sigma * phi(Z), Z = (mu - y_best - xi) / sigma,
+    0 where sigma < THRESHOLD.
+    """
+
+    mu = np.asarray(mu, dtype=float)
+    sigma = np.asarray(sigma, dtype=float)
+
+    sigma_safe = np.maximum(sigma, THRESHOLD)
+    improvement = mu - y_best - xi
+    Z = improvement / sigma_safe
+
+    ei = improvement * normal_cdf(Z) + sigma_safe * normal_pdf(Z)
+    return np.where(sigma < THRESHOLD, 0.0, ei)
+
+def chunked(func, X, chunk_size = CHUNK_SIZE):
+    """
+    func(X) evaluated on blocks of `chunk_size` rows of X, the results
+    (an array or a tuple of arrays, one row per point) concatenated.
+    """
+
+    X = np.atleast_2d(X)
+    if len(X) <= chunk_size:
+        return func(X)
+
+    parts = [func(X[i:i + chunk_size]) for i in range(0, len(X), chunk_size)]
+    if isinstance(parts[0], tuple):
+        return tuple(np.concatenate(p) for p in zip(*parts))
+    return np.concatenate(parts)
+
+if __name__ == "__main__":
+
+    import time
+    from math import erf
+
+    # Previous implementations, for reference
+    erf_vec = np.vectorize(erf)
+
+    def legacy_similarity(X1, X2, length_scale = 0.3, variance = 1.0):
+        diff = X1[:, None, :] - X2[None, :, :]
+        D = np.sum(diff * diff, axis=2)
+        return variance * np.exp(-0.5 * D / (length_scale ** 2 + 1e-16))
+
+    def legacy_ei(mu, sigma, y_best, xi = 0.01):
+        sigma_safe = np.where(sigma <= THRESHOLD, THRESHOLD, sigma)
+        improvement = mu - y_best - xi
+        Z = improvement / sigma_safe
+        ei = improvement * 0.5 * (1.0 + erf_vec(Z / np.sqrt(2))) + sigma_safe * INV_SQRT2PI * np.exp(-0.5 * Z * Z)
+        return np.where(sigma < THRESHOLD, 0.0, ei)
+
+    def legacy_predictor(X_train, y_train, X_test, noise = 1e-3, length_scale = 0.3, variance = 1.0):
+        K = legacy_similarity(X_train, X_train, length_scale, variance)
+        K[np.diag_indices_from(K)] += noise ** 2
+        Ks = legacy_similarity(X_train, X_test, length_scale, variance)
+        L = np.linalg.cholesky(K)
+        alpha = np.linalg.solve(L.T, np.linalg.solve(L, y_train))
+        v = np.linalg.solve(L, Ks)
+        Kss_diag = np.diag(legacy_similarity(X_test, X_test, length_scale, variance))
+        return Ks.T @ alpha, np.sqrt(np.maximum(Kss_diag - np.sum(v * v, axis=0), 0.0))
+
+    def best_time(func, repeat = 5):
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - t0)
+        return min(times)
+
+    rng = np.random.default_rng(0)
+    X_train = rng.random((60, 3))
+
+    print(f"{'candidates':>10} | {'kernel old':>10} {'new':>9} {'x':>5} | {'EI old':>9} {'new':>9} {'x':>5}")
+    for m in (1000, 10000, 100000):
+        X_test = rng.random((m, 3))
+        mu, sigma = rng.normal(size=m), rng.random(m)
+
+        assert np.allclose(legacy_similarity(X_train, X_test), gaussian_kernel(X_train, X_test), atol=1e-12)
+        assert np.allclose(legacy_ei(mu, sigma, 0.5), expected_improvement(mu, sigma, 0.5), atol=1e-12)
+
+        t_k_old = best_time(lambda: legacy_similarity(X_train, X_test))
+        t_k_new = best_time(lambda: chunked(lambda X: gaussian_kernel(X, X_train), X_test))
+        t_ei_old = best_time(lambda: legacy_ei(mu, sigma, 0.5), repeat = 2)
+        t_ei_new = best_time(lambda: expected_improvement(mu, sigma, 0.5))
+
+        print(f"{m:>10} | {t_k_old*1e3:>8.2f}ms {t_k_new*1e3:>7.2f}ms {t_k_old/t_k_new:>5.1f} | "
+              f"{t_ei_old*1e3:>7.2f}ms {t_ei_new*1e3:>7.2f}ms {t_ei_old/t_ei_new:>5.0f}")
+
+    # Whole candidate evaluation of a BO step: GP prediction and EI
+    from helper_functions import gaussian_process_predictor
+    y_train = rng.normal(size=len(X_train))
+
+    print(f"\n{'candidates':>10} | {'GP + EI old':>11} {'new':>9} {'x':>5}")
+    for m in (1000, 10000, 100000):
+        X_test = rng.random((m, 3))
+
+        t_new = best_time(lambda: expected_improvement(*gaussian_process_predictor(X_train, y_train, X_test), 0.5), repeat = 3)
+        if m > 20000:
+            # the old predictor builds the full (m, m) test similarity matrix for its diagonal
+            print(f"{m:>10} | {'(m x m)':>11} {t_new*1e3:>7.2f}ms")
+            continue
+
+        mu_old, sigma_old = legacy_predictor(X_train, y_train, X_test)
+        mu_new, sigma_new = gaussian_process_predictor(X_train, y_train, X_test)
+        assert np.allclose(mu_old, mu_new, atol=1e-8) and np.allclose(sigma_old, sigma_new, atol=1e-6)
+
+        t_old = best_time(lambda: legacy_ei(*legacy_predictor(X_train, y_train, X_test), 0.5), repeat = 2)
+        print(f"{m:>10} | {t_old*1e3:>9.2f}ms {t_new*1e3:>7.2f}ms {t_old/t_new:>5.0f}")
@@ -0,0 +1,597 @@
+"""
+Stateful Gaussian Process surrogate for the compensation field optimizer.
+
+`gaussian_process_hyperparameters` and `gaussian_process_predictor` rebuild
+and factorize the kernel matrix of every (length scale, relative noise)
+candidate from scratch for each suggestion, O(n^3) x 25 per BO step. Between
+two suggestions the optimizer only appends one measured point, so
+`GPSurrogate` keeps the Cholesky factor of every candidate and borders it with
+the new row and column (O(n^2) each), together with L^-1 y and log|K| for the
+log-marginal likelihood.
+
+The y normalization enters the kernel (variance and relative noise), so it is
+frozen when the factors are built and only re-anchored (full rebuild) when the
+mean or spread of the data drifts away from it.
+
+`ARDSurrogate` fits the hyperparameters continuously instead (per-dimension
+length scales, signal variance and noise) by maximizing the log-marginal
+likelihood with its analytic gradient.
+"""
+import copy
+import numpy as np
+from scipy.linalg import solve_triangular
+from scipy.optimize import minimize
+
+
+from gp_math import gaussian_kernel, normal_cdf, normal_pdf, chunked, THRESHOLD
+
+LENGTH_SCALE_LEVELS = (0.10, 0.15, 0.2, 0.25, 0.3)
+REL_NOISE_LEVELS = (0.02, 0.03, 0.04, 0.05, 0.06)
+
+
+def expected_improvement_grad(mu, sigma, dmu, dsigma, y_best, xi = 0.01):
+    """
+    Expected improvement (see `expected_improvement`) and its gradient
+        dEI/dx = Phi(Z) dmu/dx + phi(Z) dsigma/dx
+    """
+
+    sigma_safe = np.maximum(sigma, THRESHOLD)
+    improvement = mu - y_best - xi
+    Z = improvement / sigma_safe
+
+    Phi = normal_cdf(Z)
+    phi = normal_pdf(Z)
+
+    ei = np.where(sigma < THRESHOLD, 0.0, improvement * Phi + sigma_safe * phi)
+    grad = np.where((sigma < THRESHOLD)[:, None], 0.0, Phi[:, None] * dmu + phi[:, None] * dsigma)
+
+    return ei, grad
+
+
+class _Factor(object):
+    """
+    Cholesky factor of one hyperparameter candidate.
+        L:       lower Cholesky factor of K + diag(noise**2)
+        z:       L^-1 y
+        log_det: log|K + diag(noise**2)|
+    """
+
+    def __init__(self, length_scale, rel_noise):
+
+        self.length_scale = length_scale
+        self.rel_noise = rel_noise
+        self.L = np.zeros((0, 0))
+        self.z = np.zeros(0)
+        self.log_det = 0.0
+
+    @property
+    def lml(self):
+        # log-marginal likelihood (up to a constant)
+        return -0.5 * (self.z @ self.z) - 0.5 * self.log_det
+
+    def alpha(self):
+        # (K + diag(noise**2))^-1 y
+        return solve_triangular(self.L, self.z, lower=True, trans='T')
+
+
+class _SurrogateBase(object):
+    """
+    Parts shared by the GP surrogates on normalized coordinates ([0, 1] per
+    dimension): the anchored y normalization, prediction, acquisition
+    maximization and the Kriging believer. Subclasses fit the model in `fit`,
+    provide the selected model through `_predictive` and add a point to it
+    in `_add_point`.
+        drift_tol: re-anchor the y normalization when the mean moved by more
+                   than `drift_tol` anchored standard deviations, or the standard
+                   deviation changed by more than a factor (1 + drift_tol)
+    """
+
+    def __init__(self, drift_tol = 0.25, xi = 0.01):
+
+        self.drift_tol = drift_tol
+        self.xi = xi
+
+        self.X = np.zeros((0, 0))
+        self.y = np.zeros(0)                # original units
+        self.y_norm = (0.0, 1.0)            # anchored (mean, std)
+        self.variance = 1.0
+
+        self.n_rebuilds = 0
+        self.n_updates = 0
+
+    # 1) Internal Methods
+    #================================================================
+    def _normalized(self, y):
+        return (np.asarray(y, dtype=float) - self.y_norm[0]) / self.y_norm[1]
+
+    def _anchor(self, y):
+
+        y_std = np.std(y)
+        self.y_norm = (np.mean(y), y_std if y_std > 0 else 1.0)
+
+    def _drifted(self, y):
+
+        y_mean, y_std = np.mean(y), np.std(y)
+        mean_0, std_0 = self.y_norm
+
+        if y_std <= 0 or std_0 <= 0:
+            return True
+        return abs(y_mean - mean_0) > self.drift_tol * std_0 \
+            or abs(np.log(y_std / std_0)) > np.log1p(self.drift_tol)
+
+    def _observations(self, X_normalized, y):
+        """
+        (X, y, extend): the observations as arrays, extend is True if the
+        points already in the model are a prefix of them and the anchored y
+        normalization still holds.
+        """
+
+        X = np.atleast_2d(np.asarray(X_normalized, dtype=float))
+        y = np.asarray(y, dtype=float)
+
+        n_old = len(self.y)
+        is_prefix = (0 < n_old <= len(y)) and self.X.shape[1] == X.shape[1] \
+            and np.array_equal(self.X, X[:n_old]) and np.array_equal(self.y, y[:n_old])
+
+        return X, y, is_prefix and not self._drifted(y)
+
+    def _predictive(self):
+        # (length scale(s), variance, L, alpha) of the selected model
+        raise NotImplementedError
+
+    def _add_point(self, x_new, y_new):
+        # extend the selected model by one observation, same hyperparameters
+        raise NotImplementedError
+
+    # 2) Usages
+    #================================================================
+    @property
+    def y_best_normalized(self):
+        return float(np.max(self._normalized(self.y)))
+
+    def predict(self, X_test):
+        """
+        Mean and uncertainty at `X_test` (normalized coordinates), in normalized y units.
+        """
+
+        ell, variance, L, alpha = self._predictive()
+
+        def _predict(X_chunk):
+            Ks = gaussian_kernel(self.X, X_chunk, length_scale=ell, variance=variance)
+            v = solve_triangular(L, Ks, lower=True)
+            return Ks.T @ alpha, np.sqrt(np.maximum(variance - np.sum(v * v, axis=0), 0.0))
+
+        # chunks bound the memory of Ks for many candidates
+        return chunked(_predict, X_test)
+
+    def predict_with_grad(self, X_test):
+        """
+        (mu, sigma, dmu/dx, dsigma/dx) at `X_test`, the gradients are (m, d).
+        With the squared exponential kernel dk_i/dx = -k_i (x - x_i) / ell**2.
+        """
+
+        X_test = np.atleast_2d(X_test)
+        ell, variance, L, alpha = self._predictive()
+        Ks = gaussian_kernel(self.X, X_test, length_scale=ell, variance=variance)
+
+        mu = Ks.T @ alpha
+        v = solve_triangular(L, Ks, lower=True)
+        var = np.maximum(variance - np.sum(v * v, axis=0), 0.0)
+        sigma = np.sqrt(var)
+
+        # sum_i a_i dk_i/dx, with a = alpha for the mean and a = K^-1 k for the variance
+        dmu = -(X_test * mu[:, None] - (Ks * alpha[:, None]).T @ self.X) / ell ** 2
+
+        beta = solve_triangular(L, v, lower=True, trans='T') * Ks
+        dvar = 2.0 * (X_test * np.sum(beta, axis=0)[:, None] - beta.T @ self.X) / ell ** 2
+        dsigma = np.where(sigma[:, None] > THRESHOLD, dvar / (2.0 * np.maximum(sigma, THRESHOLD)[:, None]), 0.0)
+
+        return mu, sigma, dmu, dsigma
+
+    def maximize(self, candidates, values = None, n_starts = 8, acquisition = 'ei', xi = None, seed = None):
+        """
+        Maximize the expected improvement (or the posterior mean, acquisition = 'mean')
+        over [0, 1]^d. Starts from the best of `candidates` (normalized, with
+        their acquisition `values` if already known) and from the neighbourhood
+        of the best observations, all refined together by one L-BFGS-B run on
+        the summed acquisition with analytic gradients.
+        Returns (x_normalized, value).
+        """
+
+        rng = np.random.default_rng(seed)
+        candidates = np.atleast_2d(candidates)
+        d = candidates.shape[1]
+        xi = self.xi if xi is None else xi
+        y_best = self.y_best_normalized
+
+        def value_and_grad(X):
+            mu, sigma, dmu, dsigma = self.predict_with_grad(X)
+            if acquisition == 'mean':
+                return mu, dmu
+            return expected_improvement_grad(mu, sigma, dmu, dsigma, y_best, xi)
+
+        if values is None:
+            values = value_and_grad(candidates)[0]
+
+        # starting points
+        n_lhs = max(1, n_starts // 2)
+        n_obs = min(n_starts - n_lhs, len(self.y))
+        top_candidates = candidates[np.argsort(values)[-n_lhs:]]
+        top_observed = self.X[np.argsort(self.y)[len(self.y) - n_obs:]]
+        X0 = np.vstack([top_candidates, np.clip(top_observed + rng.normal(0, 0.05, top_observed.shape), 0.0, 1.0)])
+
+        # the acquisition can be tiny, scale it to O(1) for the convergence criteria
+        scale = 1.0 / max(np.max(np.abs(value_and_grad(X0)[0])), 1e-12)
+
+        def objective(flat):
+            v, g = value_and_grad(flat.reshape(-1, d))
+            return -scale * np.sum(v), -scale * g.ravel()
+
+        res = minimize(objective, X0.ravel(), jac=True, method='L-BFGS-B', bounds=[(0.0, 1.0)] * X0.size)
+        X_opt = res.x.reshape(-1, d)
+        v_opt = value_and_grad(X_opt)[0]
+
+        # never worse than the best candidate
+        i, j = np.argmax(v_opt), np.argmax(values)
+        if v_opt[i] >= values[j]:
+            return X_opt[i], float(v_opt[i])
+        return candidates[j], float(values[j])
+
+    def fantasize(self, x_normalized):
+        """
+        Copy of the surrogate that believes `x_normalized` was measured at its
+        predicted mean (Kriging believer), with the same hyperparameters.
+        """
+
+        x = np.atleast_2d(x_normalized)
+        other = copy.deepcopy(self)
+        other._add_point(x, float(self.denormalize(self.predict(x)[0][0])))
+        return other
+
+    def denormalize(self, y_normalized):
+        return np.asarray(y_normalized) * self.y_norm[1] + self.y_norm[0]
+
+
+class GPSurrogate(_SurrogateBase):
+    """
+    GP surrogate with the hyperparameter grid of `gaussian_process_hyperparameters`.
+
+        surrogate = GPSurrogate()
+        surrogate.fit(X_normalized, y)        # every BO step, y in original units
+        mu, sigma = surrogate.predict(X_test) # normalized units, see `y_norm`
+
+    `fit` extends the factors if the previous points are a prefix of the new
+    ones, and rebuilds them otherwise (see `_SurrogateBase` for `drift_tol`).
+    """
+
+    def __init__(self, length_scales = LENGTH_SCALE_LEVELS, rel_noises = REL_NOISE_LEVELS,
+                 abs_noise = 0.02, drift_tol = 0.25, xi = 0.01):
+
+        super().__init__(drift_tol = drift_tol, xi = xi)
+
+        self.length_scales = tuple(length_scales)
+        self.rel_noises = tuple(rel_noises)
+        self.abs_noise = abs_noise
+        self._factors = []
+        self._best = None
+
+    # 1) Internal Methods
+    #================================================================
+    def _noise2(self, y_normalized, rel_noise):
+        return (self.abs_noise ** 2) * self.variance + (rel_noise * y_normalized) ** 2
+
+    def _rebuild(self, X, y):
+
+        self._anchor(y)
+        self.variance = max(np.var(self._normalized(y)), 1e-12)
+        self._factorize(X, y)
+        self.n_rebuilds += 1
+
+    def _factorize(self, X, y, jitter = 0.0):
+        # full factors of every candidate, at the current normalization and variance
+
+        y_normalized = self._normalized(y)
+
+        factors = []
+        for ell in self.length_scales:
+            K = gaussian_kernel(X, X, length_scale=ell, variance=self.variance)
+            for rel_noise in self.rel_noises:
+                factor = _Factor(ell, rel_noise)
+
+                K_ = K.copy()
+                K_[np.diag_indices_from(K_)] += self._noise2(y_normalized, rel_noise) + jitter
+
+                factor.L = np.linalg.cholesky(K_)
+                factor.z = solve_triangular(factor.L, y_normalized, lower=True)
+                factor.log_det = 2.0 * np.sum(np.log(np.diag(factor.L)))
+                factors.append(factor)
+
+        self._factors = factors
+        self.X, self.y = X, y
+
+    def _append(self, x_new, y_new):
+        """
+        Border every factor with one point, False if a factor lost positive definiteness.
+        """
+
+        y_new_normalized = float(self._normalized(y_new))
+        k_new = {ell: gaussian_kernel(self.X, x_new, length_scale=ell, variance=self.variance)[:, 0]
+                 for ell in self.length_scales}
+
+        bordered = []
+        for factor in self._factors:
+            ell = factor.length_scale
+
+            c = solve_triangular(factor.L, k_new[ell], lower=True)
+            d2 = self.variance + self._noise2(y_new_normalized, factor.rel_noise) - c @ c
+            if d2 <= 1e-12:
+                return False
+            d = np.sqrt(d2)
+
+            n = len(factor.z)
+            L = np.zeros((n + 1, n + 1))
+            L[:n, :n] = factor.L
+            L[n, :n] = c
+            L[n, n] = d
+
+            z_new = (y_new_normalized - c @ factor.z) / d
+            bordered.append((L, np.append(factor.z, z_new), factor.log_det + 2.0 * np.log(d)))
+
+        for factor, (L, z, log_det) in zip(self._factors, bordered):
+            factor.L, factor.z, factor.log_det = L, z, log_det
+
+        self.X = np.vstack([self.X, x_new])
+        self.y = np.append(self.y, y_new)
+        self.n_updates += 1
+        return True
+
+    def _predictive(self):
+        return self._best.length_scale, self.variance, self._best.L, self._best.alpha()
+
+    def _add_point(self, x_new, y_new):
+
+        if self._append(x_new, y_new):
+            return
+
+        # the bordered factor is not positive definite (e.g. a point on top of
+        # another one), factor again with jitter and the same hyperparameters
+        best = (self._best.length_scale, self._best.rel_noise)
+        X, y = np.vstack([self.X, x_new]), np.append(self.y, y_new)
+
+        for jitter in (0.0, 1e-10, 1e-8, 1e-6):
+            try:
+                self._factorize(X, y, jitter=jitter * self.variance)
+                break
+            except np.linalg.LinAlgError:
+                if jitter == 1e-6:
+                    raise
+
+        self._best = next(f for f in self._factors if (f.length_scale, f.rel_noise) == best)
+        self.n_updates += 1
+
+    # 2) Usages
+    #================================================================
+    def fit(self, X_normalized, y):
+        """
+        Bring the surrogate up to date with all observations and select the
+        hyperparameters of the highest log-marginal likelihood.
+        """
+
+        n_old = len(self.y)
+        X, y, extend = self._observations(X_normalized, y)
+
+        if not extend:
+            self._rebuild(X, y)
+        else:
+            for i in range(n_old, len(y)):
+                if not self._append(X[i:i+1], y[i]):
+                    self._rebuild(X, y)
+                    break
+
+        self._best = max(self._factors, key=lambda f: f.lml)
+        return self
+
+    @property
+    def length_scale(self):
+        return self._best.length_scale
+
+    @property
+    def rel_noise(self):
+        return self._best.rel_noise
+
+    @property
+    def lml(self):
+        return self._best.lml
+
+    def noise(self):
+        """
+        Per-point noise of the observations (normalized units) with the selected hyperparameters.
+        """
+
+        return np.sqrt(self._noise2(self._normalized(self.y), self.rel_noise))
+
+
+class ARDSurrogate(_SurrogateBase):
+    """
+    GP surrogate with continuously fitted hyperparameters instead of the grid:
+    one length scale per dimension (ARD), the signal variance and the
+    heteroscedastic noise noise_i**2 = abs_noise**2 + (rel_noise * y_i)**2.
+
+    They maximize the log-marginal likelihood with L-BFGS-B and its analytic
+    gradient, in log space. Every `fit` starts from the previous optimum, and
+    on a re-anchored normalization and every `restart_every` fits also from
+    `n_restarts` random points. The factorization follows the hyperparameters,
+    so it is rebuilt each fit (cheap at the optimizer's n, the likelihood
+    evaluations dominate).
+    """
+
+    # log-space bounds of (length scales, variance, abs_noise, rel_noise), the noise
+    # stays in the range of the grid so that a sparse peak is not explained as noise
+    LOG_BOUNDS = {
+        'length_scale': (np.log(0.03), np.log(3.0)),
+        'variance':     (np.log(0.05), np.log(20.0)),
+        'abs_noise':    (np.log(1e-3), np.log(0.3)),
+        'rel_noise':    (np.log(1e-3), np.log(0.1)),
+    }
+
+    def __init__(self, n_restarts = 4, restart_every = 10, drift_tol = 0.25, xi = 0.01, seed = None):
+
+        super().__init__(drift_tol = drift_tol, xi = xi)
+
+        self.n_restarts = n_restarts
+        self.restart_every = restart_every
+        self.rng = np.random.default_rng(seed)
+
+        self.theta = None                   # log (length scales..., variance, abs_noise, rel_noise)
+        self._fits_since_restart = 0
+        self._L = None
+        self._alpha = None
+
+    # 1) Internal Methods
+    #================================================================
+    def _unpack(self, theta):
+
+        d = len(theta) - 3
+        return np.exp(theta[:d]), np.exp(theta[d]), np.exp(theta[d + 1]), np.exp(theta[d + 2])
+
+    def _kernel(self, X1, X2, length_scales, variance):
+        return gaussian_kernel(X1, X2, length_scale=length_scales, variance=variance)
+
+    def _bounds(self, d):
+
+        b = self.LOG_BOUNDS
+        return [b['length_scale']] * d + [b['variance'], b['abs_noise'], b['rel_noise']]
+
+    def _neg_lml(self, theta, X, y_normalized, D):
+        """
+        Negative log-marginal likelihood and its gradient with respect to theta.
+            D: (d, n, n) squared coordinate differences per dimension
+        """
+
+        length_scales, variance, abs_noise, rel_noise = self._unpack(theta)
+        n = len(y_normalized)
+
+        K = variance * np.exp(-0.5 * np.tensordot(1.0 / length_scales ** 2, D, axes=1))
+        noise2_rel = (rel_noise * y_normalized) ** 2
+        K_y = K.copy()
+        K_y[np.diag_indices(n)] += abs_noise ** 2 + noise2_rel + 1e-10
+
+        try:
+            L = np.linalg.cholesky(K_y)
+        except np.linalg.LinAlgError:
+            return 1e10, np.zeros_like(theta)
+
+        z = solve_triangular(L, y_normalized, lower=True)
+        alpha = solve_triangular(L, z, lower=True, trans='T')
+        lml = -0.5 * (z @ z) - np.sum(np.log(np.diag(L)))
+
+        # dLML/dtheta_j = 0.5 tr(W dK_y/dtheta_j), W = alpha alpha^T - K_y^-1
+        L_inv = solve_triangular(L, np.eye(n), lower=True)
+        W = np.outer(alpha, alpha) - L_inv.T @ L_inv
+        WK = W * K
+
+        grad = np.empty_like(theta)
+        grad[:-3] = 0.5 * np.tensordot(D, WK, axes=([1, 2], [0, 1])) / length_scales ** 2
+        grad[-3] = 0.5 * np.sum(WK)
+        grad[-2] = abs_noise ** 2 * np.trace(W)
+        grad[-1] = np.diag(W) @ noise2_rel
+
+        return -lml, -grad
+
+    def _factorize(self):
+        # factorization at the current hyperparameters
+
+        length_scales, variance, abs_noise, rel_noise = self._unpack(self.theta)
+        y_normalized = self._normalized(self.y)
+
+        K_y = self._kernel(self.X, self.X, length_scales, variance)
+        K_y[np.diag_indices_from(K_y)] += abs_noise ** 2 + (rel_noise * y_normalized) ** 2 + 1e-10
+
+        self.variance = variance
+        self._L = np.linalg.cholesky(K_y)
+        self._alpha = solve_triangular(self._L, solve_triangular(self._L, y_normalized, lower=True), lower=True, trans='T')
+
+    def _optimize(self, X, y_normalized, restart):
+
+        d = X.shape[1]
+        bounds = self._bounds(d)
+        D = (X[:, None, :] - X[None, :, :]).transpose(2, 0, 1) ** 2
+
+        starts = []
+        if self.theta is not None and len(self.theta) == d + 3:
+            starts.append(self.theta)
+        else:
+            # same scales as the middle of the grid
+            starts.append(np.log(np.r_[[0.2] * d, 1.0, 0.02, 0.04]))
+            restart = True
+        if restart:
+            low, high = np.array(bounds).T
+            starts.extend(low + self.rng.random((self.n_restarts, d + 3)) * (high - low))
+
+        best = None
+        for theta0 in starts:
+            res = minimize(self._neg_lml, theta0, args=(X, y_normalized, D), jac=True,
+                           method='L-BFGS-B', bounds=bounds)
+            if best is None or res.fun < best.fun:
+                best = res
+
+        return best.x
+
+    def _predictive(self):
+
+        length_scales, variance, _, _ = self._unpack(self.theta)
+        return length_scales, variance, self._L, self._alpha
+
+    def _add_point(self, x_new, y_new):
+
+        self.X = np.vstack([self.X, x_new])
+        self.y = np.append(self.y, y_new)
+        self._factorize()
+
+    # 2) Usages
+    #================================================================
+    def fit(self, X_normalized, y):
+
+        X, y, extend = self._observations(X_normalized, y)
+
+        restart = self._fits_since_restart >= self.restart_every
+        if not extend:
+            self._anchor(y)
+            self.n_rebuilds += 1
+            restart = True
+        else:
+            self.n_updates += 1
+        self._fits_since_restart = 0 if restart else self._fits_since_restart + 1
+
+        self.X, self.y = X, y
+        self.theta = self._optimize(X, self._normalized(y), restart)
+
+        self._factorize()
+        return self
+
+    @property
+    def length_scales(self):
+        return self._unpack(self.theta)[0]
+
+    @property
+    def length_scale(self):
+        # geometric mean, for the scalar `length_scale` dataset
+        return float(np.exp(np.mean(np.log(self.length_scales))))
+
+    @property
+    def abs_noise_fit(self):
+        return float(self._unpack(self.theta)[2])
+
+    @property
+    def rel_noise(self):
+        return float(self._unpack(self.theta)[3])
+
+    @property
+    def lml(self):
+        return -self._neg_lml(self.theta, self.X, self._normalized(self.y),
+                              (self.X[:, None, :] - self.X[None, :, :]).transpose(2, 0, 1) ** 2)[0]
+
+    def noise(self):
+
+        _, _, abs_noise, rel_noise = self._unpack(self.theta)
+        return np.sqrt(abs_noise ** 2 + (rel_noise * self._normalized(self.y)) ** 2)
@@ -1,15 +1,11 @@
 import numpy as np
 import os
-
-from math import erf
-erf_vec = np.vectorize(erf)
+from scipy.linalg import solve_triangular
 
 from amp_zotino_params import fit_parameters, old_coeffs
-
-# Constants
-INV_SQRT2PI = 0.39894228040
-SQRT2 = 1.41421356237
-THRESHOLD = 1e-9
+import gp_math
+from gp_math import INV_SQRT2PI, THRESHOLD
+from gp_surrogate import GPSurrogate
 
 ####################################################################
 ################  Functions for DC Voltage Control  ################
@@ -29,13 +25,33 @@ def calculate_input_voltage(chan, volt, use_amp = True):
 
     return input_voltage
 
+def input_voltage_coefficients(channels, use_amp = True):
+    """
+    Per-channel calibration of calculate_input_voltage as vectors,
+    input_voltage = gain * volt + bias.
+    """
+
+    if use_amp: key = 'Input→Amp'
+    else: key = 'Input→Artiq'
+
+    gain = np.zeros(len(channels))
+    bias = np.zeros(len(channels))
+    for i, chan in enumerate(channels):
+        try:
+            k = fit_parameters[chan + 1][key]['k']
+            b = fit_parameters[chan + 1][key]['b']
+            gain[i], bias[i] = 1.0 / k, -b / k
+        except KeyError:
+            gain[i], bias[i] = old_coeffs[chan]
+
+    return gain, bias
+
 def adjust_control_voltages(target, use_amp = True):
 
     channels, voltages = target
 
-    input_vector = np.zeros(len(channels))
-    for i in range(len(channels)):
-        input_vector[i] = calculate_input_voltage(channels[i], voltages[i], use_amp)
+    gain, bias = input_voltage_coefficients(channels, use_amp)
+    input_vector = gain * np.asarray(voltages, dtype=float) + bias
 
     return (channels, input_vector)
 
@@ -143,16 +159,8 @@ def gaussian_similarity(X1, X2, length_scale = 0.3, variance = 1.0):
        K: similarity matrix between samples X1 and X2
     """
 
-    # Make sure input X1 and X2 are at least 2D arrays
-    X1 = np.atleast_2d(X1).astype(float)
-    X2 = np.atleast_2d(X2).astype(float)
-
-    # Compute Euclidean distance ||x-x'||**2 for the sample
-    diff = X1[:, None, :] - X2[None, :, :]
-    D = np.sum(diff * diff, axis=2)
-
-    # Compute similarity matrix and return
-    return variance * np.exp(-0.5 * D / (length_scale ** 2 + 1e-16))
+    # Distances by dot-product expansion, no (n, m, d) difference tensor
+    return gp_math.gaussian_kernel(X1, X2, length_scale=length_scale, variance=variance)
 
 def normalize_coordinates(X, bounds):
     """
@@ -226,29 +234,28 @@ def gaussian_process_predictor(X_train, y_train, X_test,
     noise = np.asarray(noise, dtype=float)
     K[np.diag_indices_from(K)] += noise ** 2
 
-    # Calculate similarity matrix between training and target points
-    Ks = gaussian_similarity(X_train, X_test,
-                             length_scale=length_scale, variance=variance)
-    
     # Solve for prediction
     # --------------------------------------------------------
     # 1) Use Cholesky factorization to achieve fast and reliable inversion
     L = np.linalg.cholesky(K)
     
     # 2) Solve for (K + noise**2 * I).inv * y using the result of Cholesky
-    alpha = np.linalg.solve(L.T, np.linalg.solve(L, y_train))
+    alpha = solve_triangular(L.T, solve_triangular(L, y_train, lower=True), lower=False)
 
-    # 3) Solve for (K + noise**2 * I).inv * Ks using the result of Cholesky
-    v = np.linalg.solve(L, Ks)
-    
-    # 4) Calculate averages and uncertainties
-    mu = Ks.T @ alpha
-    Kss_diag = np.diag(gaussian_similarity(X_test, X_test,
-                                           length_scale=length_scale,
-                                           variance=variance))
-    var = np.maximum(Kss_diag - np.sum(v * v, axis=0), 0.0)
+    def _predict(X_chunk):
+
+        # 3) Similarity between training and target points, (K + noise**2 * I).inv * Ks
+        Ks = gaussian_similarity(X_train, X_chunk,
+                                 length_scale=length_scale, variance=variance)
+        v = solve_triangular(L, Ks, lower=True)
+
+        # 4) Calculate averages and uncertainties, diag(Kss) = variance
+        mu = Ks.T @ alpha
+        var = np.maximum(variance - np.sum(v * v, axis=0), 0.0)
+        return mu, np.sqrt(var)
 
-    return mu, np.sqrt(var)
+    # Evaluate the targets in chunks to bound the memory of Ks
+    return gp_math.chunked(_predict, X_test)
 
 def expected_improvement(mu, sigma, y_best, xi=0.01):
     """
@@ -278,26 +285,8 @@ def expected_improvement(mu, sigma, y_best, xi=0.01):
        ei: Expected improvement at each proposed point
     """
 
-    # Avoid division by zero
-    sigma_safe = np.where(sigma <= THRESHOLD, THRESHOLD, sigma)
-
-    # Helper functions
-    # ----------------------
-    # 1) Normal distribution - Density Function
-    def _phi(z):
-        return INV_SQRT2PI * np.exp(-0.5 * z * z)
-    # 2) Normal distribution - Cumulative Function
-    def _Phi(z):
-        return 0.5 * (1.0 + erf_vec(z / SQRT2))
-    
-    # Calculate expected improvement
-    improvement = mu - y_best - xi
-    Z = improvement / sigma_safe
-    ei = improvement * _Phi(Z) + sigma_safe * _phi(Z)
-
-    ei = np.where(sigma < THRESHOLD, 0.0, ei)
-
-    return ei
+    # Normal CDF as a ufunc (scipy.special.ndtr), see gp_math.py
+    return gp_math.expected_improvement(mu, sigma, y_best, xi=xi)
 
 def gaussian_process_hyperparameters(X_train, y_train):
     """
@@ -369,11 +358,14 @@ def gaussian_process_hyperparameters(X_train, y_train):
 def bo_suggest_next(X_observed, y_observed, bounds,
                     n_candidates = 256,
                     auto_mode    = True,
-                    length_scale = 0.3,
-                    variance     = 1.0,
-                    noise        = 1e-2,
-                    xi           = 0.01,
-                    seed         = None):
+                    length_scale = None,
+                    variance     = None,
+                    noise        = None,
+                    xi           = None,
+                    seed         = None,
+                    surrogate    = None,
+                    n_starts     = 0,
+                    batch_size   = 1):
     """
     Propose the next field setpoint from current BO state
     -----------------------------------------------------
@@ -391,44 +383,117 @@ def bo_suggest_next(X_observed, y_observed, bounds,
        n_candidates: int, number of trial points drawn for EI evaluation
        auto_mode:    bool, fit kernel hyperparameters from data when True
        length_scale: float, kernel width used when auto_mode is False
+                     (default 0.3)
        variance:     float, kernel amplitude used when auto_mode is False
+                     (default 1.0)
        noise:        float or array-like, assumed noise on measurements when
-                     auto_mode is False
+                     auto_mode is False (default 1e-2)
        xi:           float, exploration offset for EI when auto_mode is False
+                     (default 0.01), with a surrogate overrides its `xi`
        seed:         int or None, RNG seed for reproducible candidate draws
+       surrogate:    GPSurrogate, ARDSurrogate or None, keeps the GP between
+                     calls and extends it with the new points (see
+                     gp_surrogate.py). It always fits its own kernel, so
+                     auto_mode=False, length_scale, variance or noise raise
+                     a ValueError together with a surrogate
+       n_starts:     int, with a surrogate refine the best candidates and
+                     the neighbourhood of the best observations with
+                     multi-start L-BFGS-B on EI, 0 takes the best candidate
+       batch_size:   int, number of points to propose (q-EI by Kriging
+                     believer: every further point is chosen as if the
+                     previous ones were measured at their predicted mean).
+                     Needs a surrogate, a GPSurrogate is used if none is
+                     given, so it raises a ValueError with auto_mode=False
     -----------------------------------------------------
     2) Returns
-       candidates[idx]: suggested next point in the original coordinate scale
-       ei[idx]:         expected improvement associated with the suggestion
+       suggestion: suggested next point in the original coordinate scale,
+                   [batch_size x n_dimension] if batch_size > 1
+       ei:         expected improvement associated with the suggestion(s)
+       (length_scale, best_rel_noise): selected hyperparameters
     """
 
-    # Normalize X and y scale for better numerical stability
+    bounds = np.asarray(bounds, dtype=float)
+    fixed_kernel = [name for name, value in (('length_scale', length_scale), ('variance', variance), ('noise', noise))
+                    if value is not None]
+
+    if batch_size > 1 and surrogate is None:
+        if not auto_mode:
+            raise ValueError("batch_size > 1 needs a surrogate, which fits its own kernel: use auto_mode=True")
+        surrogate = GPSurrogate()
+
+    if surrogate is not None and not auto_mode:
+        raise ValueError("The surrogate fits its own kernel, auto_mode=False is not supported with a surrogate")
+    if surrogate is not None and fixed_kernel:
+        raise ValueError(f"The surrogate fits its own kernel, {', '.join(fixed_kernel)} cannot be given with a surrogate")
+
+    # Normalize X scale for better numerical stability
     X_normalized = normalize_coordinates(X_observed, bounds)
-    y_normalized, y_norm_param = normalize_values(y_observed)
 
     # Draw a batch of candidates in the domain
     candidates = latin_hypercube(n_candidates, bounds, seed=seed)
     candidates_normalized = normalize_coordinates(candidates, bounds)
 
-    # Learn hyperparameters from observation data if auto mode was on
-    if auto_mode:
-        length_scale, variance, noise, xi, best_rel_noise = gaussian_process_hyperparameters(X_normalized, y_normalized)
-
-    # Fit GP on current observation data
-    mu, sigma = gaussian_process_predictor(X_normalized, y_normalized,
-                                           candidates_normalized,
-                                           noise=noise,
-                                           length_scale=length_scale,
-                                           variance=variance)
+    if surrogate is not None:
+        # Incremental fit, the surrogate keeps its own (anchored) y normalization
+        surrogate.fit(X_normalized, y_observed)
+        length_scale, best_rel_noise = surrogate.length_scale, surrogate.rel_noise
+        xi = surrogate.xi if xi is None else xi
+        y_norm_param = surrogate.y_norm
+
+        mu, sigma = surrogate.predict(candidates_normalized)
+        y_best_normalized = surrogate.y_best_normalized
+
+    else:
+        # Normalize y scale for better numerical stability
+        y_normalized, y_norm_param = normalize_values(y_observed)
+        best_rel_noise = None
+
+        # Learn hyperparameters from observation data if auto mode was on
+        if auto_mode:
+            length_scale, variance, noise, xi, best_rel_noise = gaussian_process_hyperparameters(X_normalized, y_normalized)
+        else:
+            length_scale = 0.3 if length_scale is None else length_scale
+            variance = 1.0 if variance is None else variance
+            noise = 1e-2 if noise is None else noise
+            xi = 0.01 if xi is None else xi
+
+        # Fit GP on current observation data
+        mu, sigma = gaussian_process_predictor(X_normalized, y_normalized,
+                                               candidates_normalized,
+                                               noise=noise,
+                                               length_scale=length_scale,
+                                               variance=variance)
+        y_best_normalized = np.max(y_normalized)
 
     # Calculated expected improvements for candidates
-    y_best_normalized = np.max(y_normalized)
     ei = expected_improvement(mu, sigma, y_best_normalized, xi=xi)
 
-    # Suggest the next point and its expected improvement
-    idx = np.argmax(ei)
-    
-    # Temporary
-    print(f"  suggest_next: {mu[idx] * y_norm_param[1] + y_norm_param[0]:.3f}, {sigma[idx]:.3f}")
-    
-    return candidates[idx], ei[idx], (length_scale, best_rel_noise)
+    suggestions = []
+    eis = []
+    model = surrogate
+    for k in range(batch_size):
+
+        if k > 0:
+            # Kriging believer: condition on the previous suggestion at its predicted mean
+            model = model.fantasize(x_best)
+            mu, sigma = model.predict(candidates_normalized)
+            ei = expected_improvement(mu, sigma, model.y_best_normalized, xi=xi)
+
+        # Suggest the next point and its expected improvement
+        idx = np.argmax(ei)
+        x_best, ei_best, mu_best, sigma_best = candidates_normalized[idx], ei[idx], mu[idx], sigma[idx]
+
+        if model is not None and n_starts > 0:
+            x_best, ei_best = model.maximize(candidates_normalized, ei, n_starts=n_starts, xi=xi,
+                                             seed=None if seed is None else seed + k)
+            mu_best, sigma_best = (v[0] for v in model.predict(x_best))
+
+        # Temporary
+        print(f"  suggest_next: {mu_best * y_norm_param[1] + y_norm_param[0]:.3f}, {sigma_best:.3f}")
+
+        suggestions.append(bounds[:, 0] + x_best * (bounds[:, 1] - bounds[:, 0]))
+        eis.append(ei_best)
+
+    if batch_size == 1:
+        return suggestions[0], eis[0], (length_scale, best_rel_noise)
+    return np.array(suggestions), np.array(eis), (length_scale, best_rel_noise)
@@ -0,0 +1,144 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+
+class PostProcessingError(RuntimeError):
+    """
+    Raised on the main thread when the post-processing of scan point `ind` failed.
+    """
+
+    def __init__(self, ind, err):
+        self.ind = ind
+        self.err = err
+        super().__init__(f"Post-processing of point {ind} failed: {type(err).__name__}: {err}")
+
+
+class DeferredDatasets(object):
+    """
+    Stand-in for the experiment in post-processing jobs, records `set_dataset`
+    and `mutate_dataset` calls instead of sending them.
+
+    Dataset updates go through the worker's pipe to the master, which must
+    only be used from the main thread, so the recorded calls are replayed
+    there by `apply`. A `set_dataset` overwritten by a later one of the same
+    key (with no mutation in between) is dropped.
+    """
+
+    def __init__(self):
+
+        self._ops = []
+        self._lock = threading.Lock()
+
+    def set_dataset(self, key, value, **kwargs):
+
+        with self._lock:
+            self._ops.append(('set_dataset', key, (key, value), kwargs))
+
+    def mutate_dataset(self, key, index, value):
+
+        with self._lock:
+            self._ops.append(('mutate_dataset', key, (key, index, value), {}))
+
+    def apply(self, experiment):
+        """
+        Send all recorded calls, in order, from the calling (main) thread.
+        """
+
+        with self._lock:
+            ops, self._ops = self._ops, []
+
+        # walk backwards: a set is dead if the key is set again later without a mutate in between
+        keep = [True] * len(ops)
+        overwritten = set()
+        for i in range(len(ops) - 1, -1, -1):
+            method, key, _, _ = ops[i]
+            if method == 'set_dataset':
+                if key in overwritten:
+                    keep[i] = False
+                overwritten.add(key)
+            else:
+                overwritten.discard(key)
+
+        for (method, _, args, kwargs), k in zip(ops, keep):
+            if k:
+                getattr(experiment, method)(*args, **kwargs)
+
+        return sum(keep)
+
+
+class PostProcessor(object):
+    """
+    Runs the host-side post-processing of scan points on one worker thread,
+    so that it overlaps with the kernel of the next point.
+
+    Jobs are callables `job(datasets)` taking a `DeferredDatasets`. They run
+    in submission order, at most `max_pending` wait in the queue before
+    `submit` blocks. `submit` returns a `Future` of the job's return value.
+    The first failing job stops the pipeline, its error is raised as
+    `PostProcessingError` by the next `submit`, `apply` or `join` (and by the
+    futures of the failed and all later jobs).
+    """
+
+    def __init__(self, max_pending = 2):
+
+        self.datasets = DeferredDatasets()
+        self._queue = queue.Queue(maxsize = max_pending)
+        self._error = None
+        self._thread = threading.Thread(target = self._work, name = "post-processing", daemon = True)
+        self._thread.start()
+
+    # 1) Internal Methods
+    #================================================================
+    def _work(self):
+
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                ind, job, future = item
+                if self._error is None:
+                    future.set_result(job(self.datasets))
+                else:
+                    future.set_exception(self._error)
+            except BaseException as e:
+                self._error = PostProcessingError(ind, e)
+                future.set_exception(self._error)
+            finally:
+                self._queue.task_done()
+
+    def _check(self):
+
+        if self._error is not None:
+            raise self._error from self._error.err
+
+    # 2) Usages
+    #================================================================
+    def submit(self, ind, job):
+
+        self._check()
+        future = Future()
+        self._queue.put((ind, job, future))
+        return future
+
+    def apply(self, experiment):
+        """
+        Send the dataset updates of the finished jobs, raise if one failed.
+        """
+
+        self.datasets.apply(experiment)
+        self._check()
+
+    def join(self, experiment):
+        """
+        Wait for all submitted jobs, then `apply`.
+        """
+
+        self._queue.join()
+        self.apply(experiment)
+
+    def close(self):
+
+        self._queue.put(None)
+        self._thread.join()
@@ -0,0 +1,170 @@
+"""
+Pre-flight readings of the slow instruments before (or during) a scan point:
+the last wavemeter frequencies of the 422 and 390 lasers from the Laser Lock
+GUI and the RF amplitude from the spectrum analyzer marker.
+
+The laser client and the spectrum analyzer have their own sockets, so the
+readings run in parallel on a small thread pool instead of one after another.
+Only the reading happens on the pool, the datasets are written by
+`InstrumentSnapshot.record` on the calling (main) thread.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class InstrumentSnapshot(object):
+    """
+    Instrument readings of one scan point.
+        freq_422, freq_390: last wavemeter frequencies (THz), 0.0 if the read failed
+        rf_amplitude:       marker amplitude (dBm)
+        t_start, t_end:     host time the readings were issued / all returned
+    """
+
+    def __init__(self, freq_422, freq_390, rf_amplitude, t_start, t_end):
+
+        self.freq_422 = freq_422
+        self.freq_390 = freq_390
+        self.rf_amplitude = rf_amplitude
+        self.t_start = t_start
+        self.t_end = t_end
+
+    def laser_status(self, ref_422, ref_390, tol = 1e-5):
+        """
+        (status_390, status_422), True if the laser is within `tol` of its reference.
+        """
+
+        status_422 = (abs(self.freq_422 - ref_422) <= tol)
+        status_390 = (abs(self.freq_390 - ref_390) <= tol)
+
+        return status_390, status_422
+
+    def record(self, experiment, idx):
+
+        experiment.mutate_dataset('last_frequency_422', idx, self.freq_422)
+        experiment.mutate_dataset('last_frequency_390', idx, self.freq_390)
+        experiment.mutate_dataset('act_RF_amplitude', idx, self.rf_amplitude)
+
+
+class PendingSnapshot(object):
+    """
+    Readings in flight, `result()` waits for them and returns the `InstrumentSnapshot`.
+    """
+
+    def __init__(self, futures, t_start):
+
+        self._futures = futures
+        self._t_start = t_start
+        self._snapshot = None
+
+    def done(self):
+        return all(f.done() for f in self._futures.values())
+
+    def wait(self):
+        """
+        Wait for all readings without raising, used before the instruments are touched again.
+        """
+
+        for f in self._futures.values():
+            try:
+                f.result()
+            except Exception:
+                pass
+
+    def result(self):
+
+        if self._snapshot is None:
+            values = {key: f.result() for key, f in self._futures.items()}
+            self._snapshot = InstrumentSnapshot(
+                values['freq_422'], values['freq_390'], values['rf_amplitude'],
+                self._t_start, time.time()
+            )
+
+        return self._snapshot
+
+
+class InstrumentPreflight(object):
+    """
+    Issues the pre-flight readings of `laser` (LaserClient) and `rf` (RFController) in parallel.
+
+        pending = preflight.start()     # returns immediately
+        ...                             # e.g. run the kernel
+        snapshot = pending.result()
+
+    The two laser queries share one socket and go out as one pipelined
+    request on one worker, the spectrum analyzer query runs on the other.
+    A new `start` waits for the previous readings so that no socket is used
+    by two threads.
+    """
+
+    def __init__(self, laser, rf):
+
+        self.laser = laser
+        self.rf = rf
+        self._pool = ThreadPoolExecutor(max_workers = 2, thread_name_prefix = "preflight")
+        self._pending = None
+
+    # 1) Internal Methods
+    #================================================================
+    def _read_lasers(self):
+
+        # one pipelined request, or none if the client keeps them cached
+        freq_422, freq_390 = self.laser.get_frequencies([422, 390])
+
+        return freq_422, freq_390
+
+    # 2) Usages
+    #================================================================
+    def start(self):
+
+        self.wait()
+
+        lasers = self._pool.submit(self._read_lasers)
+        rf = self._pool.submit(self.rf.get_amplitude)
+
+        futures = {
+            'freq_422': _Item(lasers, 0),
+            'freq_390': _Item(lasers, 1),
+            'rf_amplitude': rf,
+        }
+
+        self._pending = PendingSnapshot(futures, time.time())
+        return self._pending
+
+    def read(self):
+        """
+        Blocking reading, both instruments still in parallel.
+        """
+
+        return self.start().result()
+
+    def wait(self):
+        """
+        Wait for readings still in flight (e.g. after a failed kernel), before the
+        laser client or the RF controller are used from the main thread.
+        """
+
+        if self._pending is not None:
+            self._pending.wait()
+            self._pending = None
+
+    def close(self):
+
+        self.wait()
+        self._pool.shutdown(wait = True)
+
+
+class _Item(object):
+    """
+    Element `index` of the tuple returned by a future.
+    """
+
+    def __init__(self, future, index):
+
+        self._future = future
+        self._index = index
+
+    def done(self):
+        return self._future.done()
+
+    def result(self):
+        return self._future.result()[self._index]
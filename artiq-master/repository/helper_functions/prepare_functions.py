@@ -1,6 +1,7 @@
 import numpy as np
 import pandas as pd
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 # instruments within the `drivers` directory
 sys.path.append("/home/electrons/software/Electrons_Artiq_Sequences/drivers")
@@ -11,7 +12,11 @@ from RF_controller    import RFController
 
 # something within the same directory
 from dc_electrodes  import Electrodes
+from preflight      import InstrumentPreflight
+from gp_surrogate   import GPSurrogate, ARDSurrogate
 from scan_functions import scan_parameter
+from scan_planner   import is_dc_parameter, check_dc_scan, clip_optimizer_bounds
+from run_functions  import start_post_processing
 from base_sequences import (
     zotino_initialization,
     set_multipoles,
@@ -22,23 +27,34 @@ from base_sequences import (
     set_extraction_pulse,
     set_loading_pulse,
     load_lifetime_wait_times,
+    init_timestamp_buffer,
 )
 
 # ===================================================================
 # 1) Master function for prepare
 def ofat_prepare(self):
 
+    # 0) Electrodes first, the scan safety check needs them
+    prepare_electrodes(self)
+
     # 1) Prepare datasets
     prepare_ofat_datasets(self)
     _prepare_with_effective_steps(self, prepare_common_datasets)
     prepare_lifetime_datasets(self)
 
+    # Unsafe scan: run and analyze skip the instruments, do not touch the hardware
+    if not self.scan_ok:
+        return
+
     # 2) Prepare devices
     prepare_instruments(self)
     prepare_initialization(self)
 
 def doe_prepare(self):
 
+    # 0) Electrodes first, the scan safety check needs them
+    prepare_electrodes(self)
+
     # 1) Prepare datasets
     prepare_doe_datasets(self)
 
@@ -50,18 +66,29 @@ def doe_prepare(self):
 
     prepare_lifetime_datasets(self)
 
+    # Unsafe scan: run and analyze skip the instruments, do not touch the hardware
+    if not self.scan_ok:
+        return
+
     # 2) Prepare devices
     prepare_instruments(self)
     prepare_initialization(self)
 
 def optimizer_prepare(self):
 
+    # 0) Electrodes first, the scan safety check needs them
+    prepare_electrodes(self)
+
     # 1) Prepare datasets
     prepare_optimizer_datesets(self)
     self.set_dataset('lifetime', [0] * self.steps, broadcast=True)
     _prepare_with_effective_steps(self, prepare_common_datasets)
     prepare_lifetime_datasets(self)
 
+    # Unsafe scan: run and analyze skip the instruments, do not touch the hardware
+    if not self.scan_ok:
+        return
+
     # 2) Prepare devices
     prepare_instruments(self)
     prepare_initialization(self)
@@ -74,9 +101,9 @@ def prepare_common_datasets(self):
 
     # timestamps for each sequence iteration
     self.set_dataset('timestamps',         [], broadcast=True)
-    
-    # data sets to save all time stamps
-    self.set_dataset('arr_of_timestamps',  [ [] for _ in range(self.steps) ], broadcast=True)
+
+    # all time stamps of the run are kept in `self.events` and saved next to the csv tables
+    init_timestamp_buffer(self)
 
     self.set_dataset('MCP_voltages',       [0] * 3,          broadcast=True)
     
@@ -86,6 +113,10 @@ def prepare_common_datasets(self):
     self.set_dataset('ratio_signal',       [0] * self.steps, broadcast=True)
     self.set_dataset('ratio_lost',         [0] * self.steps, broadcast=True)
 
+    # counts of user-defined extra windows, see `self.extra_windows`
+    for name in self.extra_windows:
+        self.set_dataset(f'{name}_signal', [0] * self.steps, broadcast=True)
+
 def prepare_ofat_datasets(self):
 
     # Scan interval
@@ -132,12 +163,21 @@ def prepare_doe_datasets(self):
             self.lifetime_points_per_scan = max_points
 
     # Safety: perform scan check for all parameters
+    # DC parameters are checked together, row by row, since their voltages add up
     self.scan_ok = True
+    dc_params = [p for p in self.doe_param_names if is_dc_parameter(p)]
     for param_to_scan in self.doe_param_names:
+        if param_to_scan in dc_params:
+            continue
         self.scan_values = self.setpoints[param_to_scan].to_numpy()
         self.scanning_parameter = param_to_scan
         self.scan_ok = self.scan_ok and scan_parameter(self, 0, scan_check = True)
 
+    if dc_params:
+        dc_points = {p: self.setpoints[p].to_numpy(dtype=float) for p in dc_params}
+        labels = [f"DOE row {row}" for row in self.setpoints["doe_input_row"]]
+        self.scan_ok = check_dc_scan(self, dc_points, labels) and self.scan_ok
+
     # To let `arr_or_setpoints` and `scan_x` based applet to run
     xaxis = np.arange(self.steps)
     self.set_dataset('arr_of_setpoints', xaxis, broadcast=True)
@@ -150,6 +190,11 @@ def prepare_optimizer_datesets(self):
     self.steps = self.max_iteration + self.init_sample_size
     self.E_sampled = []
     self.y_sampled = []
+    # GP surrogate kept between BO steps
+    if self.gp_hyperparameters == 'ARD fit':
+        self.surrogate = ARDSurrogate()
+    else:
+        self.surrogate = GPSurrogate()
 
     # Bounds matrix
     self.bounds = np.array([
@@ -158,6 +203,9 @@ def prepare_optimizer_datesets(self):
         [self.min_Ez, self.max_Ez]
     ])
 
+    # Safety: keep the whole optimizer box within the electrode voltage ratings
+    self.scan_ok = clip_optimizer_bounds(self)
+
     # Datasets for optimizer
     xaxis = np.arange(self.steps, dtype=float)
     self.set_dataset("arr_of_setpoints", xaxis, broadcast=True)
@@ -168,8 +216,6 @@ def prepare_optimizer_datesets(self):
     self.set_dataset("best_rel_noise", [0] * self.max_iteration, broadcast=True)
     self.set_dataset("optimizer_x", list(range(self.max_iteration)), broadcast=True)
 
-    self.scan_ok = True
-
 def prepare_lifetime_datasets(self):
 
     if self.mode == "Lifetime_fast":
@@ -211,34 +257,42 @@ def prepare_lifetime_datasets(self):
 # 3) Subfunctions for prepare devices
 def prepare_instruments(self):
 
-    self.ext_pulser         = BK4053()      # extraction pulse generator and AOM controller
-    self.tickler            = DSG821()      # tickle pulse generator
-    self.threshold_detector = DG4162()      # final signal for ARTIQ and threshold detector reset
-    self.laser              = LaserClient() # Laser Lock GUI client
+    # connect to all instruments at the same time
+    with ThreadPoolExecutor(max_workers = 5) as pool:
+        ext_pulser         = pool.submit(BK4053)      # extraction pulse generator and AOM controller
+        tickler            = pool.submit(DSG821)      # tickle pulse generator
+        threshold_detector = pool.submit(DG4162)      # final signal for ARTIQ and threshold detector reset
+        laser              = pool.submit(LaserClient.from_address, self.laser_server) # Laser Lock GUI client
 
-    # trap drive and measurement
-    self.rf = RFController(
-        mode = self.RF_amp_mode,
-        amplitude = self.RF_amplitude,
-        frequency = self.RF_frequency
-    )
+        # trap drive and measurement
+        rf = pool.submit(RFController,
+            mode = self.RF_amp_mode,
+            amplitude = self.RF_amplitude,
+            frequency = self.RF_frequency
+        )
 
-    # Zotino DC controller
-    self.electrodes = Electrodes(trap = self.trap, flipped = self.flip_electrodes)
-    for elec in self.electrodes.elec_dict.keys():
-        param_name = f"offset_{elec}"
-        offset_voltage = getattr(self, param_name)
-        self.electrodes.set_offset(elec, offset_voltage)
+    self.ext_pulser         = ext_pulser.result()
+    self.tickler            = tickler.result()
+    self.threshold_detector = threshold_detector.result()
+    self.laser              = laser.result()
+    self.rf                 = rf.result()
 
-def prepare_initialization(self):
+    # cached laser frequencies, read locally before each point
+    if self.laser_poll_interval > 0:
+        self.laser.start_polling((422, 390), interval = self.laser_poll_interval)
 
-    # configures the trap drive, mesh voltage, etc ...
+    # parallel laser and RF readings before each point
+    self.preflight = InstrumentPreflight(self.laser, self.rf)
+
+def _initialize_laser(self):
 
     # 1. Laser
     #------------------------------------------------------
     self.laser.set_frequency(390, self.frequency_390)
     self.laser.set_frequency(422, self.frequency_422)
 
+def _initialize_rf(self):
+
     # 2. RF
     #------------------------------------------------------
     if self.RF_on:
@@ -246,29 +300,24 @@ def prepare_initialization(self):
     else:
         self.rf.off(kill_sockets=False)
 
-    # 3. DC voltages
-    #------------------------------------------------------
-    zotino_initialization(self)
-    set_multipoles(self)
-
-    # 4. Mesh and MCP
-    #------------------------------------------------------
-    #self.mesh = Mesh(initial_voltage = self.mesh_voltage)
-    set_mesh_voltage(self, self.mesh_voltage)
-    self.current_MCP_front = self.MCP_front
-    set_MCP_voltages(self, self.MCP_front)
+def _initialize_threshold_detector(self):
 
     # 5. Envelope Threshold Detector
     #------------------------------------------------------
-    set_threshold_voltage(self, self.threshold_voltage*1e-3)
     self.threshold_detector.config_general()
     self.threshold_detector.set_to_signal_mode()
     self.threshold_detector.on(1)
+    self.threshold_detector.wait_finished()
+
+def _initialize_pulses(self):
 
     # 6. Extraction Pulse
     #------------------------------------------------------
-    set_extraction_pulse(self)
-    set_loading_pulse(self)
+    with self.ext_pulser.batch():
+        set_extraction_pulse(self)
+        set_loading_pulse(self)
+
+def _initialize_tickler(self):
 
     # 7. Tickle Pulse
     #------------------------------------------------------
@@ -278,11 +327,59 @@ def prepare_initialization(self):
         self.tickler.set_freq(self.tickle_frequency)
     else:
         self.tickler.off()
+    self.tickler.wait_finished()
+
+def prepare_electrodes(self):
+
+    # Zotino DC controller
+    self.electrodes = Electrodes(trap = self.trap, flipped = self.flip_electrodes)
+    for elec in self.electrodes.elec_dict.keys():
+        param_name = f"offset_{elec}"
+        offset_voltage = getattr(self, param_name)
+        self.electrodes.set_offset(elec, offset_voltage)
+
+def prepare_initialization(self):
+
+    # configures the trap drive, mesh voltage, etc ...
+    # The instruments (1, 2, 5-7) are set up on worker threads while the
+    # core device sets the DC voltages (3-5) on this thread.
+
+    with ThreadPoolExecutor(max_workers = 5) as pool:
+        instruments = [
+            pool.submit(_initialize_laser, self),
+            pool.submit(_initialize_rf, self),
+            pool.submit(_initialize_threshold_detector, self),
+            pool.submit(_initialize_pulses, self),
+            pool.submit(_initialize_tickler, self),
+        ]
+
+        # 3. DC voltages
+        #------------------------------------------------------
+        zotino_initialization(self)
+        set_multipoles(self)
+
+        # 4. Mesh and MCP
+        #------------------------------------------------------
+        #self.mesh = Mesh(initial_voltage = self.mesh_voltage)
+        set_mesh_voltage(self, self.mesh_voltage)
+        self.current_MCP_front = self.MCP_front
+        set_MCP_voltages(self, self.MCP_front)
+
+        # 5. Threshold voltage of the detector
+        #------------------------------------------------------
+        set_threshold_voltage(self, self.threshold_voltage*1e-3)
+
+        # raise the first instrument error, if any
+        for future in instruments:
+            future.result()
 
     # 8. Artiq
     #------------------------------------------------------
     self.core.reset() # Reset the core
 
+    # Host post-processing worker (if pipelined)
+    start_post_processing(self)
+
     # 9. Message saying the experiment starts
     #------------------------------------------------------
     print("*"*100)
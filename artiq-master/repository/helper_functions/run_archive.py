@@ -0,0 +1,185 @@
+"""
+Binary run archive: one HDF5 file per scan timestamp (`<base>_run.h5`) with
+  /scan       one-row-per-scan-point table, one dataset per column
+  /substep    one-row-per-substep table (lifetime modes only)
+  /datasets   every dataset listed in `data_to_save`, as recorded
+  /config     config_dict entries as attributes (strings, like the `_conf` file)
+  /events     raw timestamps, see `EventStore`
+Numeric columns are stored contiguous and uncompressed, so `RunArchive.column`
+can hand them out as read-only memory maps instead of parsing text files.
+"""
+import numpy as np
+import h5py
+import os
+
+from event_processing import EventArchive, EVENT_INDEX_KEYS
+
+DATA_FOLDER = '/home/electrons/software/data/'
+ARCHIVE_SUFFIX = '_run.h5'
+
+# ===================================================================
+# 1) Writing
+def archive_path(basefilename):
+    return f"{basefilename}{ARCHIVE_SUFFIX}"
+
+def _write_column(group, name, values):
+
+    values = np.asarray(values)
+
+    if values.dtype.kind in "OUS":
+        group.create_dataset(name, data=values.astype(str).astype(object), dtype=h5py.string_dtype())
+    else:
+        group.create_dataset(name, data=values)
+
+def _write_table(group, table):
+
+    group.attrs["columns"] = [str(col) for col in table.columns]
+    for col in table.columns:
+        _write_column(group, str(col), table[col].to_numpy())
+
+def write_run_archive(basefilename, scan_table, substep_table=None,
+                      datasets=None, config=None, events=None):
+    """
+    Write the archive of one run.
+    scan_table / substep_table: pandas.DataFrame (substep may be None)
+    datasets: dict {name: array-like}
+    config:   list of config_dict entries {'par', 'val', ['unit'], ['cmt']}
+    events:   EventStore or None
+    """
+
+    path = archive_path(basefilename)
+
+    with h5py.File(path, "w") as f:
+
+        f.attrs["basefilename"] = str(basefilename)
+
+        _write_table(f.create_group("scan"), scan_table)
+        if substep_table is not None:
+            _write_table(f.create_group("substep"), substep_table)
+
+        group = f.create_group("datasets")
+        for name, values in (datasets or {}).items():
+            try:
+                _write_column(group, name, values)
+            except (TypeError, ValueError):
+                print(f"[Archive] Dataset {name} could not be archived, skipped.")
+
+        group = f.create_group("config")
+        for entry in (config or []):
+            group.attrs[entry["par"]] = str(entry["val"])
+            for opt in ("unit", "cmt"):
+                if opt in entry:
+                    group.attrs[f"{entry['par']}.{opt}"] = str(entry[opt])
+
+        if events is not None and len(events) > 0:
+            group = f.create_group("events")
+            group.create_dataset("timestamps", data=events.timestamps)
+            for key in EVENT_INDEX_KEYS:
+                group.create_dataset(key, data=getattr(events, key))
+
+    return path
+
+# ===================================================================
+# 2) Reading
+class RunArchive(object):
+    """
+    Read access to a run archive, columns are loaded one by one on request.
+        with RunArchive.from_timestamp("20260327_113849") as run:
+            y = run.column("ratio_signal")
+            u2 = run.config("U2")
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+        self.file = h5py.File(path, "r")
+
+    @classmethod
+    def from_timestamp(cls, timestamp, data_folder = DATA_FOLDER):
+
+        path = find_run_archive(timestamp, data_folder)
+        if path is None:
+            raise FileNotFoundError(f"No run archive for {timestamp} in {data_folder}")
+        return cls(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    # 1) Internal Methods
+    #================================================================
+    def _read(self, dataset, mmap):
+
+        offset = dataset.id.get_offset()
+        plain = dataset.chunks is None and dataset.compression is None and dataset.dtype.kind in "biuf"
+
+        if mmap and plain and offset is not None and dataset.size > 0:
+            return np.memmap(self.path, mode="r", dtype=dataset.dtype, shape=dataset.shape, offset=offset)
+
+        values = dataset[()]
+        if dataset.dtype.kind == "O":
+            values = np.array([v.decode() if isinstance(v, bytes) else v for v in np.ravel(values)], dtype=object)
+        return values
+
+    # 2) Usages
+    #================================================================
+    def columns(self, table = "scan"):
+
+        if table not in self.file:
+            return []
+        return list(self.file[table].attrs["columns"])
+
+    def has_column(self, name, table = "scan"):
+        return (table in self.file) and (name in self.file[table])
+
+    def column(self, name, table = "scan", mmap = True):
+        """
+        One column of the scan (or substep) table.
+        """
+
+        if not self.has_column(name, table):
+            raise KeyError(f"Column '{name}' not found in /{table} of {self.path}")
+        return self._read(self.file[table][name], mmap)
+
+    def dataset(self, name, mmap = True):
+        """
+        One of the datasets listed in `data_to_save`, with its original shape.
+        """
+
+        return self._read(self.file["datasets"][name], mmap)
+
+    def config(self, name = None, default = ""):
+        """
+        Config value(s) as strings, same as in the `_conf` file.
+        """
+
+        attrs = self.file["config"].attrs
+        if name is None:
+            return {key: str(val) for key, val in attrs.items() if "." not in key}
+        return str(attrs[name]) if name in attrs else default
+
+    def events(self, mmap = True):
+        """
+        Raw timestamps as an `EventArchive`, None if the run recorded none.
+        """
+
+        if "events" not in self.file:
+            return None
+
+        group = self.file["events"]
+        timestamps = self._read(group["timestamps"], mmap)
+        return EventArchive(timestamps, **{key: group[key][()] for key in EVENT_INDEX_KEYS})
+
+def find_run_archive(timestamp, data_folder = DATA_FOLDER):
+    """
+    Path of the archive of run `timestamp` (YYYYMMDD_HHMMSS), None if it was not archived.
+    """
+
+    date = timestamp.split("_")[0]
+    path = os.path.join(data_folder, date, timestamp + ARCHIVE_SUFFIX)
+    return path if os.path.exists(path) else None
@@ -0,0 +1,297 @@
+"""
+Catalog of all saved runs: one SQLite file in the data folder, updated by
+`save_all` after each run, so runs can be looked up by sequence, mode, date,
+config values and signal statistics without walking the date folders.
+
+    catalog = RunCatalog()                  # RunCatalog.open_existing() for lookups only
+    timestamps = catalog.find_runs(sequence="find_optimal_E", after="20260220_020000",
+                                   RF_amplitude=2.5, U2=(-0.4, -0.2))
+    conf = catalog.config(timestamps[0])
+"""
+import numpy as np
+import sqlite3
+import os
+from configparser import ConfigParser
+
+from run_archive import DATA_FOLDER, RunArchive, find_run_archive
+
+CATALOG_NAME = 'run_catalog.sqlite'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    timestamp          TEXT PRIMARY KEY,
+    date               TEXT NOT NULL,
+    sequence           TEXT,
+    mode               TEXT,
+    scanning_parameter TEXT,
+    n_points           INTEGER,
+    status             TEXT,
+    basefilename       TEXT
+);
+CREATE TABLE IF NOT EXISTS config (
+    timestamp TEXT NOT NULL,
+    par       TEXT NOT NULL,
+    val_text  TEXT,
+    val_num   REAL,
+    PRIMARY KEY (timestamp, par)
+);
+CREATE TABLE IF NOT EXISTS stats (
+    timestamp TEXT NOT NULL,
+    tbl       TEXT NOT NULL,
+    name      TEXT NOT NULL,
+    n         INTEGER,
+    mean      REAL,
+    min       REAL,
+    max       REAL,
+    PRIMARY KEY (timestamp, tbl, name)
+);
+CREATE INDEX IF NOT EXISTS runs_date     ON runs (date);
+CREATE INDEX IF NOT EXISTS runs_sequence ON runs (sequence, timestamp);
+CREATE INDEX IF NOT EXISTS config_num    ON config (par, val_num);
+CREATE INDEX IF NOT EXISTS config_text   ON config (par, val_text);
+"""
+
+def _as_number(val):
+
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return None
+
+def _sequence_name(sequence_file):
+
+    if not sequence_file:
+        return None
+    return os.path.splitext(os.path.basename(str(sequence_file)))[0]
+
+def column_statistics(table):
+    """
+    {column: (n, mean, min, max)} of the numeric columns of a pandas.DataFrame
+    (or a dict of arrays), NaN ignored.
+    """
+
+    stats = {}
+    if table is None:
+        return stats
+
+    for col in table.keys():
+        values = np.asarray(table[col])
+        if values.ndim != 1 or values.dtype.kind not in "biuf":
+            continue
+        values = values[np.isfinite(values)].astype(float)
+        if values.size == 0:
+            stats[str(col)] = (0, None, None, None)
+        else:
+            stats[str(col)] = (int(values.size), float(np.mean(values)), float(np.min(values)), float(np.max(values)))
+
+    return stats
+
+
+class RunCatalog(object):
+    """
+    Indexed lookup of runs in the data folder, see module docstring.
+    Config values are kept as text (as in the `_conf` file) and, if they
+    parse as numbers, as numbers for range queries.
+    """
+
+    def __init__(self, path = None, data_folder = DATA_FOLDER, read_only = False):
+
+        self.data_folder = data_folder
+        self.path = path or os.path.join(data_folder, CATALOG_NAME)
+        self.read_only = read_only
+
+        if read_only:
+            # lookups only: never create the file or touch the schema
+            self.connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30)
+        else:
+            self.connection = sqlite3.connect(self.path, timeout=30)
+            self.connection.executescript(_SCHEMA)
+
+    @classmethod
+    def open_existing(cls, path = None, data_folder = DATA_FOLDER):
+        """
+        Read-only catalog, None if there is none (e.g. on an analysis machine without the data folder).
+        """
+
+        path = path or os.path.join(data_folder, CATALOG_NAME)
+        if not os.path.exists(path):
+            return None
+        try:
+            return cls(path, data_folder, read_only=True)
+        except sqlite3.Error:
+            return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    # 1) Writing
+    #================================================================
+    def add_run(self, timestamp, config, basefilename = None, mode = None, n_points = None, stats = None):
+        """
+        Add (or replace) one run.
+        config: {par: val} or a list of config_dict entries
+        stats:  {table: column_statistics(...)}
+        """
+
+        if isinstance(config, list):
+            config = {entry['par']: entry['val'] for entry in config}
+
+        date = timestamp.split("_")[0]
+        row = (
+            timestamp, date,
+            _sequence_name(config.get('sequence_file')),
+            mode if mode is not None else config.get('mode'),
+            config.get('scanning_parameter'),
+            n_points,
+            str(config['Status']) if 'Status' in config else None,
+            basefilename,
+        )
+
+        with self.connection:
+            self.connection.execute("DELETE FROM config WHERE timestamp = ?", (timestamp,))
+            self.connection.execute("DELETE FROM stats WHERE timestamp = ?", (timestamp,))
+            self.connection.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row)
+            self.connection.executemany(
+                "INSERT INTO config VALUES (?, ?, ?, ?)",
+                [(timestamp, str(par), str(val), _as_number(val)) for par, val in config.items()]
+            )
+            self.connection.executemany(
+                "INSERT INTO stats VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(timestamp, tbl, name) + tuple(values)
+                 for tbl, columns in (stats or {}).items() for name, values in columns.items()]
+            )
+
+    def index_run(self, timestamp):
+        """
+        Add a run from its files, the run archive if there is one, else the `_conf` file.
+        Returns False if neither exists.
+        """
+
+        date = timestamp.split("_")[0]
+        basefilename = os.path.join(self.data_folder, date, timestamp)
+
+        archive = find_run_archive(timestamp, self.data_folder)
+        if archive is not None:
+            with RunArchive(archive) as run:
+                config = run.config()
+                scan = {name: run.column(name, mmap=False) for name in run.columns()}
+                substep = {name: run.column(name, table="substep", mmap=False) for name in run.columns("substep")}
+            n_points = len(next(iter(scan.values()))) if scan else None
+            stats = {
+                'scan':    column_statistics(scan),
+                'substep': column_statistics(substep),
+            }
+            self.add_run(timestamp, config, basefilename, n_points=n_points, stats=stats)
+            return True
+
+        conf_filename = basefilename + '_conf'
+        if os.path.exists(conf_filename):
+            parser = ConfigParser(interpolation=None)
+            parser.read(conf_filename)
+            config = {par: parser[par]['val'] for par in parser.sections() if 'val' in parser[par]}
+            self.add_run(timestamp, config, basefilename)
+            return True
+
+        return False
+
+    def index_date(self, date, refresh = False):
+        """
+        Add all runs of one date folder (YYYYMMDD), known runs are skipped unless `refresh`.
+        Returns the number of runs added.
+        """
+
+        folder = os.path.join(self.data_folder, date)
+        if not os.path.isdir(folder):
+            return 0
+
+        known = set() if refresh else set(self.find_runs(date=date))
+        timestamps = set()
+        for filename in os.listdir(folder):
+            if filename.endswith('_conf') or filename.endswith('_run.h5'):
+                timestamps.add(filename[:15])
+
+        added = 0
+        for timestamp in sorted(timestamps - known):
+            added += self.index_run(timestamp)
+        return added
+
+    # 2) Queries
+    #================================================================
+    def find_runs(self, sequence = None, mode = None, date = None, after = None, before = None,
+                  finished = None, **conditions):
+        """
+        Timestamps of all runs matching every given criterion, in time order.
+            after / before: timestamp or date prefix, inclusive
+            finished:       only runs with (True) / without (False) Status = True
+            conditions:     par = value     config value equal (numeric if value is a number)
+                            par = (lo, hi)  numeric config value in [lo, hi]
+        """
+
+        clauses, args = [], []
+
+        for column, value in (('sequence', sequence), ('mode', mode), ('date', date)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                args.append(value)
+
+        # both bounds compare the timestamp prefix of their own length
+        if after is not None:
+            clauses.append("substr(timestamp, 1, ?) >= ?")
+            args.extend([len(str(after)), str(after)])
+        if before is not None:
+            clauses.append("substr(timestamp, 1, ?) <= ?")
+            args.extend([len(str(before)), str(before)])
+        if finished is not None:
+            clauses.append("status = 'True'" if finished else "(status IS NULL OR status != 'True')")
+
+        for par, value in conditions.items():
+            if isinstance(value, (tuple, list)):
+                lo, hi = value
+                clauses.append("timestamp IN (SELECT timestamp FROM config WHERE par = ? AND val_num BETWEEN ? AND ?)")
+                args.extend([par, float(lo), float(hi)])
+            elif _as_number(value) is not None and not isinstance(value, str):
+                clauses.append("timestamp IN (SELECT timestamp FROM config WHERE par = ? AND val_num = ?)")
+                args.extend([par, float(value)])
+            else:
+                clauses.append("timestamp IN (SELECT timestamp FROM config WHERE par = ? AND val_text = ?)")
+                args.extend([par, str(value)])
+
+        query = "SELECT timestamp FROM runs"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY timestamp"
+
+        return [row[0] for row in self.connection.execute(query, args)]
+
+    def config(self, timestamp, names = None):
+        """
+        {par: value string} of one run, only `names` if given.
+        """
+
+        rows = self.connection.execute("SELECT par, val_text FROM config WHERE timestamp = ?", (timestamp,))
+        config = dict(rows.fetchall())
+        if names is None:
+            return config
+        return {name: config.get(name, "") for name in names}
+
+    def statistics(self, timestamp, table = "scan"):
+        """
+        {column: {'n', 'mean', 'min', 'max'}} of one run.
+        """
+
+        rows = self.connection.execute(
+            "SELECT name, n, mean, min, max FROM stats WHERE timestamp = ? AND tbl = ?", (timestamp, table)
+        )
+        return {name: {'n': n, 'mean': mean, 'min': lo, 'max': hi} for name, n, mean, lo, hi in rows}
+
+    def has_run(self, timestamp):
+
+        row = self.connection.execute("SELECT 1 FROM runs WHERE timestamp = ?", (timestamp,)).fetchone()
+        return row is not None
+
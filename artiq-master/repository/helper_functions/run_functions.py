@@ -2,19 +2,24 @@ from artiq.language.core import TerminationRequested
 from artiq.coredevice.exceptions import RTIOOverflow, RTIOUnderflow
 import numpy as np
 import time
+from concurrent.futures import Future
 from scipy.optimize import curve_fit, minimize
 
 from base_sequences import (
     count_histogram,
     count_events,
-    record_laser_frequencies,
+    start_preflight,
+    record_preflight,
     bare_counting,
-    record_RF_amplitude,
     set_multipoles,
     sampler_read,
-    recover_threshold_detector
+    recover_threshold_detector,
+    collect_timestamps,
+    start_timestamp_point
 )
 from helper_functions import latin_hypercube, bo_suggest_next
+from event_processing import WindowCounter
+from post_processing import PostProcessor
 from scan_functions import _scan_wait_time
 
 
@@ -110,28 +115,40 @@ def measure(self, ind, print_result=False,
         raise TerminationRequested("Termination requested during scan")
 
     if self.RF_amp_mode == "locked":
+        self.preflight.wait()
         self.rf.set_amplitude()
 
-    status_390, status_422 = record_laser_frequencies(
-        self, ind,
-        target_422=expected_freq_422, target_390=expected_freq_390,
-        tol=tolerance
-    )
-    record_RF_amplitude(self, ind)
+    # Laser and RF readings, overlapping with the kernel only for single-kernel points
+    pending = start_preflight(self)
+    overlap = getattr(self, 'overlap_preflight', False) and self.mode == "Trapping"
+
+    def validate_preflight():
+        status_390, status_422 = record_preflight(
+            self, pending, ind,
+            target_422=expected_freq_422, target_390=expected_freq_390,
+            tol=tolerance
+        )
+
+        # Validate laser frequencies (compare actual vs expected setpoint)
+        if validate_390 and not status_390:
+            raise LaserError(390)
+        if validate_422 and not status_422:
+            raise LaserError(422)
 
-    # Validate laser frequencies (compare actual vs expected setpoint)
-    if validate_390 and not status_390:
-        raise LaserError(390)
-    if validate_422 and not status_422:
-        raise LaserError(422)
+    if not overlap:
+        validate_preflight()
 
     if self.mode == "Trapping":
         if self.histogram_on:
-            cts_trapped, cts_lost, cts_loading = trap_with_histogram(self, ind)
+            counts = trap_with_histogram(self, ind)
         else:
-            cts_trapped, cts_lost, cts_loading = trap_without_histogram(self)
+            counts = trap_without_histogram(self, ind)
 
-        store_to_dataset(self, ind, cts_trapped, cts_lost, cts_loading)
+        # a laser off during the kernel discards the point, it is measured again
+        if overlap:
+            validate_preflight()
+
+        cts_trapped, cts_lost, cts_loading = wait_for_counts(self, ind, counts)
 
         if print_result:
             print(f"Trapped: {cts_trapped}, Lost: {cts_lost}, Loading: {cts_loading}")
@@ -139,6 +156,7 @@ def measure(self, ind, print_result=False,
     elif self.mode == 'Lifetime_fast':
         points_per_scan = self.lifetime_points_per_scan
         N = np.zeros(2)
+        counts, results = [], []
 
         for i, wt in enumerate([self.wait_time_fast1, self.wait_time_fast2]):
             _scan_wait_time(self, wt, None)
@@ -148,15 +166,14 @@ def measure(self, ind, print_result=False,
             self.mutate_dataset('wait_times_file_used', idx, str(getattr(self, "wait_times_file", "")))
 
             if self.histogram_on:
-                cts_trapped, cts_lost, cts_loading = trap_with_histogram(self, idx)
+                counts.append(trap_with_histogram(self, idx, deferred=True))
             else:
-                cts_trapped, cts_lost, cts_loading = trap_without_histogram(self)
-
-            store_to_dataset(self, idx, cts_trapped, cts_lost, cts_loading)
+                counts.append(trap_without_histogram(self, idx, deferred=True))
 
-            if cts_loading == 0:
-                raise RuntimeError("No Loading Signal Detected")
+            _check_substeps(self, points_per_scan * ind, counts, results)
+        _check_substeps(self, points_per_scan * ind, counts, results, last=True)
 
+        for i, (cts_trapped, cts_lost, cts_loading) in enumerate(results):
             N[i] = cts_trapped/cts_loading
 
         # Two-point lifetime: N[0] at wait_time_fast1, N[1] at wait_time_fast2 (use fast1 < fast2)
@@ -172,6 +189,7 @@ def measure(self, ind, print_result=False,
         N = np.zeros(num_wait_times)
         T = np.zeros(num_wait_times)
         L = np.zeros(num_wait_times)
+        counts, results = [], []
 
         for i, wt in enumerate(self.wait_time_arr):
             _scan_wait_time(self, wt, None)
@@ -182,15 +200,14 @@ def measure(self, ind, print_result=False,
             self.mutate_dataset('wait_times_file_used', idx, str(getattr(self, "wait_times_file", "")))
 
             if self.histogram_on:
-                cts_trapped, cts_lost, cts_loading = trap_with_histogram(self, idx)
+                counts.append(trap_with_histogram(self, idx, deferred=True))
             else:
-                cts_trapped, cts_lost, cts_loading = trap_without_histogram(self)
+                counts.append(trap_without_histogram(self, idx, deferred=True))
 
-            store_to_dataset(self, idx, cts_trapped, cts_lost, cts_loading)
-
-            if cts_loading == 0:
-                raise RuntimeError("No Loading Signal Detected")
+            _check_substeps(self, points_per_scan * ind, counts, results)
+        _check_substeps(self, points_per_scan * ind, counts, results, last=True)
 
+        for i, (cts_trapped, cts_lost, cts_loading) in enumerate(results):
             T[i] = cts_trapped
             L[i] = cts_loading
             N[i] = cts_trapped/cts_loading
@@ -200,12 +217,16 @@ def measure(self, ind, print_result=False,
         for i in range(num_wait_times, points_per_scan):
             _fill_missing_substep(self, points_per_scan * ind + i)
 
-        # fit for lifetime
-        #tao = fit_lifetime_unweighted(self, T, L, N)
-        #tao = fit_lifetime_weighted(self, T, L, N)
-        tao = fit_lifetime_poisson_MLE(self, T, L, N)
+        # fit for lifetime (on the post-processing worker if pipelined)
+        wait_times = np.array(self.wait_time_arr, dtype=float)
+
+        def fit_job(datasets):
+            #tao = fit_lifetime_unweighted(self, T, L, N)
+            #tao = fit_lifetime_weighted(self, T, L, N)
+            tao = fit_lifetime_poisson_MLE(self, T, L, N, wait_times=wait_times)
+            datasets.mutate_dataset('lifetime', ind, tao)
 
-        self.mutate_dataset('lifetime', ind, tao)
+        submit_post_processing(self, ind, fit_job)
 
 
     elif self.mode == 'Counting':
@@ -275,7 +296,8 @@ def handle_laser_jump(self, laser_to_fix=422, setpoint=None, tol=1e-5):
         if self.scheduler.check_pause():
             raise TerminationRequested("Termination requested during laser jump handling")
 
-        time.sleep(1.0)
+        # with the polled frequency cache the fix is seen within one poll interval
+        time.sleep(self.laser.poll_interval or 1.0)
         act_freq = self.laser.get_frequency(laser_to_fix)
 
 # ===================================================================
@@ -381,9 +403,10 @@ def fit_lifetime_weighted(self, T, L, N):
     tao = popt[1]
     return tao
 
-def fit_lifetime_poisson_MLE(self, T, L, N):
+def fit_lifetime_poisson_MLE(self, T, L, N, wait_times=None):
 
-    t = np.asarray(self.wait_time_arr, dtype=float)
+    # `wait_times` is a copy of `self.wait_time_arr` taken when the point was measured
+    t = np.asarray(self.wait_time_arr if wait_times is None else wait_times, dtype=float)
     T = np.asarray(T, dtype=float)
     L = np.asarray(L, dtype=float)
     N = np.asarray(N, dtype=float)
@@ -404,7 +427,7 @@ def fit_lifetime_poisson_MLE(self, T, L, N):
 
     else:
         # Point 0 for initial estimation
-        idx0 = np.argmin(self.wait_time_arr)
+        idx0 = np.argmin(t)
         N00 = N[idx0]
         tao0 = np.max(t) - np.min(t)
         if tao0 <= 0:
@@ -457,7 +480,9 @@ def bo_sampling(self, ind):
     # calculate the next point to measure
     E_next, ei, params = bo_suggest_next(
         self.E_sampled, self.y_sampled, self.bounds,
-        n_candidates=self.n_candidate_run
+        n_candidates=self.n_candidate_run,
+        surrogate=self.surrogate,
+        n_starts=self.n_acq_starts
     )
 
     # perform experiment
@@ -473,35 +498,87 @@ def bo_sampling(self, ind):
 
     return ei
 
-def measure_optimize(self, ind, E_field=None):
+def bo_sampling_batch(self, ind, batch_size):
+    """
+    Propose `batch_size` points at once (q-EI, Kriging believer) and measure
+    them back to back with one pre-flight reading of the lasers and the RF,
+    the GP takes all of them at the next proposal. `ind` is the BO index of
+    the first point, returns the EIs of the measured points.
+    """
+
+    t0 = time.time()
+    n_points = min(batch_size, self.max_iteration - ind)
+
+    # calculate the next points to measure
+    E_batch, ei_batch, params = bo_suggest_next(
+        self.E_sampled, self.y_sampled, self.bounds,
+        n_candidates=self.n_candidate_run,
+        surrogate=self.surrogate,
+        n_starts=self.n_acq_starts,
+        batch_size=n_points
+    )
+    E_batch, ei_batch = np.atleast_2d(E_batch), np.atleast_1d(ei_batch)
+
+    # one pre-flight for the whole batch, recorded at every point
+    pending = start_preflight(self)
+
+    for j, (E_next, ei) in enumerate(zip(E_batch, ei_batch)):
+
+        # perform experiment, a failed point is retried on its own
+        run_experiment_with_retries(self, measure_optimize, ind + j + self.init_sample_size,
+                                    E_field=E_next, pending=pending)
+
+        # store BO result
+        self.mutate_dataset("y_best", ind + j, np.max(self.y_sampled))
+        self.mutate_dataset("ei", ind + j, ei)
+
+        # store BO parameters
+        self.mutate_dataset("length_scale", ind + j, params[0])
+        self.mutate_dataset("best_rel_noise", ind + j, params[1])
+
+        self.mutate_dataset("time_cost", ind + j + self.init_sample_size, time.time() - t0)
+        t0 = time.time()
+
+    return ei_batch
+
+def measure_optimize(self, ind, E_field=None, pending=None):
 
     # implement setpoint
     self.Ex, self.Ey, self.Ez = E_field
     set_multipoles(self)
 
     # perform measurement
-    signal = trap_optimize(self, ind)
+    signal = trap_optimize(self, ind, pending)
 
     # store result
     self.E_sampled.append(E_field)
     self.y_sampled.append(signal)
     self.mutate_dataset("e_trace", ind, E_field)
 
-def trap_optimize(self, ind):
+def trap_optimize(self, ind, pending=None):
+    """
+    pending: pre-flight readings shared by a batch of points (see `bo_sampling_batch`),
+             a new reading is taken if None
+    """
 
     if self.scheduler.check_pause():
         raise TerminationRequested("Termination requested during scan")
 
-    # Record Laser and RF data
-    status_390, status_422 = record_laser_frequencies(self, ind)
-    record_RF_amplitude(self, ind)
+    # Record Laser and RF data, read during the kernel if `overlap_preflight`
+    if pending is None:
+        pending = start_preflight(self)
+    if not getattr(self, 'overlap_preflight', False):
+        record_preflight(self, pending, ind)
 
     if self.histogram_on:
-        cts_trapped, cts_lost, cts_loading = trap_with_histogram(self, ind)
+        counts = trap_with_histogram(self, ind)
     else:
-        cts_trapped, cts_lost, cts_loading = trap_without_histogram(self)
+        counts = trap_without_histogram(self, ind)
 
-    store_to_dataset(self, ind, cts_trapped, cts_lost, cts_loading)
+    if getattr(self, 'overlap_preflight', False):
+        record_preflight(self, pending, ind)
+
+    cts_trapped, cts_lost, cts_loading = wait_for_counts(self, ind, counts)
 
     if self.optimize_target == "trapped_signal":
         signal = cts_trapped
@@ -523,72 +600,187 @@ def trap_optimize(self, ind):
 
 # ===================================================================
 # 4) Basic Components
-def trap_with_histogram(self, my_ind):
+def trap_with_histogram(self, my_ind, deferred=False):
 
-    # run detection sequence
+    # run detection sequence (all timestamps end up in `self.events`)
+    start_timestamp_point(self, my_ind)
     count_histogram(self)
 
-    # get result
-    xs = self.get_dataset('hist_xs')
-    ys = self.get_dataset('hist_ys')
-    self.mutate_dataset('arr_of_timestamps', my_ind, self.get_dataset('timestamps'))
+    # trapped, kicked out, loading (and extra window) counts from the histogram
+    return submit_window_counts(self, my_ind, histogram=True, deferred=deferred)
 
-    # calculate trapped count
-    ind_l = (xs > (self.load_time + self.wait_time - 1))[:-1]
-    ind_u = (xs < (self.load_time + self.wait_time + self.ext_pulse_length // 1000 + 3))[:-1]
-    cts_trapped = np.sum(ys[ind_l*ind_u])
+def trap_without_histogram(self, my_ind, deferred=False):
 
-    # calculate kicked out count
-    ind_l = (xs > (self.load_time + 4))[:-1]
-    ind_u = (xs < (self.load_time + self.tickle_pulse_length + 3))[:-1]
-    #print(ys[ind_l*ind_u])
-    cts_lost = np.sum(ys[ind_l*ind_u])
+    # run detection sequence (all timestamps end up in `self.events`)
+    start_timestamp_point(self, my_ind)
+    count_events(self)
 
-    # calculate loading count
-    ind_l = (xs > 1)[:-1]
-    ind_u = (xs < (self.load_time + 2))[:-1]
-    cts_loading = np.sum(ys[ind_l*ind_u])
+    return submit_window_counts(self, my_ind, histogram=False, deferred=deferred)
 
-    return cts_trapped, cts_lost, cts_loading
+def get_window_counter(self, histogram=True):
+    """
+    Window counter for the current timing parameters, rebuilt only when
+    `load_time`, `wait_time`, `tickle_pulse_length` or `ext_pulse_length` change.
+    """
 
-def trap_without_histogram(self):
+    key = (histogram, self.load_time, self.wait_time, self.tickle_pulse_length, self.ext_pulse_length)
+    cached = getattr(self, '_window_counter', None)
+    if cached is None or cached[0] != key:
+        counter = WindowCounter.for_trapping(
+            self.load_time, self.wait_time, self.tickle_pulse_length, self.ext_pulse_length,
+            histogram=histogram, extra_windows=getattr(self, 'extra_windows', None)
+        )
+        self._window_counter = (key, counter)
 
-    # run detection sequence
-    count_events(self)
+    return self._window_counter[1]
 
-    # get result
-    events = np.array(self.get_dataset('timestamps'))
-    cts_loading = len(events[events<(self.load_time + 2)])
-    cts_trapped = len(events[events>(self.load_time + self.wait_time -3)])
-    cts_lost = 0
+def submit_window_counts(self, my_ind, histogram=True, deferred=False):
+    """
+    Count the windows of the point just measured and write the count and ratio
+    datasets in a post-processing job. The timestamps go to the job directly
+    (and are archived from `self.events`), they are not broadcast. Returns a
+    `Future` of the {window: counts} dict.
+
+    The counts are only `deferred` to the job for the Lifetime substeps, where
+    the next substep runs before they are needed. Trapping and the optimizer
+    need them right away, so they are counted here and only the dataset writes
+    are left to the job.
+    """
 
-    return cts_trapped, cts_lost, cts_loading
+    # close the point, the next one may start while it is counted (only the
+    # counting without histogram reads the timestamps)
+    timestamps = None if histogram else collect_timestamps(self)
+    self.events.end_point()
 
-def store_to_dataset(self, my_ind, cts_trapped, cts_lost, cts_loading):
+    counter = get_window_counter(self, histogram=histogram)
+    edges, hist_counts = (self.histogram.edges, self.histogram.counts.copy()) if histogram else (None, None)
+    extra_windows = list(getattr(self, 'extra_windows', {}))
 
-    # store result
-    self.mutate_dataset('trapped_signal', my_ind, cts_trapped)
-    self.mutate_dataset('lost_signal', my_ind, cts_lost)
-    self.mutate_dataset('loading_signal', my_ind, cts_loading)
-
-    # calculate ratios
-    if cts_loading > 0:
-        self.mutate_dataset('ratio_signal', my_ind, cts_trapped / cts_loading)
-        self.mutate_dataset('ratio_lost', my_ind, cts_lost / cts_loading)
-    else:
-        self.mutate_dataset('ratio_signal', my_ind, 0.0)
-        self.mutate_dataset('ratio_lost', my_ind, 0.0)
+    def count():
+        if histogram:
+            return counter.count_histogram(edges, hist_counts)
+        return counter.count_events(timestamps)
 
-    # reset timestamps
-    self.set_dataset('timestamps', [], broadcast=True)
-    self.set_dataset('timestamps_loading', [], broadcast=True)
+    def count_job(datasets, window_counts=None):
 
-    # handle threshold detector errors
+        if window_counts is None:
+            window_counts = count()
+
+        cts_trapped = window_counts['trapped']
+        cts_lost = window_counts['lost']
+        cts_loading = window_counts['loading']
+
+        # store result
+        datasets.mutate_dataset('trapped_signal', my_ind, cts_trapped)
+        datasets.mutate_dataset('lost_signal', my_ind, cts_lost)
+        datasets.mutate_dataset('loading_signal', my_ind, cts_loading)
+
+        # user-defined extra windows
+        for name in extra_windows:
+            datasets.mutate_dataset(f'{name}_signal', my_ind, window_counts.get(name, 0))
+
+        # calculate ratios
+        if cts_loading > 0:
+            datasets.mutate_dataset('ratio_signal', my_ind, cts_trapped / cts_loading)
+            datasets.mutate_dataset('ratio_lost', my_ind, cts_lost / cts_loading)
+        else:
+            datasets.mutate_dataset('ratio_signal', my_ind, 0.0)
+            datasets.mutate_dataset('ratio_lost', my_ind, 0.0)
+
+        return window_counts
+
+    if deferred:
+        return submit_post_processing(self, my_ind, count_job)
+
+    window_counts = count()
+    submit_post_processing(self, my_ind, lambda datasets: count_job(datasets, window_counts))
+
+    counts = Future()
+    counts.set_result(window_counts)
+    return counts
+
+def wait_for_counts(self, my_ind, counts):
+    """
+    (trapped, lost, loading) counts of point `my_ind` from the `Future` of
+    `submit_window_counts`, after checking the threshold detector.
+    """
+
+    window_counts = counts.result()
+    cts_trapped, cts_lost, cts_loading = window_counts['trapped'], window_counts['lost'], window_counts['loading']
+
+    # handle threshold detector errors (needs the core device, so stays here)
     if cts_loading == 0:
         qbar = sampler_read(self)[4]
         if qbar <= 0.5:
             raise DetectorError("Threshold detector was dead!")
 
+    return cts_trapped, cts_lost, cts_loading
+
+# ===================================================================
+# 5) Host Post-Processing
+def start_post_processing(self):
+    """
+    With `pipeline_post_processing` on, the dataset writes and lifetime fits
+    of a point run on a worker thread, overlapping with the kernels of the next
+    (sub)steps. The window counting of the Lifetime substeps runs there too,
+    Trapping and the optimizer count on the main thread.
+    """
+
+    if getattr(self, 'pipeline_post_processing', False):
+        self.post_processor = PostProcessor(max_pending=2)
+    else:
+        self.post_processor = None
+
+def submit_post_processing(self, ind, job):
+    """
+    Run `job(datasets)` for point `ind`, right away without pipeline, returns
+    a `Future` of its result. Raises `PostProcessingError` here if the job of
+    an earlier point failed.
+    """
+
+    post_processor = getattr(self, 'post_processor', None)
+    if post_processor is None:
+        future = Future()
+        future.set_result(job(self))
+        return future
+
+    post_processor.apply(self)
+    return post_processor.submit(ind, job)
+
+def finish_post_processing(self):
+    """
+    Wait for the pending jobs and write their datasets, before saving.
+    """
+
+    post_processor = getattr(self, 'post_processor', None)
+    if post_processor is None:
+        return
+
+    try:
+        post_processor.join(self)
+    except Exception as e:
+        print(f"Post-processing error: {e}")
+        self.err_list.append((getattr(e, 'ind', None), type(e).__name__))
+    finally:
+        post_processor.close()
+        self.post_processor = None
+
+def _check_substeps(self, first_ind, counts, results, last=False):
+    """
+    Wait for the counts of the Lifetime substeps measured so far and append
+    their (trapped, lost, loading) to `results`. The first substep is checked
+    as soon as it is measured, so a dead detector ends the point right away;
+    the others one substep behind, counted while the next one runs.
+    """
+
+    n_ready = len(counts) if (last or not results) else len(counts) - 1
+    for i in range(len(results), n_ready):
+        cts = wait_for_counts(self, first_ind + i, counts[i])
+
+        if cts[2] == 0:
+            raise RuntimeError("No Loading Signal Detected")
+
+        results.append(cts)
 
 def _fill_missing_substep(self, idx):
     """Mark an unmeasured lifetime substep explicitly as NaN."""
@@ -600,3 +792,5 @@ def _fill_missing_substep(self, idx):
     self.mutate_dataset('loading_signal', idx, np.nan)
     self.mutate_dataset('ratio_signal', idx, np.nan)
     self.mutate_dataset('ratio_lost', idx, np.nan)
+    for name in getattr(self, 'extra_windows', {}):
+        self.mutate_dataset(f'{name}_signal', idx, np.nan)
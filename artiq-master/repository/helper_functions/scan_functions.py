@@ -14,6 +14,7 @@ from base_sequences import (
     load_lifetime_wait_times,
     lifetime_csv_path,
 )
+from scan_planner import DC_MULTIPOLES, check_dc_scan
 
 #####################################################################
 ##  -- Master Scanning Functions  --  ###############################
@@ -96,12 +97,10 @@ def _get_scan_function(param_name):
     3. Otherwise, search for function named `_scan_{param_name}`
     """
 
-    multipole_list = ["Ex", "Ey", "Ez", "U1", "U2", "U3", "U4", "U5"]
-
     if param_name.startswith("offset_"):
         elec_name = param_name.replace("offset_", "")
         return _create_offset_scanner(elec_name)
-    elif param_name in multipole_list:
+    elif param_name in DC_MULTIPOLES:
         return _create_multipole_scanner(param_name)
     else:
         this_module = sys.modules[__name__]
@@ -169,8 +168,9 @@ def _scan_load_time(self, val, scan_values, scan_check = False):
     else:
         self.load_time = int(round(val))  # Integer us for kernel/ARTIQ compatibility
         update_detection_time(self)
-        set_loading_pulse(self)
-        set_extraction_pulse(self)
+        with self.ext_pulser.batch():
+            set_loading_pulse(self)
+            set_extraction_pulse(self)
 
         return 1
 
@@ -332,9 +332,10 @@ def _create_multipole_scanner(multipole_name):
 
     def _scanner(self, val, scan_values, scan_check = False):
 
-        # Safety check has been done by `Electrode` class, so just pass there
+        # Voltages of all scan points are checked at once, see `scan_planner`
         if scan_check:
-            return 1
+            labels = [f"{multipole_name} = {v:g}" for v in scan_values]
+            return check_dc_scan(self, {multipole_name: scan_values}, labels)
 
         else:
             # set_multipoles relies on self attributes, so we have to modify here
@@ -352,9 +353,10 @@ def _create_offset_scanner(elec_name):
 
     def _scanner(self, val, scan_values, scan_check = False):
 
-        # Safety check has been done by `Electrode` class, so just pass there
+        # Voltages of all scan points are checked at once, see `scan_planner`
         if scan_check:
-            return 1
+            labels = [f"offset_{elec_name} = {v:g}" for v in scan_values]
+            return check_dc_scan(self, {f"offset_{elec_name}": scan_values}, labels)
 
         else:
             self.electrodes.set_offset(elec_name, val)
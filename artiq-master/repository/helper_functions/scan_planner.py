@@ -0,0 +1,151 @@
+"""
+Safety planning of DC scans before anything is sent to the hardware.
+
+All points of a scan (OFAT scan values, DOE table rows or the optimizer box)
+are mapped onto electrode voltages in one pass with the multipole matrix of
+`Electrodes`, so unsafe points are found in prepare instead of raising
+`VoltageSafetyError` in the middle of the run.
+"""
+import numpy as np
+
+DC_MULTIPOLES = ["Ex", "Ey", "Ez", "U1", "U2", "U3", "U4", "U5"]
+
+def is_dc_parameter(name):
+    return name in DC_MULTIPOLES or name.startswith("offset_")
+
+class ScanPlan(object):
+    """
+    Electrode and Zotino voltages of every planned point.
+        channels: (n_channels,) Zotino channels of the electrodes
+        voltages: (n_points, n_electrodes) electrode voltages
+        control:  (n_points, n_channels) Zotino input voltages
+        safe:     (n_points,) True if all electrodes are within their ratings
+    """
+
+    def __init__(self, electrodes, voltages):
+
+        self.electrodes = electrodes
+        self.channels = electrodes.channels.copy()
+        self.voltages = voltages
+        self.control = electrodes.calibrate(voltages)
+        self.safe = np.all(np.abs(voltages) <= electrodes.limits, axis = 1)
+
+    def __len__(self):
+        return len(self.voltages)
+
+    @property
+    def unsafe_points(self):
+        return np.flatnonzero(~self.safe)
+
+    def report(self, labels = None, max_lines = 10):
+        """
+        Print the unsafe points, the worst electrode of each.
+        """
+
+        unsafe = self.unsafe_points
+        if len(unsafe) == 0:
+            return
+
+        print(f"DC safety check: {len(unsafe)} of {len(self)} planned points exceed the electrode voltage ratings!")
+
+        excess = np.abs(self.voltages[unsafe]) - self.electrodes.limits
+        for n, (i, row) in enumerate(zip(unsafe, excess)):
+            if n == max_lines:
+                print(f"  ... {len(unsafe) - max_lines} more")
+                break
+            j = int(np.argmax(row))
+            label = labels[i] if labels is not None else f"point {i}"
+            print(f"  {label}: electrode {self.electrodes.elec_names[j]} at {self.voltages[i, j]:.2f} V "
+                  f"(limit +/- {self.electrodes.limits[j]:.2f} V)")
+
+# ===================================================================
+# 1) Planning
+def plan_dc_points(electrodes, base_multipoles, points):
+    """
+    Plan the DC setpoints of a whole scan.
+        base_multipoles: {multipole: value} of the parameters that are not scanned
+        points:          {parameter: array of n_points}, multipoles and/or `offset_<elec>`
+    Unscanned offsets keep the current offsets of `electrodes`.
+    """
+
+    n_points = len(next(iter(points.values()))) if points else 1
+
+    multipoles = np.tile(electrodes._multipole_array(base_multipoles), (n_points, 1))
+    offsets = np.tile(electrodes.offsets, (n_points, 1))
+
+    for name, values in points.items():
+        values = np.asarray(values, dtype = float)
+        if name.startswith("offset_"):
+            offsets[:, electrodes.elec_names.index(name[len("offset_"):])] = values
+        else:
+            multipoles[:, electrodes.multipoles.index(name)] = values
+
+    return ScanPlan(electrodes, electrodes._get_voltages(multipoles, offsets))
+
+def feasible_box(electrodes, base_multipoles, bounds, names = ("Ex", "Ey", "Ez")):
+    """
+    Largest box, centred on the centre of `bounds` and shrunk by the same
+    factor in every dimension, in which every point is safe.
+    For electrode i the worst case over a box with centre c and half widths h
+    is |v0_i + a_i.c| + sum_j |a_ij| h_j, linear in the shrink factor.
+    Returns (sub_bounds, factor), (None, 0.0) if even the centre is unsafe.
+    """
+
+    bounds = np.asarray(bounds, dtype = float)
+    centre = bounds.mean(axis = 1)
+    half_width = (bounds[:, 1] - bounds[:, 0]) / 2
+
+    base = dict(base_multipoles)
+    for name, value in zip(names, centre):
+        base[name] = value
+    v_centre = electrodes._get_voltages(base)
+
+    columns = [electrodes.multipoles.index(name) for name in names]
+    spread = np.abs(electrodes.multipole_matrix[:, columns]) @ half_width
+
+    margin = electrodes.limits - np.abs(v_centre)
+    if np.any(margin < 0):
+        return None, 0.0
+
+    with np.errstate(divide = 'ignore'):
+        factors = np.where(spread > 0, margin / spread, np.inf)
+    factor = min(1.0, float(np.min(factors)))
+
+    sub_bounds = np.column_stack((centre - factor * half_width, centre + factor * half_width))
+    return sub_bounds, factor
+
+# ===================================================================
+# 2) Usages in prepare
+def base_multipoles(self):
+    return {m: getattr(self, m) for m in self.electrodes.multipoles}
+
+def check_dc_scan(self, points, labels = None):
+    """
+    Plan and check DC setpoints {parameter: values}, keep the plan in `self.scan_plan`.
+    Returns True if every point is safe.
+    """
+
+    self.scan_plan = plan_dc_points(self.electrodes, base_multipoles(self), points)
+    self.scan_plan.report(labels)
+
+    return bool(np.all(self.scan_plan.safe))
+
+def clip_optimizer_bounds(self):
+    """
+    Shrink `self.bounds` (Ex, Ey, Ez) to a box with safe voltages everywhere.
+    Returns False if no such box exists.
+    """
+
+    sub_bounds, factor = feasible_box(self.electrodes, base_multipoles(self), self.bounds)
+
+    if sub_bounds is None:
+        print("DC safety check: the centre of the optimizer bounds exceeds the electrode voltage ratings!")
+        return False
+
+    if factor < 1.0:
+        print(f"DC safety check: optimizer bounds shrunk to {factor:.1%} around their centre to stay within the electrode voltage ratings:")
+        for name, (lo, hi), (new_lo, new_hi) in zip(("Ex", "Ey", "Ez"), self.bounds, sub_bounds):
+            print(f"  {name}: [{lo:.3f}, {hi:.3f}] -> [{new_lo:.3f}, {new_hi:.3f}]")
+        self.bounds = sub_bounds
+
+    return True
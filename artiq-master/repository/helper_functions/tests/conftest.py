@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the helper modules import each other flat, as on the experiment path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
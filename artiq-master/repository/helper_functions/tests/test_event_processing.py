@@ -0,0 +1,124 @@
+import numpy as np
+
+from event_processing import EventStore, HistogramAccumulator, WindowCounter
+
+
+def _measure(store, index, repeats):
+    store.begin_point(index)
+    for chunk in repeats:
+        store.append(np.asarray(chunk, dtype=float))
+    store.append_repeat_counts([len(chunk) for chunk in repeats])
+    store.end_point()
+
+
+def test_histogram_accumulator_matches_old_binning():
+
+    rng = np.random.default_rng(0)
+    detection_time, bin_width = 300, 1
+    chunks = [rng.uniform(0, detection_time, n) for n in (50, 0, 200, 7)]
+    chunks[0][0] = 0.0
+    chunks[2][:2] = detection_time
+
+    histogram = HistogramAccumulator(detection_time, bin_width)
+    for chunk in chunks:
+        histogram.add(chunk)
+
+    # old make_histogram: all timestamps binned again on every refresh
+    extract = list(np.concatenate(chunks))
+    number_of_bins = int(detection_time / bin_width) + 1
+    a, b = np.histogram(extract[1:len(extract)], bins = np.linspace(0, detection_time, number_of_bins))
+
+    # the old binning dropped the first event of the run, the accumulator keeps it
+    first, _ = np.histogram(extract[:1], bins = b)
+    assert np.array_equal(histogram.edges, b)
+    assert np.array_equal(histogram.counts, a + first)
+    assert histogram.n_events == len(extract)
+
+
+def _old_histogram_counts(xs, ys, load_time, wait_time, tickle_pulse_length, ext_pulse_length):
+    # boolean masks of the old trap_with_histogram
+
+    ind_l = (xs > (load_time + wait_time - 1))[:-1]
+    ind_u = (xs < (load_time + wait_time + ext_pulse_length // 1000 + 3))[:-1]
+    cts_trapped = np.sum(ys[ind_l*ind_u])
+
+    ind_l = (xs > (load_time + 4))[:-1]
+    ind_u = (xs < (load_time + tickle_pulse_length + 3))[:-1]
+    cts_lost = np.sum(ys[ind_l*ind_u])
+
+    ind_l = (xs > 1)[:-1]
+    ind_u = (xs < (load_time + 2))[:-1]
+    cts_loading = np.sum(ys[ind_l*ind_u])
+
+    return cts_trapped, cts_lost, cts_loading
+
+
+def test_window_counter_matches_old_masks():
+
+    rng = np.random.default_rng(1)
+    for load_time, wait_time, tickle_pulse_length, ext_pulse_length, bin_width in (
+            (100, 50, 20, 1000, 1), (100, 50, 20, 1500, 0.5), (40, 200, 60, 200, 2)):
+
+        detection_time = load_time + wait_time + 50
+        events = rng.uniform(0, detection_time, 2000)
+        events[:20] = rng.integers(0, detection_time, 20)       # on the window bounds
+
+        histogram = HistogramAccumulator(detection_time, bin_width)
+        histogram.add(events)
+        xs, ys = histogram.edges, histogram.counts
+
+        counter = WindowCounter.for_trapping(load_time, wait_time, tickle_pulse_length, ext_pulse_length)
+        counts = counter.count_histogram(xs, ys)
+        assert (counts['trapped'], counts['lost'], counts['loading']) == \
+            _old_histogram_counts(xs, ys, load_time, wait_time, tickle_pulse_length, ext_pulse_length)
+
+        # old trap_without_histogram
+        counter = WindowCounter.for_trapping(load_time, wait_time, tickle_pulse_length, ext_pulse_length,
+                                             histogram=False)
+        counts = counter.count_events(events)
+        assert counts['loading'] == len(events[events<(load_time + 2)])
+        assert counts['trapped'] == len(events[events>(load_time + wait_time -3)])
+        assert counts['lost'] == 0
+
+
+def test_event_store_offsets():
+
+    store = EventStore(capacity = 2)
+    _measure(store, 0, [[1, 2], [3]])
+    _measure(store, 1, [[4], [], [5, 6]])
+
+    assert list(store.point_index) == [0, 1]
+    assert list(store.timestamps) == [1, 2, 3, 4, 5, 6]
+    assert list(store.point_offsets) == [0, 3, 6]
+    assert list(store.point_repeat_offsets) == [0, 2, 5]
+    assert list(store.repeat_offsets) == [0, 2, 3, 4, 4, 6]
+
+
+def test_event_store_adjacent_retry():
+
+    store = EventStore()
+    _measure(store, 0, [[1, 2]])
+    _measure(store, 1, [[3]])
+    _measure(store, 1, [[4, 5]])
+
+    assert list(store.point_index) == [0, 1]
+    assert list(store.timestamps) == [1, 2, 4, 5]
+    assert list(store.repeat_offsets) == [0, 2, 4]
+
+
+def test_event_store_non_adjacent_retry():
+
+    # Lifetime point 0 with substeps 0, 1 fails in substep 1 and is measured again
+    store = EventStore(capacity = 4)
+    _measure(store, 0, [[1, 2], [3]])
+    _measure(store, 1, [[4], [5, 6]])
+    _measure(store, 0, [[7]])
+    _measure(store, 1, [[8, 9]])
+    _measure(store, 2, [[10]])
+
+    assert list(store.point_index) == [0, 1, 2]
+    assert list(store.timestamps) == [7, 8, 9, 10]
+    assert list(store.point_offsets) == [0, 1, 3, 4]
+    assert list(store.point_repeat_offsets) == [0, 1, 2, 3]
+    assert list(store.repeat_offsets) == [0, 1, 3, 4]
+    assert list(store.current_point()) == [10]
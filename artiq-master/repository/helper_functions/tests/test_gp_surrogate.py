@@ -0,0 +1,62 @@
+import numpy as np
+
+from gp_surrogate import GPSurrogate
+from helper_functions import gaussian_process_hyperparameters, gaussian_process_predictor, normalize_values
+
+
+def _data(n, seed = 4):
+    rng = np.random.default_rng(seed)
+    X = rng.random((n, 3))
+    y = np.exp(-8 * np.sum((X - 0.6) ** 2, axis = 1)) + 0.05 * rng.normal(size = n)
+    return X, y, rng.random((40, 3))
+
+
+def _fresh_predictor(surrogate, X_test):
+    # old path: factor everything again with the surrogate's normalization and hyperparameters
+    noise = surrogate.noise()
+    return gaussian_process_predictor(surrogate.X, surrogate._normalized(surrogate.y), X_test,
+                                      noise=noise, length_scale=surrogate.length_scale,
+                                      variance=surrogate.variance)
+
+
+def test_gp_surrogate_matches_old_predictor():
+
+    X, y, X_test = _data(20)
+    surrogate = GPSurrogate().fit(X, y)
+
+    # old bo_suggest_next: normalize, pick hyperparameters on the grid, predict
+    y_normalized, _ = normalize_values(y)
+    length_scale, variance, noise, _, rel_noise = gaussian_process_hyperparameters(X, y_normalized)
+    mu, sigma = gaussian_process_predictor(X, y_normalized, X_test,
+                                           noise=noise, length_scale=length_scale, variance=variance)
+
+    assert (surrogate.length_scale, surrogate.rel_noise) == (length_scale, rel_noise)
+    assert np.allclose(surrogate.noise(), noise)
+    assert np.allclose(surrogate.predict(X_test)[0], mu)
+    assert np.allclose(surrogate.predict(X_test)[1], sigma)
+
+
+def test_gp_surrogate_updates_match_fresh_factorization():
+
+    X, y, X_test = _data(30)
+    surrogate = GPSurrogate()
+    for n in (10, 15, 16, 24, 30):
+        surrogate.fit(X[:n], y[:n])
+
+    assert surrogate.n_rebuilds == 1 and surrogate.n_updates == 20
+    mu, sigma = _fresh_predictor(surrogate, X_test)
+    assert np.allclose(surrogate.predict(X_test)[0], mu)
+    assert np.allclose(surrogate.predict(X_test)[1], sigma)
+
+
+def test_gp_surrogate_fantasize_keeps_repeated_point():
+
+    # without noise a repeated point makes the bordered update singular
+    X, y, X_test = _data(12)
+    surrogate = GPSurrogate(abs_noise = 0.0, rel_noises = (0.0,)).fit(X, y)
+    believer = surrogate.fantasize(X[3])
+
+    assert len(believer.y) == len(y) + 1
+    assert np.array_equal(believer.X[-1], X[3])
+    assert believer.length_scale == surrogate.length_scale
+    assert np.allclose(believer.predict(X[3:4])[0], surrogate.predict(X[3:4])[0])
@@ -0,0 +1,90 @@
+from configparser import ConfigParser
+
+import numpy as np
+import pandas as pd
+
+from event_processing import EventStore
+from run_archive import RunArchive, write_run_archive
+
+
+def _config_dict():
+    return [
+        {'par': 'mode', 'val': 'Trapping'},
+        {'par': 'U2', 'val': -0.69, 'unit': 'V'},
+        {'par': 'no_of_repeats', 'val': 1000, 'cmt': 'per point'},
+        {'par': 'Status', 'val': True, 'cmt': 'Run finished.'},
+    ]
+
+
+def _write_conf(basefilename, config_dict):
+    # same layout as save_config
+    config = ConfigParser()
+    config['Scan'] = {'filename' : basefilename}
+    for d in config_dict:
+        config[d['par']] = {'val' : d['val']}
+        for opt in ['unit', 'cmt']:
+            if opt in d.keys():
+                config[d['par']].update({opt : d[opt]})
+    with open(basefilename + '_conf', 'w') as conf_file:
+        config.write(conf_file)
+
+
+def test_run_archive_matches_csv_and_conf(tmp_path):
+
+    rng = np.random.default_rng(2)
+    basefilename = str(tmp_path / '20260327_113849')
+    scan_df = pd.DataFrame({
+        'U2':           np.linspace(-1, 1, 7),
+        'ratio_signal': rng.random(7) / 3,
+        'repeats':      np.arange(7) * 100,
+        'laser':        ['ok', 'ok', 'jump', 'ok', 'ok', 'ok', 'ok'],
+    })
+    datasets = {'hist_ys': rng.integers(0, 50, 300), 'trapped_signal': rng.random(7)}
+
+    # old save: the CSV tables and the `_conf` file
+    scan_df.to_csv(f"{basefilename}_scan_result.csv", index=False)
+    _write_conf(basefilename, _config_dict())
+
+    write_run_archive(basefilename, scan_df, datasets=datasets, config=_config_dict())
+
+    csv = pd.read_csv(f"{basefilename}_scan_result.csv", float_precision="round_trip")
+    conf = ConfigParser(interpolation=None)
+    conf.read(basefilename + '_conf')
+
+    with RunArchive(basefilename + '_run.h5') as run:
+        assert run.columns() == list(csv.columns)
+        for name in csv.columns:
+            assert list(run.column(name)) == list(csv[name])
+        for name, values in datasets.items():
+            assert np.array_equal(run.dataset(name), values)
+
+        assert run.config() == {par: conf[par]['val'] for par in conf.sections() if par != 'Scan'}
+        assert run.config('U2.unit') == conf['U2']['unit']
+        assert run.events() is None
+
+
+def test_run_archive_events_match_point_timestamps(tmp_path):
+
+    # old arr_of_timestamps: the timestamps of the last attempt of every point
+    rng = np.random.default_rng(3)
+    arr_of_timestamps = {}
+    store = EventStore(capacity = 8)
+    for index in (0, 1, 2, 1, 3):
+        repeats = [rng.uniform(0, 300, n).astype(np.float32) for n in rng.integers(0, 5, 3)]
+        store.begin_point(index)
+        for chunk in repeats:
+            store.append(chunk)
+        store.append_repeat_counts([len(chunk) for chunk in repeats])
+        store.end_point()
+        arr_of_timestamps[index] = repeats
+
+    basefilename = str(tmp_path / '20260327_113849')
+    write_run_archive(basefilename, pd.DataFrame({'x': np.arange(4)}), events=store)
+
+    with RunArchive(basefilename + '_run.h5') as run:
+        events = run.events()
+        assert sorted(events.point_index) == sorted(arr_of_timestamps)
+        for index, repeats in arr_of_timestamps.items():
+            assert np.array_equal(events.point(index), np.concatenate(repeats))
+            for repeat, chunk in enumerate(repeats):
+                assert np.array_equal(events.shot(index, repeat), chunk)
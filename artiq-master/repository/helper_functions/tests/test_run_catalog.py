@@ -0,0 +1,84 @@
+import os
+from configparser import ConfigParser
+
+import numpy as np
+import pandas as pd
+
+from run_archive import write_run_archive
+from run_catalog import RunCatalog
+
+RUNS = {
+    '20260326_235959': {'sequence_file': '/seq/Trapping.py', 'mode': 'Trapping', 'U2': -0.69, 'Status': True},
+    '20260327_101500': {'sequence_file': '/seq/Trapping.py', 'mode': 'Trapping', 'U2': -0.5, 'Status': True},
+    '20260327_113849': {'sequence_file': '/seq/Lifetime.py', 'mode': 'Lifetime', 'U2': -0.69, 'Status': True},
+    '20260328_080000': {'sequence_file': '/seq/Trapping.py', 'mode': 'Trapping', 'U2': 0.1},
+}
+
+
+def _save_run(data_folder, timestamp, config, archive):
+    # `_conf` file as written by save_config, the run archive only for some runs
+
+    folder = os.path.join(data_folder, timestamp[:8])
+    os.makedirs(folder, exist_ok=True)
+    basefilename = os.path.join(folder, timestamp)
+
+    conf = ConfigParser()
+    conf['Scan'] = {'filename' : basefilename}
+    for par, val in config.items():
+        conf[par] = {'val' : val}
+    with open(basefilename + '_conf', 'w') as conf_file:
+        conf.write(conf_file)
+
+    if archive:
+        config_dict = [{'par': par, 'val': val} for par, val in config.items()]
+        write_run_archive(basefilename, pd.DataFrame({'ratio_signal': np.linspace(0, 1, 5)}), config=config_dict)
+
+
+def _read_confs(data_folder):
+    # old lookup: parse the `_conf` file of every run
+    confs = {}
+    for timestamp in RUNS:
+        parser = ConfigParser(interpolation=None)
+        parser.read(os.path.join(data_folder, timestamp[:8], timestamp + '_conf'))
+        confs[timestamp] = {par: parser[par]['val'] for par in parser.sections() if par != 'Scan'}
+    return confs
+
+
+def test_run_catalog_matches_conf_files(tmp_path):
+
+    data_folder = str(tmp_path)
+    for k, (timestamp, config) in enumerate(RUNS.items()):
+        _save_run(data_folder, timestamp, config, archive = k % 2 == 0)
+
+    with RunCatalog(data_folder=data_folder) as catalog:
+        added = sum(catalog.index_date(date) for date in ('20260326', '20260327', '20260328'))
+        assert added == len(RUNS)
+
+        confs = _read_confs(data_folder)
+        for timestamp in RUNS:
+            assert catalog.config(timestamp) == confs[timestamp]
+
+        assert catalog.find_runs(mode='Trapping') == \
+            sorted(t for t, conf in confs.items() if conf['mode'] == 'Trapping')
+        assert catalog.find_runs(sequence='Trapping', U2=-0.69) == \
+            sorted(t for t, conf in confs.items() if conf['sequence_file'].endswith('/Trapping.py')
+                   and float(conf['U2']) == -0.69)
+        assert catalog.find_runs(U2=(-0.7, -0.6), finished=True) == \
+            sorted(t for t, conf in confs.items() if -0.7 <= float(conf['U2']) <= -0.6
+                   and conf.get('Status') == 'True')
+
+        assert catalog.statistics('20260326_235959')['ratio_signal']['n'] == 5
+        assert catalog.statistics('20260327_101500') == {}
+
+
+def test_run_catalog_time_bounds(tmp_path):
+
+    with RunCatalog(data_folder=str(tmp_path)) as catalog:
+        for timestamp, config in RUNS.items():
+            catalog.add_run(timestamp, config)
+
+        # dates, partial and full timestamps are inclusive prefixes on both sides
+        assert catalog.find_runs(after='20260327', before='20260327') == ['20260327_101500', '20260327_113849']
+        assert catalog.find_runs(after='20260327_11') == ['20260327_113849', '20260328_080000']
+        assert catalog.find_runs(before='20260327_10') == ['20260326_235959', '20260327_101500']
+        assert catalog.find_runs(after='20260327_113849', before='20260327_113849') == ['20260327_113849']
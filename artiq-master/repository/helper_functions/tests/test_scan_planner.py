@@ -0,0 +1,53 @@
+import itertools
+
+import numpy as np
+
+from dc_electrodes import Electrodes, VoltageSafetyError
+from scan_planner import feasible_box, plan_dc_points
+
+BASE = {'Ex': 0.0, 'Ey': 0.0, 'Ez': 0.0, 'U1': 0.0, 'U2': -0.69, 'U3': 0.0, 'U4': 0.0, 'U5': 0.0}
+
+
+def _old_control_voltage(multipoles, offsets = None):
+    # per-point path of the old scans, raising on the first unsafe point
+    electrodes = Electrodes('Single PCB')
+    for elec, voltage in (offsets or {}).items():
+        electrodes.set_offset(elec, voltage)
+    try:
+        return electrodes.get_control_voltage(multipoles)
+    except VoltageSafetyError:
+        return None
+
+
+def test_scan_plan_matches_get_control_voltage():
+
+    electrodes = Electrodes('Single PCB')
+    U2 = np.linspace(-40, 40, 17)
+    offsets = np.linspace(-30, 30, 17)
+    plan = plan_dc_points(electrodes, BASE, {'U2': U2, 'offset_tl2': offsets})
+
+    assert 0 < len(plan.unsafe_points) < len(plan)
+    for i in range(len(plan)):
+        control = _old_control_voltage(dict(BASE, U2=U2[i]), {'tl2': offsets[i]})
+        assert plan.safe[i] == (control is not None)
+        if control is not None:
+            assert np.array_equal(plan.channels, control[0])
+            assert np.allclose(plan.control[i], control[1], rtol = 1e-12, atol = 1e-12)
+
+
+def test_feasible_box_is_safe_and_tight():
+
+    electrodes = Electrodes('Single PCB')
+    bounds = [(-40, 40), (-40, 40), (-5, 5)]
+    sub_bounds, factor = feasible_box(electrodes, BASE, bounds)
+    assert 0 < factor < 1
+
+    def corners(box):
+        for corner in itertools.product(*box):
+            yield dict(BASE, Ex=corner[0], Ey=corner[1], Ez=corner[2])
+
+    assert all(_old_control_voltage(mv) is not None for mv in corners(sub_bounds))
+
+    centre = np.mean(bounds, axis = 1, keepdims = True)
+    wider = centre + (sub_bounds - centre) * 1.01
+    assert any(_old_control_voltage(mv) is None for mv in corners(wider))
@@ -0,0 +1,81 @@
+import numpy as np
+
+ZOTINO_CHANNELS = 32
+ZOTINO_GAIN_MU = 65000
+
+
+class ZotinoShadow(object):
+    """
+    Host-side copy of what was last written to the Zotino (gain and DAC code
+    of each channel), used to send only the channels that actually change.
+
+    Voltages are compared after conversion into DAC codes, so changes below
+    one LSB cause no write at all. A state of -1 means unknown (after init or
+    a failed write), such channels are always written.
+    """
+
+    def __init__(self, offset_dacs = 0x2000, vref = 5.0, n_channels = ZOTINO_CHANNELS):
+
+        self.offset_dacs = offset_dacs
+        self.vref = vref
+        self.gain_mu = np.full(n_channels, -1, dtype=np.int64)
+        self.dac_mu = np.full(n_channels, -1, dtype=np.int64)
+
+    # 1) Internal Methods
+    #================================================================
+    def voltage_to_mu(self, voltages):
+        """
+        DAC codes of output voltages, same as `artiq.coredevice.ad53xx.voltage_to_mu`.
+        """
+
+        voltages = np.asarray(voltages, dtype=float)
+        codes = np.round((1 << 16) * (voltages / (4.0 * self.vref)) + self.offset_dacs * 0x4).astype(np.int64)
+
+        if np.any((codes < 0) | (codes > 0xffff)):
+            raise ValueError("Invalid DAC voltage!")
+        return codes
+
+    # 2) Usages
+    #================================================================
+    def plan(self, channels, voltages, gain_mu = ZOTINO_GAIN_MU):
+        """
+        Minimal write set for the requested channel voltages.
+        Returns (gain_channels, dac_channels, dac_codes) as int32 arrays.
+        A channel listed twice keeps its last voltage.
+        """
+
+        channels = np.asarray(channels, dtype=np.int64)
+        codes = self.voltage_to_mu(voltages)
+
+        # keep the last occurrence of each channel
+        _, last = np.unique(channels[::-1], return_index=True)
+        keep = np.sort(len(channels) - 1 - last)
+        channels, codes = channels[keep], codes[keep]
+
+        gain_channels = channels[self.gain_mu[channels] != gain_mu]
+        changed = self.dac_mu[channels] != codes
+
+        return (gain_channels.astype(np.int32),
+                channels[changed].astype(np.int32),
+                codes[changed].astype(np.int32))
+
+    def commit(self, gain_channels, dac_channels, dac_codes, gain_mu = ZOTINO_GAIN_MU):
+        """
+        Record a write set as applied.
+        """
+
+        self.gain_mu[np.asarray(gain_channels, dtype=np.int64)] = gain_mu
+        self.dac_mu[np.asarray(dac_channels, dtype=np.int64)] = dac_codes
+
+    def invalidate(self, channels = None):
+        """
+        Forget the state of `channels` (all if None), they are rewritten on the next call.
+        """
+
+        if channels is None:
+            self.gain_mu[:] = -1
+            self.dac_mu[:] = -1
+        else:
+            channels = np.asarray(channels, dtype=np.int64)
+            self.gain_mu[channels] = -1
+            self.dac_mu[channels] = -1
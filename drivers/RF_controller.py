@@ -1,5 +1,6 @@
 from rs import RS
 from keysight_spectrum import Keysight
+from rf_calibration import RFCalibration, RF_CALIBRATION_FILE
 
 import numpy as np
 import time
@@ -39,7 +40,8 @@ class RFController:
         marker_no: int = 1,
         mode = "setpoint",            # "setpoint", "actual" or "locked"
         amplitude: float = 4.0,
-        frequency: float = 1.732e+09
+        frequency: float = 1.732e+09,
+        calibration_file = RF_CALIBRATION_FILE   # None: do not persist the setpoint calibration
         ):
 
         # 1. Initialize Devices
@@ -72,6 +74,10 @@ class RFController:
         # ---------------------------------------
         self._last_setpoint = None
 
+        # 6. Setpoint -> amplitude curves learned from the locks
+        # ---------------------------------------
+        self.calibration = RFCalibration(calibration_file, update_date=RF_SYSTEM_PARAMS["update_date"])
+
     # 2) Turn RF on and off
     # ===============================================================
     def on(self):
@@ -124,30 +130,63 @@ class RFController:
         _n_meas = 3
         _settle_time = 0.05
 
-        if self._last_setpoint is None:
-            self._last_setpoint = self._get_initial_setpoint(target)
+        if self._last_setpoint is not None:
+            # Still locked: one measurement at the current setpoint is enough,
+            # otherwise (drift, new target) step from there along the learned curve
+            act_ampl = self.get_amplitude()
+            if abs(target - act_ampl) <= _tol:
+                return
+            self._update_setpoint_calibrated(target - act_ampl)
+
+        else:
+            # Seed from the learned curve, the hand-tuned guess without one
+            seed = self.calibration.setpoint_for(self.frequency, target)
+            if seed is not None:
+                self._last_setpoint = self._clip_setpoint(seed)
+            else:
+                self._last_setpoint = self._get_initial_setpoint(target)
 
-        for k in range(_max_iter):
-            self.generator.set_ampl(self._last_setpoint)
-            time.sleep(_settle_time)
+        try:
+            for k in range(_max_iter):
+                self.generator.set_ampl(self._last_setpoint)
+                time.sleep(_settle_time)
 
-            measured_amplitudes = np.zeros(_n_meas)
-            for i in range(_n_meas):
-                measured_amplitudes[i] = self.get_amplitude()
+                measured_amplitudes = np.zeros(_n_meas)
+                for i in range(_n_meas):
+                    measured_amplitudes[i] = self.get_amplitude()
 
-            act_ampl = np.mean(np.sort(measured_amplitudes)[1:-1])
-            err = target - act_ampl
+                act_ampl = np.mean(np.sort(measured_amplitudes)[1:-1])
+                err = target - act_ampl
+                self.calibration.add(self.frequency, self._last_setpoint, act_ampl)
 
-            if abs(err) <= _tol:
-                print(f"[RFController] RF setpoint: {self._last_setpoint:.3f} dBm")
-                return
+                if abs(err) <= _tol:
+                    print(f"[RFController] RF setpoint: {self._last_setpoint:.3f} dBm ({k+1} iterations)")
+                    return
 
-            self._update_setpoint_fast(err)
+                self._update_setpoint_calibrated(err)
+
+        finally:
+            self.calibration.save()
 
         print("[RFController] Warning: Did not find proper setpoint for this RF_amplitude within "
              f"setpoint bound [{self._setpoint_min:.3f}, {self._setpoint_max:.3f}] dBm!\n"
              f"[RFController] Using setpoint: {self._last_setpoint:.3f} dBm! Actual amplitude: {act_ampl:.3f} dBm.")
 
+    def _clip_setpoint(self, setpoint: float) -> float:
+        return max(self._setpoint_min, min(self._setpoint_max, setpoint))
+
+    def _update_setpoint_calibrated(self, err: float):
+        """
+        Newton step with the local slope of the learned curve, `_update_setpoint_fast` without one.
+        """
+
+        slope = self.calibration.slope(self.frequency, self._last_setpoint)
+        if slope is None:
+            self._update_setpoint_fast(err)
+            return
+
+        self._last_setpoint = self._clip_setpoint(self._last_setpoint + err / slope)
+
     def _update_setpoint(self, err: float):
         """
         Robust setpoint update
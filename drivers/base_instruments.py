@@ -1,10 +1,51 @@
+import asyncio
+import math
+import time
 import pyvisa as visa
 
+from scpi_transport import EventLoopThread
+
+
+def _short_form(value):
+    # SCPI short form of a mnemonic, e.g. PULSe -> PULS
+    short = ''.join(c for c in value if not c.islower())
+    return short.upper() if short else value.upper()
+
+def _same_setting(value, reply, scale=1.0):
+    """
+    True if the instrument reply to `<header>?` matches the value written.
+    Numbers are compared as numbers (`scale` converts the written unit into
+    the one of the reply), mnemonics by their short form, ON/OFF also as 1/0.
+    """
+
+    reply = reply.strip().strip('"')
+
+    try:
+        return math.isclose(float(value) * scale, float(reply), rel_tol=1e-9, abs_tol=1e-12)
+    except (TypeError, ValueError):
+        pass
+
+    short = _short_form(str(value))
+    reply = reply.upper()
+    if short in ("ON", "OFF"):
+        return reply in ((short, "1") if short == "ON" else (short, "0"))
+
+    return reply.startswith(short)
+
+
 class BaseVisaInstrument:
+    """
+    pyvisa instrument with a shadow register model: settings written with
+    `write_setting` are remembered per SCPI header, writing the same value
+    again sends nothing. `sync` re-reads the remembered settings and forgets
+    those the instrument does not hold (anymore), e.g. after a reconnect.
+    """
 
     def __init__(self, IP):
+        self.IP = IP
         self.rm = visa.ResourceManager("@py")
         self.device = self.rm.open_resource('TCPIP::' + IP + '::INSTR')
+        self.registers = {}     # header -> (value, scale) as last written
         return
 
     def id(self):
@@ -16,9 +57,117 @@ class BaseVisaInstrument:
     def query(self, msg):
         return self.device.query(msg)
 
-    def wait_finished(self):
-        while self.query('*OPC?').strip() != '1':
+    def write_setting(self, header, value, unit="", scale=1.0):
+        """
+        Send `<header> <value><unit>` unless the register already holds `value`.
+        `scale` converts `value` into the unit the instrument replies in.
+        Returns True if a command was sent.
+        """
+
+        if self.registers.get(header, (None,))[0] == value:
+            return False
+
+        try:
+            self.write(f"{header} {value}{unit}")
+        except Exception:
+            self.registers.pop(header, None)
+            raise
+
+        self.registers[header] = (value, scale)
+        return True
+
+    def invalidate(self, header=None):
+        """
+        Forget one (or all) registers, they are written on the next call.
+        """
+
+        if header is None:
+            self.registers.clear()
+        else:
+            self.registers.pop(header, None)
+
+    def sync(self):
+        """
+        Re-read every remembered register, drop those that differ or cannot be read.
+        Returns the headers that were dropped.
+        """
+
+        dropped = []
+        for header, (value, scale) in list(self.registers.items()):
+            try:
+                same = _same_setting(value, self.query(f"{header}?"), scale)
+            except Exception:
+                same = False
+            if not same:
+                del self.registers[header]
+                dropped.append(header)
+
+        return dropped
+
+    def reconnect(self):
+        """
+        Re-open the VISA session and check the shadow registers against the instrument.
+        """
+
+        try:
+            self.device.close()
+        except Exception:
             pass
+        self.device = self.rm.open_resource('TCPIP::' + self.IP + '::INSTR')
+
+        return self.sync()
+
+    def wait_finished(self, timeout=10.0, poll=False):
+        """
+        Block until all pending commands are executed, raise TimeoutError after `timeout` s.
+        poll=False: a single `*OPC?`, answered by the instrument once it is done
+        poll=True:  set the OPC bit of the event status register with `*OPC` and
+                    poll `*ESR?` with exponential backoff (1 ms to 100 ms)
+        """
+
+        if poll:
+            self._poll_operation_complete(timeout)
+            return
+
+        old_timeout = self.device.timeout
+        self.device.timeout = timeout * 1000     # VISA timeouts are in ms
+        try:
+            reply = self.query('*OPC?')
+        except visa.errors.VisaIOError as e:
+            if e.error_code == visa.constants.StatusCode.error_timeout:
+                raise TimeoutError(f"{self.IP}: operation not complete after {timeout} s") from e
+            raise
+        finally:
+            self.device.timeout = old_timeout
+
+        if reply.strip() != '1':
+            raise RuntimeError(f"Unexpected *OPC? reply from {self.IP}: {reply!r}")
+
+    def _poll_operation_complete(self, timeout):
+
+        # reading the event status register clears it
+        self.query('*ESR?')
+        self.write('*OPC')
+
+        deadline = time.monotonic() + timeout
+        interval = 0.001
+        while not (int(self.query('*ESR?').strip()) & 1):
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"{self.IP}: operation not complete after {timeout} s")
+            time.sleep(min(interval, max(0.0, deadline - time.monotonic())))
+            interval = min(2 * interval, 0.1)
+
+    def wait_finished_async(self, timeout=10.0, poll=False):
+        """
+        `wait_finished` on a worker thread, returns a concurrent.futures.Future.
+        Code on the transport event loop can await `asyncio.wrap_future(...)` of it.
+        """
+
+        # asyncio.to_thread needs Python 3.9, the lab runs 3.8
+        async def wait():
+            await asyncio.get_running_loop().run_in_executor(None, self.wait_finished, timeout, poll)
+
+        return EventLoopThread.instance().submit(wait())
 
     def close(self):
         self.device.close()
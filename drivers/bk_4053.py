@@ -1,71 +1,142 @@
-import socket
-import time
+from contextlib import contextmanager
+
+from scpi_transport import ScpiTransport
 
 class BK4053:
+    """
+    BK Precision 4053 in burst mode.
 
-    def __init__(self, TCP_IP="192.168.42.64", TCP_PORT=5025, timeout=2.0):
+    The driver keeps the last value written to every channel setting, a
+    setter that would not change anything sends nothing. Inside `batch()`
+    the remaining commands are collected and sent together, as one
+    semicolon-joined line (or one line each if `join_commands` is False)
+    followed by a single `*OPC?`.
+    """
 
-        self.command_delay = 0.05
+    def __init__(self, TCP_IP="192.168.42.64", TCP_PORT=5025, timeout=2.0, join_commands=True):
 
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.settimeout(timeout)
-        s.connect((TCP_IP,TCP_PORT))
+        self.transport = ScpiTransport(TCP_IP, TCP_PORT, timeout=timeout)
+        self.join_commands = join_commands
 
-        self.socket = s
-        time.sleep(self.command_delay)
+        self._state = {}        # (channel, setting) -> value as sent
+        self._queued = {}       # same, for the commands of the open batch
+        self._batch_depth = 0
 
         reply = self.query("*IDN?")
         if "4053" not in reply:
             raise RuntimeError(f"Not BK4053? *IDN? -> {reply!r}")
 
+    # 1) Internal Methods
+    #================================================================
+    def _set(self, channel, setting, value, msg):
+
+        key = (channel, setting)
+        if self._batch_depth > 0:
+            if self._state.get(key) == value and key not in self._queued:
+                return
+            self._queued[key] = (value, msg)
+            return
+
+        if self._state.get(key) == value:
+            return
+        try:
+            self.send(msg)
+        except Exception:
+            self._state.pop(key, None)
+            raise
+        self._state[key] = value
+
+    def _flush(self):
+
+        queued, self._queued = self._queued, {}
+        # a setting written back to its old value inside the batch needs no command
+        commands = [(key, value, msg) for key, (value, msg) in queued.items() if self._state.get(key) != value]
+        if not commands:
+            return
+
+        try:
+            if self.join_commands:
+                self.transport.write(";".join(msg for _, _, msg in commands))
+            else:
+                for _, _, msg in commands:
+                    self.transport.write(msg)
+            self.transport.opc()
+        except Exception:
+            # unknown which commands were executed
+            for key, _, _ in commands:
+                self._state.pop(key, None)
+            raise
+
+        for key, value, _ in commands:
+            self._state[key] = value
+
+    # 2) Usages
+    #================================================================
     def send(self, msg):
-        send_msg = msg.rstrip("\r\n") + "\n"
-        self.socket.sendall(send_msg.encode("ascii"))
-        time.sleep(self.command_delay)
-
-    def recv_line(self, max_bytes=4096):
-        chunks = []
-        total = 0
-        while total < max_bytes:
-            chunk = self.socket.recv(256).decode()
-            if not chunk: break
-            chunks.append(chunk)
-            total += len(chunk)
-            if "\n" in chunk: break
-        return "".join(chunks)
+        # wait for the command to be executed instead of a fixed delay
+        self.transport.write(msg)
+        self.transport.opc()
 
     def query(self, msg):
-        self.send(msg)
-        return self.recv_line()
+        return self.transport.query(msg)
+
+    @contextmanager
+    def batch(self):
+        """
+        Collect the settings changed inside the block and send them at its end,
+        nested blocks are sent with the outermost one.
+        """
+
+        self._batch_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._queued = {}
+            raise
+        self._batch_depth -= 1
+        if self._batch_depth == 0:
+            self._flush()
+
+    def invalidate(self, channel=None):
+        """
+        Forget the cached settings (of one channel), e.g. after changes on the front panel.
+        """
+
+        if channel is None:
+            self._state.clear()
+        else:
+            self._state = {key: val for key, val in self._state.items() if key[0] != channel}
 
     def on(self, channel):
-        self.send(f"C{channel}:OUTP ON")        
+        self._set(channel, "OUTP", "ON", f"C{channel}:OUTP ON")
 
     def off(self, channel):
-        self.send(f"C{channel}:OUTP OFF")
-        
+        self._set(channel, "OUTP", "OFF", f"C{channel}:OUTP OFF")
+
     def set_burst_mode(self, channel, burst):
-        self.send(f"C{channel}:BTWV STATE, {'ON' if burst else 'OFF'}")
+        state = 'ON' if burst else 'OFF'
+        self._set(channel, "STATE", state, f"C{channel}:BTWV STATE, {state}")
 
     def set_carr_delay(self, channel, delay):
-        self.send(f"C{channel}:BTWV CARR,DLY,{delay}")
+        self._set(channel, "DLY", delay, f"C{channel}:BTWV CARR,DLY,{delay}")
 
     def set_carr_freq(self, channel, frequency):
-        self.send(f"C{channel}:BTWV CARR,FRQ,{frequency}")
-        
+        self._set(channel, "FRQ", frequency, f"C{channel}:BTWV CARR,FRQ,{frequency}")
+
     def set_carr_width(self, channel, freq, width):
         duty = 100 * width / (1/freq)
-        self.send(f"C{channel}:BTWV CARR,DUTY,{duty}")
-        
+        self._set(channel, "DUTY", duty, f"C{channel}:BTWV CARR,DUTY,{duty}")
+
     def set_carr_ampl(self, channel, amplitude):
-        self.send(f"C{channel}:BTWV CARR,AMP,{amplitude}")
+        self._set(channel, "AMP", amplitude, f"C{channel}:BTWV CARR,AMP,{amplitude}")
 
     def set_carr_offset(self, channel, offset):
-        self.send(f"C{channel}:BTWV CARR,OFST,{offset}")
+        self._set(channel, "OFST", offset, f"C{channel}:BTWV CARR,OFST,{offset}")
 
     def close(self):
-        self.socket.shutdown(socket.SHUT_RDWR)
-        self.socket.close()
+        self.transport.close()
 
 if __name__ == '__main__':
     bk = BK4053()
@@ -1,51 +1,31 @@
-import socket
 import time
 import numpy as np
 
-class Keysight:
-    
-    def __init__(self):
-
-        TCP_IP = '192.168.42.63'
-        TCP_PORT = 5025
+from scpi_transport import ScpiTransport
 
-        self.command_delay = 0.01
+NO_ERROR = '+0,"No error"'
 
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    
-        s.connect((TCP_IP,TCP_PORT))
-    
-        s.send(b"*IDN?\n")
-        t = s.recv(1024)
+class Keysight:
     
-        print(t)
-        
-        self.socket = s
+    def __init__(self, TCP_IP='192.168.42.63', TCP_PORT=5025, timeout=2.0):
+
+        self.transport = ScpiTransport(TCP_IP, TCP_PORT, timeout=timeout)
     
+        print(self.query("*IDN?"))
 
     def send(self, msg):
 
-        send_msg = msg + '\n'
-
-        self.socket.send(send_msg.encode())
-
-        time.sleep(self.command_delay)
-
-    def recv(self):
-
-        self.msg = self.socket.recv(1024)
-
-        return self.msgKeysight
+        self.transport.write(msg)
 
     def query(self, msg):
 
-        self.send(msg)
+        self.msg = self.transport.query(msg)
 
-        self.msg = self.socket.recv(1024)
+        return self.msg
 
-        self.msg = self.msg.decode().strip('\n')
+    def wait_finished(self):
 
-        return self.msg
+        self.transport.opc()
 
     def set_center_freq(self, freq):
 
@@ -89,22 +69,88 @@ class Keysight:
         self.send(':CALC:MARK' + str(no) + ':STATE ON')
 
     def marker_measure(self, no, wait_time = None):
-
-        self.send(':CALC:MARK' + str(no) + ':MAX')
-
-        if not wait_time is None:
+        """
+        Peak search with marker `no`, returns (frequency, amplitude, error).
+        Peak search and readout go out as one concatenated query together with
+        the status byte, the error queue is only read if its bit (value 4) is set.
+        """
+
+        mark = ':CALC:MARK' + str(no)
+
+        if wait_time is None:
+            reply = self.query(mark + ':MAX;' + mark + ':X?;' + mark + ':Y?;*STB?')
+        else:
+            self.send(mark + ':MAX')
             time.sleep(wait_time)
+            reply = self.query(mark + ':X?;' + mark + ':Y?;*STB?')
 
-        x = self.query(':CALC:MARK' + str(no) + ':X?')
-        
-        y = self.query(':CALC:MARK' + str(no) + ':Y?')        
-        
-        err = self.query(':SYST:ERR?')        
+        x, y, stb = reply.split(';')
+
+        if int(float(stb)) & 4:
+            err = self.read_errors()
+        else:
+            err = NO_ERROR
 
         return (np.float64(x), np.float64(y), err)
 
+    def read_errors(self, max_errors = 20):
+        """
+        Empty the error queue, returns the entries joined by '; ' (NO_ERROR if empty).
+        """
+
+        errors = []
+        for i in range(max_errors):
+            err = self.query(':SYST:ERR?')
+            if err.lstrip('+').startswith('0,'):
+                break
+            errors.append(err)
+
+        return '; '.join(errors) if errors else NO_ERROR
+
+    def set_freq_range(self, start, stop):
+
+        self.send(':FREQ:STAR ' + str(start) + ' Hz;:FREQ:STOP ' + str(stop) + ' Hz')
+
+    def get_freq_range(self):
+
+        start, stop = self.query(':FREQ:STAR?;:FREQ:STOP?').split(';')
+        return float(start), float(stop)
+
+    def set_sweep_points(self, n):
+
+        self.send(':SWE:POIN ' + str(int(n)))
+
+    def get_sweep_points(self):
+
+        return int(float(self.query(':SWE:POIN?')))
+
+    def get_sweep_time(self):
+
+        return float(self.query(':SWE:TIME?'))
+
+    def set_continuous(self, on):
+
+        self.send(':INIT:CONT ' + ('ON' if on else 'OFF'))
+
+    def single_sweep(self, timeout = 10.0):
+        """
+        Start one sweep and wait until it is finished.
+        """
+
+        self.transport.query(':INIT:IMM;*OPC?', timeout = timeout, retry = False)
+
+    def get_trace(self, no, timeout = 10.0):
+        """
+        Trace `no` as float32 amplitudes, downloaded as a binary REAL,32 block.
+        """
+
+        self.send(':FORM:DATA REAL,32;:FORM:BORD SWAP')
+        block = self.transport.query_block(':TRAC:DATA? TRACE' + str(no), timeout = timeout)
+
+        return np.frombuffer(block, dtype='<f4')
+
     def close(self):
 
-        self.socket.close()
+        self.transport.close()
 
    
@@ -1,56 +1,117 @@
-import socket
+import asyncio
+import threading
 import time
 
+from scpi_transport import ScpiTransport
+
 
 class LaserClient:
 
-    def __init__(self):
+    def __init__(self, TCP_IP="192.168.42.26", TCP_PORT=63700):
 
-        TCP_IP = "192.168.42.26"
-        TCP_PORT = 63700
+        # the Laser Lock GUI, or a local laser_server_sim.py
         self.address = (TCP_IP, TCP_PORT)
 
-        self._create_connection()
+        # Line-based protocol, reconnects and retries a query once on a broken connection
+        self.transport = ScpiTransport(TCP_IP, TCP_PORT, timeout=5.0, encoding="utf-8")
 
-    def _create_connection(self):
+        # Frequency cache {laserid: (frequency, time.monotonic() of the reply)}, see `start_polling`
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+        self._poller = None
+        self.poll_interval = None
+        self.max_age = 0.0
 
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect(self.address)
+    @classmethod
+    def from_address(cls, address: str):
+        """
+        Client for "host:port" (port defaults to 63700).
+        """
 
-        # Enable line-based reader
-        self.socket = s
-        self.rf = s.makefile('r', encoding = "utf-8", newline = "")
+        host, _, port = address.strip().partition(':')
+        return cls(host, int(port) if port else 63700)
 
-    def _reconnect(self):
-        self.close()
-        self._create_connection()
+    def query(self, message: str) -> str:
 
-    def _send(self, message: str):
+        return self.transport.query(message)
 
-        if not message.endswith('\n'):
-            message += '\n'
+    # Frequency cache
+    # ===============================================================
+    @staticmethod
+    def _parse_frequency(laserid, respond):
 
-        self.socket.sendall(message.encode("utf-8"))
+        try:
+            laserid_recv, last_freq = respond.split(',')
+        except (AttributeError, ValueError):
+            return None
+        if laserid_recv != str(laserid):
+            print("Mismatched Laser ID!")
+            return None
+        try:
+            return float(last_freq)
+        except ValueError:
+            return None
 
-    def _recv(self) -> str:
-        """Line based receiving"""
+    def _store(self, laserid, frequency, t):
 
-        line = self.rf.readline()
-        if not line:
-            raise ConnectionResetError("EOF from server")
+        with self._cache_lock:
+            self._cache[str(laserid)] = (frequency, t)
 
-        return line.rstrip('\r\n')
+    def _invalidate(self, laserid):
 
-    def query(self, message: str) -> str:
+        with self._cache_lock:
+            self._cache.pop(str(laserid), None)
 
-        try:
-            self._send(message)
-            return self._recv()
+    def cached_frequency(self, laserid, max_age: float = None):
+        """
+        (frequency, age in s) of the cached reading of `laserid`, None if there
+        is none or it is older than `max_age` (default `self.max_age`).
+        """
+
+        max_age = self.max_age if max_age is None else max_age
+        with self._cache_lock:
+            entry = self._cache.get(str(laserid))
+        if entry is None:
+            return None
+
+        age = time.monotonic() - entry[1]
+        return (entry[0], age) if age <= max_age else None
+
+    async def _poll(self, laserids, interval):
+
+        messages = [f"{laserid},?" for laserid in laserids]
+        while True:
+            try:
+                replies = await self.transport.aio.query_many(messages, retry=False)
+                now = time.monotonic()
+                for laserid, respond in zip(laserids, replies):
+                    frequency = self._parse_frequency(laserid, respond)
+                    if frequency is not None:
+                        self._store(laserid, frequency, now)
+            except (ConnectionError, OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                pass    # reconnects on the next round
+
+            await asyncio.sleep(interval)
+
+    def start_polling(self, laserids=(422, 390), interval: float = 0.2, max_age: float = None):
+        """
+        Keep the frequencies of `laserids` cached, polled every `interval` s in the
+        background with one pipelined request. `get_frequency` then answers from the
+        cache while the reading is at most `max_age` old (default 2 * interval).
+        """
 
-        except (BrokenPipeError, ConnectionResetError, OSError):
-            self._reconnect()
-            self._send(message)
-            return self._recv()
+        self.stop_polling()
+        self.poll_interval = interval
+        self.max_age = 2 * interval if max_age is None else max_age
+        self._poller = self.transport.loop.submit(self._poll(list(laserids), interval))
+
+    def stop_polling(self):
+
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+        self.poll_interval = None
+        self.max_age = 0.0
 
     def set_frequency(self, laserid, setpoint: float, max_attempt: int = 3) -> None:
         """
@@ -62,6 +123,7 @@ class LaserClient:
 
         for attempt in range(max_attempt):
             respond = self.query(f"{laserid},{setpoint:.6f}")
+            self._invalidate(laserid)
             if respond == '1':
                 print(f"Successfully sent setpoint {setpoint:.6f} THz to laser {laserid}!")
                 return
@@ -75,6 +137,7 @@ class LaserClient:
         """
         for attempt in range(max_attempt):
             respond = self.query(f"{laserid},switch")
+            self._invalidate(laserid)
             if respond == "1":
                 print(f"Successfully switched to laser {laserid}!")
                 return
@@ -98,29 +161,46 @@ class LaserClient:
                 continue
         return None
 
-    def get_frequency(self, laserid, max_attempt: int = 3) -> float:
+    def get_frequency(self, laserid, max_attempt: int = 3, max_age: float = None) -> float:
         """
         Get last wavemeter reading (THz) of laser `laserid` from remote server.
         Warning: returns cached value. If fiber was on another laser, the value may be stale.
         Use switch_and_get_frequency() to switch first and ensure fresh reading.
+        While polling, a reading at most `max_age` s old is taken from the local cache.
         """
-        respond = None
+
+        return self.get_frequencies([laserid], max_attempt=max_attempt, max_age=max_age)[0]
+
+    def get_frequencies(self, laserids, max_attempt: int = 3, max_age: float = None) -> list:
+        """
+        `get_frequency` of several lasers, the ones not in the cache are requested
+        together in one pipelined round trip.
+        """
+
+        frequencies = [None] * len(laserids)
+        for k, laserid in enumerate(laserids):
+            cached = self.cached_frequency(laserid, max_age)
+            if cached is not None:
+                frequencies[k] = cached[0]
 
         for attempt in range(max_attempt):
-            respond = self.query(f"{laserid},?")
-            try:
-                laserid_recv, last_freq = respond.split(',')
-                if laserid_recv != str(laserid):
-                    print("Mismatched Laser ID!")
-                    continue
-                return float(last_freq)
+            missing = [k for k, freq in enumerate(frequencies) if freq is None]
+            if not missing:
+                break
 
-            # Difference between `except:` and `except Exception:` is the former will capture `BaseException` like `KeyBoardInterrupt`, `SystemExit`, `GeneratorExit`, etc, which is not good, the latter is good.
-            except Exception:
-                continue
+            replies = self.transport.query_many([f"{laserids[k]},?" for k in missing])
+            now = time.monotonic()
+            for k, respond in zip(missing, replies):
+                frequencies[k] = self._parse_frequency(laserids[k], respond)
+                if frequencies[k] is not None:
+                    self._store(laserids[k], frequencies[k], now)
 
-        print(f"Failed to get last frequency of laser {laserid} after {max_attempt} attempts!")
-        return 0.0
+        for k, freq in enumerate(frequencies):
+            if freq is None:
+                print(f"Failed to get last frequency of laser {laserids[k]} after {max_attempt} attempts!")
+                frequencies[k] = 0.0
+
+        return frequencies
 
     def get_setpoint(self, laserid, max_attempt: int = 3) -> float:
 
@@ -152,9 +232,8 @@ class LaserClient:
 
     def close(self):
 
-        try: self.rf.close()
-        except Exception: pass
-        try: self.socket.close()
+        self.stop_polling()
+        try: self.transport.close()
         except Exception: pass
 
 
@@ -0,0 +1,302 @@
+"""
+Local stand-in for the Laser Lock GUI server, for benchmarking and testing
+the laser handling without the lab.
+
+Speaks the same line protocol as the real server:
+    <id>,<setpoint>   set the lock setpoint (THz)        -> 1, or 0 for unknown lasers
+    <id>,?            last wavemeter reading             -> <id>,<frequency>
+    <id>,set?         current setpoint                   -> <id>,<setpoint>, or 0
+    <id>,switch       switch the fiber to this laser     -> 1, or 0
+
+Each laser settles exponentially onto a new setpoint, drifts around it while
+locked and occasionally mode hops away, the wavemeter refreshes at a finite
+rate and every reply is delayed by a configurable latency.
+
+    python laser_server_sim.py --port 63700 --latency 0.005 --hop-rate 0.01
+
+and point the experiment at it with the `laser_server` parameter
+("localhost:63700"), or `LaserClient("localhost", 63700)`.
+"""
+import argparse
+import asyncio
+import collections
+import math
+import random
+import threading
+import time
+
+DEFAULT_LASERS = {422: 709.076780, 390: 768.708843}
+
+
+class SimulatedLaser:
+    """
+    Frequency model of one locked laser (all frequencies in THz, times in s).
+        settle_time: time constant of the approach to a new setpoint
+        drift:       random walk of the locked frequency, THz/sqrt(s), pulled back within settle_time
+        noise:       white noise of a wavemeter reading
+        hop_rate:    mode hops per second, each moves the laser by +/- hop_size
+        hop_duration: time until a hop is "fixed", 0 keeps it until the next setpoint
+    """
+
+    def __init__(self, setpoint, settle_time=0.5, drift=2e-7, noise=2e-7,
+                 hop_rate=0.0, hop_size=0.02, hop_duration=5.0, rng=None):
+
+        self.setpoint = setpoint
+        self.settle_time = settle_time
+        self.drift = drift
+        self.noise = noise
+        self.hop_rate = hop_rate
+        self.hop_size = hop_size
+        self.hop_duration = hop_duration
+        self.rng = rng or random.Random()
+
+        now = time.monotonic()
+        self._start = setpoint          # frequency when the setpoint was set
+        self._t_set = now
+        self._offset = 0.0              # drift around the setpoint
+        self._hop = 0.0
+        self._hop_until = None
+        self._t_last = now
+
+    def set_setpoint(self, setpoint):
+
+        now = time.monotonic()
+        self._start = self.frequency(now, noise=False)
+        self._t_set = now
+        self.setpoint = setpoint
+
+        # relocking clears a mode hop
+        self._hop = 0.0
+        self._hop_until = None
+
+    def _advance(self, now):
+
+        dt = max(0.0, now - self._t_last)
+        self._t_last = now
+
+        # Ornstein-Uhlenbeck drift around the setpoint
+        if dt > 0 and self.drift > 0:
+            pull = math.exp(-dt / max(self.settle_time, 1e-3))
+            self._offset = self._offset * pull + self.drift * math.sqrt(dt) * self.rng.gauss(0, 1)
+
+        # mode hops
+        if self._hop_until is not None and self.hop_duration > 0 and now >= self._hop_until:
+            self._hop = 0.0
+            self._hop_until = None
+        if self._hop == 0.0 and self.hop_rate > 0 and self.rng.random() < 1 - math.exp(-self.hop_rate * dt):
+            self.mode_hop(now=now)
+
+    def mode_hop(self, size=None, now=None):
+        """
+        Hop away from the setpoint by `size` (default +/- hop_size) now.
+        """
+
+        now = time.monotonic() if now is None else now
+        self._hop = self.rng.choice((-1, 1)) * self.hop_size if size is None else size
+        self._hop_until = now + self.hop_duration
+
+    def frequency(self, now=None, noise=True):
+
+        now = time.monotonic() if now is None else now
+        self._advance(now)
+
+        settle = math.exp(-(now - self._t_set) / max(self.settle_time, 1e-6))
+        freq = self.setpoint + (self._start - self.setpoint) * settle + self._offset + self._hop
+        if noise and self.noise > 0:
+            freq += self.rng.gauss(0, self.noise)
+        return freq
+
+
+class LaserServerSim:
+    """
+    asyncio server answering the Laser Lock GUI protocol for a set of `SimulatedLaser`s.
+        latency:            delay of every reply (s), plus uniform jitter in [0, jitter]; the
+                            delays of pipelined requests overlap, replies keep the request order
+        wavemeter_interval: a reading is refreshed at most this often (s)
+        switched_fiber:     True: only the laser the fiber is switched to is measured,
+                            the others return their last reading (as with one wavemeter channel)
+    """
+
+    def __init__(self, lasers=None, host="127.0.0.1", port=63700, latency=0.0, jitter=0.0,
+                 wavemeter_interval=0.05, switched_fiber=False, switch_time=1.0, seed=None, **laser_kwargs):
+
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.wavemeter_interval = wavemeter_interval
+        self.switched_fiber = switched_fiber
+        self.switch_time = switch_time
+
+        self.rng = random.Random(seed)
+        lasers = DEFAULT_LASERS if lasers is None else lasers
+        self.lasers = {str(laserid): SimulatedLaser(setpoint, rng=self.rng, **laser_kwargs)
+                       for laserid, setpoint in lasers.items()}
+
+        self._readings = {}                 # laserid -> (frequency, time)
+        self._active = next(iter(self.lasers), None)
+        self._active_from = 0.0
+        self._server = None
+        self.n_requests = 0
+
+    # 1) Internal Methods
+    #================================================================
+    def _reading(self, laserid):
+
+        now = time.monotonic()
+        last = self._readings.get(laserid)
+
+        measured = (not self.switched_fiber) or (laserid == self._active and now >= self._active_from)
+        if measured and (last is None or now - last[1] >= self.wavemeter_interval):
+            last = (self.lasers[laserid].frequency(now), now)
+            self._readings[laserid] = last
+
+        return last[0] if last is not None else 0.0
+
+    def handle_line(self, line):
+
+        self.n_requests += 1
+        try:
+            laserid, command = line.strip().split(",", 1)
+        except ValueError:
+            return "0"
+
+        if laserid not in self.lasers:
+            return "0"
+        laser = self.lasers[laserid]
+
+        if command == "?":
+            return f"{laserid},{self._reading(laserid):.6f}"
+        if command == "set?":
+            return f"{laserid},{laser.setpoint:.6f}"
+        if command == "switch":
+            self._active = laserid
+            self._active_from = time.monotonic() + self.switch_time
+            return "1"
+
+        try:
+            laser.set_setpoint(float(command))
+        except ValueError:
+            return "0"
+        return "1"
+
+    async def _handle_client(self, reader, writer):
+
+        # A request is handled when it arrives, its reply is sent `delay` later.
+        # Replies wait in request order until all earlier ones are sent.
+        loop = asyncio.get_running_loop()
+        replies = collections.deque()       # [reply, due] in request order
+        last_due = loop.time()
+
+        def send_due():
+            while replies and replies[0][1] and not writer.is_closing():
+                writer.write((replies.popleft()[0] + "\n").encode("utf-8"))
+
+        def due(entry):
+            entry[1] = True
+            send_due()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                entry = [self.handle_line(line.decode("utf-8")), False]
+                replies.append(entry)
+
+                delay = self.latency + self.rng.uniform(0, self.jitter)
+                if delay > 0:
+                    loop.call_later(delay, due, entry)
+                    last_due = max(last_due, loop.time() + delay)
+                else:
+                    due(entry)
+                await writer.drain()
+
+            # the client may still read the replies in flight
+            await asyncio.sleep(max(0.0, last_due - loop.time()))
+            await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    # 2) Usages
+    #================================================================
+    async def start(self):
+
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.host, self.port
+
+    async def serve_forever(self):
+
+        if self._server is None:
+            await self.start()
+        print(f"[LaserServerSim] Listening on {self.host}:{self.port}, lasers {', '.join(self.lasers)}")
+        async with self._server:
+            await self._server.serve_forever()
+
+    def run_in_thread(self):
+        """
+        Serve on a daemon thread (for benchmarks in the same process, see
+        laser_sim_benchmark.py), returns (host, port). Use port=0 to get a free port.
+        """
+
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start())
+            started.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, name="laser-server-sim", daemon=True).start()
+        started.wait()
+        return self.host, self.port
+
+
+def _parse_lasers(items):
+
+    lasers = {}
+    for item in items:
+        laserid, setpoint = item.split(":")
+        lasers[int(laserid)] = float(setpoint)
+    return lasers
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Local stand-in for the Laser Lock GUI server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=63700)
+    parser.add_argument("--lasers", nargs="+", default=None, help="id:setpoint_THz, e.g. 422:709.076780 390:768.708843")
+    parser.add_argument("--latency", type=float, default=0.0, help="reply delay in s")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra uniform reply delay in s")
+    parser.add_argument("--wavemeter-interval", type=float, default=0.05)
+    parser.add_argument("--switched-fiber", action="store_true", help="only the switched-to laser is measured")
+    parser.add_argument("--switch-time", type=float, default=1.0)
+    parser.add_argument("--settle-time", type=float, default=0.5)
+    parser.add_argument("--drift", type=float, default=2e-7, help="THz/sqrt(s)")
+    parser.add_argument("--noise", type=float, default=2e-7, help="THz")
+    parser.add_argument("--hop-rate", type=float, default=0.0, help="mode hops per s and laser")
+    parser.add_argument("--hop-size", type=float, default=0.02, help="THz")
+    parser.add_argument("--hop-duration", type=float, default=5.0, help="s, 0: until the next setpoint")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = LaserServerSim(
+        lasers = _parse_lasers(args.lasers) if args.lasers else None,
+        host = args.host, port = args.port,
+        latency = args.latency, jitter = args.jitter,
+        wavemeter_interval = args.wavemeter_interval,
+        switched_fiber = args.switched_fiber, switch_time = args.switch_time,
+        seed = args.seed,
+        settle_time = args.settle_time, drift = args.drift, noise = args.noise,
+        hop_rate = args.hop_rate, hop_size = args.hop_size, hop_duration = args.hop_duration,
+    )
+
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,144 @@
+"""
+Benchmark of the laser handling against the local Laser Lock GUI stand-in
+(laser_server_sim.py), no lab needed. The server runs on a thread of this
+process, the client is the `LaserClient` used by the experiments.
+
+    readings: pre-flight laser reading of a scan point (`InstrumentPreflight`,
+              formerly `record_laser_frequencies`): two `get_frequency` round
+              trips, one pipelined `get_frequencies`, the polled cache
+    jump:     `handle_laser_jump` after a mode hop, delay from the fix until
+              the waiting loop sees the laser back on its setpoint
+    relock:   setpoint steps of a 422 frequency scan (`_scan_frequency_422`, the
+              scans of `relock_laser`), fixed 1 s wait against the actual settling
+
+    python laser_sim_benchmark.py --latency 0.005 --points 200
+"""
+import argparse
+import random
+import statistics
+import time
+
+from laser_controller import LaserClient
+from laser_server_sim import LaserServerSim
+
+SCAN_WAIT = 1.0     # fixed wait after a setpoint in `_scan_frequency_422`
+
+
+def bench_readings(client, n_points, poll_interval):
+    """
+    Mean time (s) of the laser readings of one scan point, per way of reading.
+    """
+
+    def mean_time(read):
+        t0 = time.perf_counter()
+        for _ in range(n_points):
+            read()
+        return (time.perf_counter() - t0) / n_points
+
+    results = {
+        '2x get_frequency': mean_time(lambda: (client.get_frequency(422), client.get_frequency(390))),
+        'get_frequencies':  mean_time(lambda: client.get_frequencies([422, 390])),
+    }
+
+    client.start_polling((422, 390), interval=poll_interval)
+    time.sleep(2 * poll_interval)
+    results[f'polled ({poll_interval:g} s)'] = mean_time(lambda: client.get_frequencies([422, 390]))
+    client.stop_polling()
+
+    return results
+
+def bench_laser_jump(server, client, laserid, tol, hop_size, fix_after, poll_interval=None):
+    """
+    Delay (s) between the end of a mode hop and the waiting loop of
+    `handle_laser_jump` returning, started once the hop is seen.
+    """
+
+    laser = server.lasers[str(laserid)]
+    setpoint = laser.setpoint
+
+    if poll_interval:
+        client.start_polling((laserid,), interval=poll_interval)
+
+    laser.hop_duration = fix_after
+    laser.mode_hop(size=hop_size)
+    t_fixed = time.monotonic() + fix_after
+
+    # the reading that raised the LaserError
+    act_freq = client.get_frequency(laserid)
+    while abs(act_freq - setpoint) <= tol:
+        time.sleep(0.01)
+        act_freq = client.get_frequency(laserid)
+
+    # handle_laser_jump
+    while abs(act_freq - setpoint) > tol:
+        time.sleep(client.poll_interval or 1.0)
+        act_freq = client.get_frequency(laserid)
+
+    delay = time.monotonic() - t_fixed
+    client.stop_polling()
+    return delay
+
+def bench_relock_steps(client, laserid, start, step, n_steps, tol):
+    """
+    Settling times (s) of the setpoint steps of a frequency scan, from sending
+    the setpoint until the reading is within `tol` of it.
+    """
+
+    settle_times = []
+    for k in range(n_steps):
+        setpoint = start + k * step
+
+        t0 = time.monotonic()
+        client.set_frequency(laserid, setpoint)
+        while abs(client.get_frequency(laserid) - setpoint) > tol:
+            time.sleep(0.01)
+        settle_times.append(time.monotonic() - t0)
+
+    return settle_times
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Laser handling benchmark against laser_server_sim.py")
+    parser.add_argument("--latency", type=float, default=0.005, help="reply delay of the server in s")
+    parser.add_argument("--jitter", type=float, default=0.001, help="extra uniform reply delay in s")
+    parser.add_argument("--points", type=int, default=200, help="scan points of the readings benchmark")
+    parser.add_argument("--poll-interval", type=float, default=0.2, help="s, LaserClient.start_polling")
+    parser.add_argument("--settle-time", type=float, default=0.2, help="s, lock time constant")
+    parser.add_argument("--hop-size", type=float, default=0.02, help="THz")
+    parser.add_argument("--fix-after", type=float, default=2.0, help="s until a mode hop is fixed")
+    parser.add_argument("--jumps", type=int, default=5, help="mode hops per way of waiting")
+    parser.add_argument("--steps", type=int, default=5, help="setpoint steps of the relock scan")
+    parser.add_argument("--step-size", type=float, default=1e-4, help="THz")
+    parser.add_argument("--tol", type=float, default=1e-5, help="THz, as in handle_laser_jump")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = LaserServerSim(port=0, latency=args.latency, jitter=args.jitter, seed=args.seed,
+                            settle_time=args.settle_time)
+    host, port = server.run_in_thread()
+    client = LaserClient(host, port)
+
+    try:
+        print(f"Laser server simulator on {host}:{port}, latency {args.latency*1e3:g} ms + {args.jitter*1e3:g} ms jitter\n")
+
+        print(f"Pre-flight laser readings, mean of {args.points} points:")
+        for name, t in bench_readings(client, args.points, args.poll_interval).items():
+            print(f"  {name:<20} {t*1e3:8.3f} ms")
+
+        # hops fixed at a random phase of the 1 s sleep
+        rng = random.Random(args.seed)
+        print(f"\nhandle_laser_jump, delay after the hop is fixed ({args.fix_after:g}-{args.fix_after + 1:g} s):")
+        for name, interval in (("1 s sleep", None), (f"polled ({args.poll_interval:g} s)", args.poll_interval)):
+            delays = [bench_laser_jump(server, client, 422, args.tol, args.hop_size, args.fix_after + rng.random(), interval)
+                      for _ in range(args.jumps)]
+            print(f"  {name:<20} {statistics.mean(delays):8.3f} s mean, {max(delays):.3f} s max")
+
+        print(f"\n422 scan steps of {args.step_size*1e6:g} MHz, settling within {args.tol*1e6:g} MHz:")
+        start = server.lasers['422'].setpoint
+        settle_times = bench_relock_steps(client, 422, start + args.step_size, args.step_size, args.steps, args.tol)
+        print(f"  settled after      {statistics.mean(settle_times):8.3f} s mean, {max(settle_times):.3f} s max "
+              f"(fixed wait {SCAN_WAIT:g} s)")
+
+    finally:
+        client.close()
@@ -0,0 +1,147 @@
+import json
+import os
+import numpy as np
+
+RF_CALIBRATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rf_calibration.json")
+
+
+class RFCalibration:
+    """
+    Generator setpoint -> measured amplitude curve (dBm -> dBm) for every RF
+    frequency, learned from the amplitude locks and kept in a JSON file:
+
+        {"update_date": 20251217,
+         "curves": {"1732000000": [[setpoint, measured], ...], ...}}
+
+    A file written for another `update_date` (another RF system) is ignored.
+    Points closer than `resolution` dB in setpoint replace each other, so a
+    curve stays small and follows slow drifts.
+    """
+
+    def __init__(self, path=RF_CALIBRATION_FILE, update_date=None,
+                 frequency_tol=1e6, resolution=0.05, max_points=200):
+
+        self.path = path
+        self.update_date = update_date
+        self.frequency_tol = frequency_tol
+        self.resolution = resolution
+        self.max_points = max_points
+
+        self.curves = {}
+        self._load()
+
+    # 1) Internal Methods
+    #================================================================
+    def _load(self):
+
+        if self.path is None or not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            print(f"[RFCalibration] Could not read {self.path}, starting a new calibration.")
+            return
+
+        if self.update_date is not None and data.get("update_date") != self.update_date:
+            print("[RFCalibration] Calibration file is from another RF system, starting a new calibration.")
+            return
+
+        self.curves = {int(freq): [tuple(p) for p in points] for freq, points in data.get("curves", {}).items()}
+
+    @staticmethod
+    def _key(frequency):
+        return int(round(frequency))
+
+    def _curve(self, frequency):
+        """
+        (setpoints, measured) of the closest calibrated frequency within `frequency_tol`, sorted by setpoint.
+        """
+
+        if not self.curves:
+            return None
+
+        key = self._key(frequency)
+        if key not in self.curves:
+            key = min(self.curves, key=lambda k: abs(k - frequency))
+            if abs(key - frequency) > self.frequency_tol:
+                return None
+
+        points = np.array(sorted(self.curves[key]), dtype=float)
+        return points[:, 0], points[:, 1]
+
+    @staticmethod
+    def _end_slope(setpoints, measured):
+
+        ds = setpoints[1] - setpoints[0]
+        slope = (measured[1] - measured[0]) / ds if ds != 0 else 1.0
+        # a flat or inverted segment (noise) would send the setpoint far away
+        return slope if slope > 0.05 else 1.0
+
+    # 2) Usages
+    #================================================================
+    def add(self, frequency, setpoint, measured):
+
+        points = self.curves.setdefault(self._key(frequency), [])
+        points[:] = [p for p in points if abs(p[0] - setpoint) >= self.resolution]
+        points.append((float(setpoint), float(measured)))
+
+        if len(points) > self.max_points:
+            del points[0]
+
+    def setpoint_for(self, frequency, target):
+        """
+        Generator setpoint expected to give `target`, None without calibration.
+        Interpolated on the curve, extrapolated with the slope of its ends.
+        """
+
+        curve = self._curve(frequency)
+        if curve is None:
+            return None
+
+        setpoints, measured = curve
+        if len(setpoints) == 1:
+            return setpoints[0] + (target - measured[0])
+
+        # the curve is monotonic up to noise, invert it on the measured axis
+        order = np.argsort(measured)
+        setpoints, measured = setpoints[order], measured[order]
+
+        if target < measured[0]:
+            return setpoints[0] + (target - measured[0]) / self._end_slope(setpoints[:2], measured[:2])
+        if target > measured[-1]:
+            return setpoints[-1] + (target - measured[-1]) / self._end_slope(setpoints[-2:], measured[-2:])
+
+        return float(np.interp(target, measured, setpoints))
+
+    def slope(self, frequency, setpoint):
+        """
+        d(measured)/d(setpoint) of the curve around `setpoint`, None without two calibration points.
+        """
+
+        curve = self._curve(frequency)
+        if curve is None or len(curve[0]) < 2:
+            return None
+
+        setpoints, measured = curve
+        i = int(np.clip(np.searchsorted(setpoints, setpoint), 1, len(setpoints) - 1))
+        return self._end_slope(setpoints[i-1:i+1], measured[i-1:i+1])
+
+    def save(self):
+
+        if self.path is None:
+            return
+
+        data = {
+            "update_date": self.update_date,
+            "curves": {str(freq): points for freq, points in sorted(self.curves.items())},
+        }
+
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(data, f, indent=1)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"[RFCalibration] Could not save {self.path}: {e}")
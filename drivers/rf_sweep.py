@@ -0,0 +1,210 @@
+import time
+import numpy as np
+import datetime
+import os
+
+from rs import RS
+from keysight_spectrum import Keysight
+
+MAX_SWEEP_POINTS = 40001
+
+def extract_peaks(trace_freqs, trace, step_freqs):
+    """
+    Peak (frequency, amplitude) of every generator step in one trace. Each step
+    owns the trace bins closer to it than to its neighbours, `step_freqs` sorted.
+    Steps without a bin get NaN.
+    """
+
+    step_freqs = np.asarray(step_freqs, dtype=float)
+    trace_freqs = np.asarray(trace_freqs, dtype=float)
+    trace = np.asarray(trace, dtype=float)
+
+    # step index of every bin
+    edges = (step_freqs[1:] + step_freqs[:-1]) / 2
+    owner = np.searchsorted(edges, trace_freqs)
+
+    # the last bin of every owner after sorting by (owner, amplitude) is its maximum
+    order = np.lexsort((trace, owner))
+    last = np.flatnonzero(np.diff(owner[order], append=len(step_freqs)))
+    peak_bins = order[last]
+
+    x = np.full(len(step_freqs), np.nan)
+    y = np.full(len(step_freqs), np.nan)
+    x[owner[peak_bins]] = trace_freqs[peak_bins]
+    y[owner[peak_bins]] = trace[peak_bins]
+
+    return x, y
+
+
+class RFSweep:
+    """
+    RF transfer function sweep with trace downloads instead of one marker
+    reading per generator step.
+
+    The frequency list is cut into windows of `steps_per_window` steps. For
+    every window the analyzer span covers all its steps and
+        max_hold=True:  the analyzer sweeps continuously in max hold while the
+                        generator steps through the window, dwelling one sweep
+                        time per step, then one trace is downloaded
+        max_hold=False: one single sweep and trace download per step
+    and the peak of every step is taken from the trace with NumPy.
+    """
+
+    def __init__(self, generator, spec, trace_no=1, oversampling=8):
+
+        self.generator = generator
+        self.spec = spec
+        self.trace_no = trace_no
+        self.oversampling = oversampling
+
+    # 1) Internal Methods
+    #================================================================
+    def _configure_window(self, step_freqs):
+
+        spacing = np.min(np.diff(step_freqs)) if len(step_freqs) > 1 else 1e6
+        start = step_freqs[0] - spacing / 2
+        stop = step_freqs[-1] + spacing / 2
+
+        # several trace bins per step so that the peak is resolved
+        n_points = int(np.clip(np.ceil((stop - start) / spacing * self.oversampling) + 1, 101, MAX_SWEEP_POINTS))
+
+        self.spec.set_freq_range(start, stop)
+        self.spec.set_sweep_points(n_points)
+
+        # bin frequencies as the analyzer actually set them
+        start, stop = self.spec.get_freq_range()
+        return np.linspace(start, stop, self.spec.get_sweep_points())
+
+    def _sweep_max_hold(self, step_freqs, dwell):
+
+        trace_freqs = self._configure_window(step_freqs)
+
+        if dwell is None:
+            dwell = 1.2 * self.spec.get_sweep_time()
+
+        # restart the max hold for this window, on the first step
+        self.generator.set_freq(step_freqs[0])
+        self.spec.set_continuous(True)
+        self.spec.set_trace(self.trace_no, 'WRIT')
+        self.spec.set_trace(self.trace_no, 'MAXH')
+
+        for freq in step_freqs:
+            self.generator.set_freq(freq)
+            time.sleep(dwell)
+
+        trace = self.spec.get_trace(self.trace_no)
+        return extract_peaks(trace_freqs, trace, step_freqs)
+
+    def _sweep_single(self, step_freqs, timeout):
+
+        trace_freqs = self._configure_window(step_freqs)
+
+        self.spec.set_continuous(False)
+        self.spec.set_trace(self.trace_no, 'WRIT')
+
+        x = np.zeros(len(step_freqs))
+        y = np.zeros(len(step_freqs))
+        for i, freq in enumerate(step_freqs):
+            self.generator.set_freq(freq)
+            self.spec.single_sweep(timeout)
+            trace = self.spec.get_trace(self.trace_no)
+
+            # only the bins of this step
+            xi, yi = extract_peaks(trace_freqs, trace, step_freqs)
+            x[i], y[i] = xi[i], yi[i]
+
+        self.spec.set_continuous(True)
+        return x, y
+
+    # 2) Usages
+    #================================================================
+    def sweep(self, freq_arr, steps_per_window=100, max_hold=True, dwell=None, timeout=10.0):
+        """
+        Measured (frequency, amplitude) arrays of all generator frequencies `freq_arr` (sorted, Hz).
+            dwell: time per step in max hold, default 1.2 sweep times
+        """
+
+        freq_arr = np.asarray(freq_arr, dtype=float)
+        x_arr = np.zeros(len(freq_arr))
+        y_arr = np.zeros(len(freq_arr))
+
+        for i in range(0, len(freq_arr), steps_per_window):
+            window = slice(i, i + steps_per_window)
+            if max_hold:
+                x_arr[window], y_arr[window] = self._sweep_max_hold(freq_arr[window], dwell)
+            else:
+                x_arr[window], y_arr[window] = self._sweep_single(freq_arr[window], timeout)
+
+            print(f' Window {i // steps_per_window + 1}/{int(np.ceil(len(freq_arr) / steps_per_window))}: '
+                  f'{freq_arr[window][0]/1e9:.4f} to {freq_arr[window][-1]/1e9:.4f} GHz')
+
+        return x_arr, y_arr
+
+if __name__ == '__main__':
+
+    import matplotlib.pyplot as plt
+
+    ############################
+    ##### Experiment setup #####
+    ############################
+    low_freq = 1200e+06
+    high_freq = 2400e+06
+    steps = 1201
+    amplitude = -2.0
+    steps_per_window = 100
+    max_hold = True
+    experiment_name = 'LowP_Al_withfoil_R'
+    folder_suffix = ''
+
+    SPEC_REF = 10
+    SPEC_DIV = 10
+
+    #####################################
+    ##### Experiment initialization #####
+    #####################################
+    rf = RS()
+    spec = Keysight()
+
+    rf.set_ampl(amplitude)
+    rf.on()
+    spec.set_ref_ampl(SPEC_REF)
+    spec.set_div_ampl(SPEC_DIV)
+
+    freq_arr = np.linspace(low_freq, high_freq, steps)
+
+    ######################
+    ##### Experiment #####
+    ######################
+    start_time = time.time()
+
+    x_arr, y_arr = RFSweep(rf, spec).sweep(freq_arr, steps_per_window=steps_per_window, max_hold=max_hold)
+
+    rf.off()
+
+    rf.close()
+    spec.close()
+
+    end_time = time.time()
+    print(f'Total time consumption: {end_time - start_time:.2f}')
+
+    ################################
+    ##### Save experiment data #####
+    ################################
+    timestamp = datetime.datetime.today()
+    folder = 'data/' + timestamp.strftime('%Y%m%d') + folder_suffix
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    basefilename = folder + '/' + experiment_name
+
+    np.savetxt(basefilename + '_x.csv', x_arr, delimiter=",")
+    np.savetxt(basefilename + '_y.csv', y_arr, delimiter=",")
+
+    ##########################
+    ##### Result preview #####
+    ##########################
+    plt.figure()
+    plt.plot(x_arr, y_arr)
+    plt.title(experiment_name)
+    plt.xlabel('Frequency')
+    plt.ylabel('Response')
+    plt.show()
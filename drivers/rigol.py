@@ -11,16 +11,17 @@ class DSG821(BaseVisaInstrument):
         super().__init__(IP)
 
     def set_freq(self, freq):
-        self.write(':FREQ {0}MHz'.format(float(freq)))
+        # the instrument replies in Hz
+        self.write_setting(':FREQ', float(freq), unit='MHz', scale=1e6)
 
     def set_ampl(self, level):
-        self.write(':LEV {0}'.format(float(level)))
+        self.write_setting(':LEV', float(level))
 
     def on(self):
-        self.write(':OUTP ON')
+        self.write_setting(':OUTP', 'ON')
 
     def off(self):
-        self.write(':OUTP OFF')
+        self.write_setting(':OUTP', 'OFF')
 
     def close(self):
         super().close()
@@ -37,11 +38,11 @@ class DG4162(BaseVisaInstrument):
     # Output control
     # -------------------------------------------------------------------------
     def on(self, channel=1):
-        self.write(f":OUTPut{channel}:STATe ON")
+        self.write_setting(f":OUTPut{channel}:STATe", "ON")
 
     def off(self, channel=1, disable_output=True, kill_socket=False):
         if disable_output:
-            self.write(f":OUTPut{channel}:STATe OFF")
+            self.write_setting(f":OUTPut{channel}:STATe", "OFF")
         if kill_socket:
             super().close()
 
@@ -49,27 +50,35 @@ class DG4162(BaseVisaInstrument):
     # Function / waveform
     # -------------------------------------------------------------------------
     def set_function(self, channel, function):
-        self.write(f":SOURce{channel}:FUNCtion {function}")
+        if self.write_setting(f":SOURce{channel}:FUNCtion", function):
+            # a new waveform may come with its own defaults, rewrite the rest of the channel
+            for header in list(self.registers):
+                if header.startswith(f":SOURce{channel}:") and header != f":SOURce{channel}:FUNCtion":
+                    self.invalidate(header)
 
     def set_frequency(self, channel, frequency):
         # frequency unit: Hz
-        self.write(f":SOURce{channel}:FREQuency {float(frequency)}")
+        if self.write_setting(f":SOURce{channel}:FREQuency", float(frequency)):
+            # the instrument keeps the duty cycle, the pulse width follows the period
+            self.invalidate(f":SOURce{channel}:PULSe:WIDTh")
 
     def set_voltage_high(self, channel, voltage):
         # voltage unit: V
-        self.write(f":SOURce{channel}:VOLTage:HIGH {float(voltage)}")
+        self.write_setting(f":SOURce{channel}:VOLTage:HIGH", float(voltage))
 
     def set_voltage_low(self, channel, voltage):
         # voltage unit: V
-        self.write(f":SOURce{channel}:VOLTage:LOW {float(voltage)}")
+        self.write_setting(f":SOURce{channel}:VOLTage:LOW", float(voltage))
 
     def set_pulse_duty(self, channel, duty):
         # duty unit: percentage
-        self.write(f":SOURce{channel}:FUNCtion:PULSe:DCYCle {float(duty)}")
+        if self.write_setting(f":SOURce{channel}:FUNCtion:PULSe:DCYCle", float(duty)):
+            self.invalidate(f":SOURce{channel}:PULSe:WIDTh")
 
     def set_pulse_width(self, channel, width):
         # width unit: s
-        self.write(f":SOURce{channel}:PULSe:WIDTh {float(width)}")
+        if self.write_setting(f":SOURce{channel}:PULSe:WIDTh", float(width)):
+            self.invalidate(f":SOURce{channel}:FUNCtion:PULSe:DCYCle")
 
     # -------------------------------------------------------------------------
     # Burst mode
@@ -77,14 +86,14 @@ class DG4162(BaseVisaInstrument):
     def set_burst_state(self, channel, on=True):
         """Enable or disable burst mode."""
         state = "ON" if on else "OFF"
-        self.write(f":SOURce{channel}:BURSt:STATe {state}")
+        self.write_setting(f":SOURce{channel}:BURSt:STATe", state)
 
     def set_burst_mode(self, channel, mode):
         """
         Set burst mode type.
         mode: 'TRIGgered' (N-cycle) or 'GATed'
         """
-        self.write(f":SOURce{channel}:BURSt:MODE {mode}")
+        self.write_setting(f":SOURce{channel}:BURSt:MODE", mode)
 
     def set_burst_ncycles(self, channel, n):
         """
@@ -92,17 +101,17 @@ class DG4162(BaseVisaInstrument):
         Use 'INFinity' for continuous burst.
         """
         if isinstance(n, str) and n.upper() == "INFINITY":
-            self.write(f":SOURce{channel}:BURSt:NCYCles INFinity")
+            self.write_setting(f":SOURce{channel}:BURSt:NCYCles", "INFinity")
         else:
-            self.write(f":SOURce{channel}:BURSt:NCYCles {int(n)}")
+            self.write_setting(f":SOURce{channel}:BURSt:NCYCles", int(n))
 
     def set_burst_trigger_source(self, channel, source):
         # source: INTernal | EXTernal | MANual
-        self.write(f":SOURce{channel}:BURSt:TRIGger:SOURce {source}")
+        self.write_setting(f":SOURce{channel}:BURSt:TRIGger:SOURce", source)
 
     def set_burst_trigger_slope(self, channel, slope):
         # slope: POSitive | NEGative
-        self.write(f":SOURce{channel}:BURSt:TRIGger:SLOPe {slope}")
+        self.write_setting(f":SOURce{channel}:BURSt:TRIGger:SLOPe", slope)
 
     def burst_trigger_immediate(self, channel):
         self.write(f":SOURce{channel}:BURSt:TRIGger:IMMediate")
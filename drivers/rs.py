@@ -1,60 +1,47 @@
-import socket
-import time
-import numpy as np
+from scpi_transport import ScpiTransport
 
 class RS:
     
-    def __init__(self):
+    def __init__(self, TCP_IP='192.168.42.61', TCP_PORT=5025, timeout=2.0):
 
-        TCP_IP = '192.168.42.61'
-        TCP_PORT = 5025
-
-        self.command_delay = 0.1
-
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    
-        s.connect((TCP_IP,TCP_PORT))
-    
-        #s.send(b"*IDN?\n")
-        #t = s.recv(1024)
-    
-        #print(t)
-        
-        self.socket = s
+        self.transport = ScpiTransport(TCP_IP, TCP_PORT, timeout=timeout)
     
     def send(self, msg):
 
-        send_msg = msg + '\n'
-
-        self.socket.send(send_msg.encode())
+        self.transport.write(msg)
 
-        time.sleep(self.command_delay)
+    def query(self, msg):
 
-    def recv(self):
+        return self.transport.query(msg)
 
-        self.msg = self.socket.recv(1024)
+    def wait_finished(self):
 
-        return self.msg
+        # replaces the fixed delay after every command
+        self.transport.opc()
 
     def on(self):
 
-        self.send('OUTP ON')        
+        self.send('OUTP ON')
+        self.wait_finished()
 
     def off(self):
 
         self.send('OUTP OFF')
+        self.wait_finished()
 
     def set_freq(self, freq):
 
         self.send('FREQ ' + str(freq) + ' Hz')
+        self.wait_finished()
 
     def set_ampl(self, ampl):
 
         self.send(':POW ' + str(ampl))
+        self.wait_finished()
 
     def close(self):
 
-        self.socket.close()
+        self.transport.close()
 
 
   
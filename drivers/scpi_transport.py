@@ -0,0 +1,263 @@
+import asyncio
+import threading
+
+
+class EventLoopThread:
+    """
+    One asyncio event loop on a daemon thread, shared by all transports.
+    Blocking callers hand coroutines over with `run` (wait for the result)
+    or `submit` (get a concurrent.futures.Future), so several instruments
+    can talk at the same time without a thread per socket.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name="scpi-transport", daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def instance(cls):
+
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def _run(self):
+
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro):
+        return self.submit(coro).result()
+
+
+class AsyncScpiTransport:
+    """
+    Line-framed SCPI over a raw TCP socket (port 5025 on most instruments).
+
+    Every message is terminated with `terminator`, replies are read up to the
+    next newline. Each read has a timeout; a timed out or broken connection
+    is dropped and re-opened on the next call, queries are retried once on a
+    fresh connection. Completion is checked with `*OPC?` instead of sleeping
+    after every command. All calls on one transport are serialized.
+    """
+
+    def __init__(self, host, port, timeout=2.0, terminator="\n", encoding="ascii"):
+
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.terminator = terminator
+        self.encoding = encoding
+
+        self._reader = None
+        self._writer = None
+        self._lock = None
+
+    # 1) Internal Methods
+    #================================================================
+    def _get_lock(self):
+
+        # created on first use, inside the event loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def _open(self):
+
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout
+        )
+
+    async def _drop(self):
+
+        writer, self._reader, self._writer = self._writer, None, None
+        if writer is None:
+            return
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+    async def _ensure_open(self):
+
+        if self._writer is None or self._writer.is_closing():
+            await self._drop()
+            await self._open()
+
+    async def _write(self, msg):
+
+        await self._ensure_open()
+        msg = msg.rstrip("\r\n") + self.terminator
+        self._writer.write(msg.encode(self.encoding))
+        await self._writer.drain()
+
+    async def _read_line(self, timeout):
+
+        line = await asyncio.wait_for(self._reader.readline(), timeout)
+        if not line:
+            raise ConnectionResetError(f"EOF from {self.host}:{self.port}")
+        return line.decode(self.encoding).rstrip("\r\n")
+
+    async def _read_block(self, timeout):
+        """
+        IEEE 488.2 definite length block `#<n><length><data>`, the terminator is consumed.
+        """
+
+        header = await asyncio.wait_for(self._reader.readexactly(2), timeout)
+        if header[:1] != b"#":
+            raise ValueError(f"Not a binary block from {self.host}: {header!r}")
+
+        n_digits = int(header[1:2])
+        if n_digits == 0:
+            # indefinite length, ends with the terminator
+            data = await asyncio.wait_for(self._reader.readline(), timeout)
+            return data.rstrip(b"\r\n")
+
+        length = int(await asyncio.wait_for(self._reader.readexactly(n_digits), timeout))
+        data = await asyncio.wait_for(self._reader.readexactly(length), timeout)
+        await self._read_line(timeout)
+        return data
+
+    async def _transaction(self, msg, timeout, retry):
+
+        try:
+            await self._write(msg)
+            return await self._read_line(timeout)
+
+        except (ConnectionError, OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            # a late reply would be read by the next query, start from a clean connection
+            await self._drop()
+            if not retry:
+                raise
+
+        await self._write(msg)
+        return await self._read_line(timeout)
+
+    # 2) Usages
+    #================================================================
+    async def connect(self):
+
+        async with self._get_lock():
+            await self._ensure_open()
+
+    async def write(self, msg):
+
+        async with self._get_lock():
+            try:
+                await self._write(msg)
+            except (ConnectionError, OSError):
+                await self._drop()
+                await self._write(msg)
+
+    async def query(self, msg, timeout=None, retry=True):
+
+        timeout = self.timeout if timeout is None else timeout
+        async with self._get_lock():
+            return await self._transaction(msg, timeout, retry)
+
+    async def query_many(self, msgs, timeout=None, retry=True):
+        """
+        Pipelined queries: all lines are sent at once, then one reply line per query is read.
+        """
+
+        timeout = self.timeout if timeout is None else timeout
+        msg = self.terminator.join(m.rstrip("\r\n") for m in msgs)
+
+        async with self._get_lock():
+            for attempt in range(2 if retry else 1):
+                try:
+                    await self._write(msg)
+                    return [await self._read_line(timeout) for _ in msgs]
+                except (ConnectionError, OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    await self._drop()
+                    if attempt == 1 or not retry:
+                        raise
+
+    async def query_block(self, msg, timeout=None):
+        """
+        Query with a binary block reply (e.g. `:TRAC:DATA?` in REAL,32 format), returns bytes.
+        """
+
+        timeout = self.timeout if timeout is None else timeout
+        async with self._get_lock():
+            try:
+                await self._write(msg)
+                return await self._read_block(timeout)
+            except (ConnectionError, OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+                await self._drop()
+                raise
+
+    async def opc(self, timeout=None):
+        """
+        Wait until all pending commands are executed (`*OPC?` replies 1).
+        """
+
+        reply = await self.query("*OPC?", timeout=timeout, retry=False)
+        if reply.strip() != "1":
+            raise RuntimeError(f"Unexpected *OPC? reply from {self.host}: {reply!r}")
+
+    async def close(self):
+
+        async with self._get_lock():
+            await self._drop()
+
+
+class ScpiTransport:
+    """
+    Blocking wrapper of `AsyncScpiTransport` for the existing drivers, the I/O
+    itself runs on the shared `EventLoopThread`. The `_async` variants return
+    a concurrent.futures.Future instead of waiting, `aio` is the async transport
+    for code running on the loop.
+    """
+
+    def __init__(self, host, port, timeout=2.0, terminator="\n", encoding="ascii", connect=True):
+
+        self.aio = AsyncScpiTransport(host, port, timeout, terminator, encoding)
+        self.loop = EventLoopThread.instance()
+
+        if connect:
+            self.connect()
+
+    @property
+    def address(self):
+        return (self.aio.host, self.aio.port)
+
+    def connect(self):
+        self.loop.run(self.aio.connect())
+
+    def write(self, msg):
+        self.loop.run(self.aio.write(msg))
+
+    def query(self, msg, timeout=None, retry=True):
+        return self.loop.run(self.aio.query(msg, timeout, retry))
+
+    def query_many(self, msgs, timeout=None, retry=True):
+        return self.loop.run(self.aio.query_many(msgs, timeout, retry))
+
+    def query_block(self, msg, timeout=None):
+        return self.loop.run(self.aio.query_block(msg, timeout))
+
+    def opc(self, timeout=None):
+        self.loop.run(self.aio.opc(timeout))
+
+    def write_async(self, msg):
+        return self.loop.submit(self.aio.write(msg))
+
+    def query_async(self, msg, timeout=None, retry=True):
+        return self.loop.submit(self.aio.query(msg, timeout, retry))
+
+    def opc_async(self, timeout=None):
+        return self.loop.submit(self.aio.opc(timeout))
+
+    def close(self):
+        self.loop.run(self.aio.close())